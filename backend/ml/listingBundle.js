@@ -0,0 +1,125 @@
+/**
+ * Đọc listing bundle (recommendation_houses.bin + .manifest.json) do scripts/listing_bundle.py ghi
+ * Cột số là Float64Array / Float32Array trỏ thẳng vào buffer, cột string là codes Int32Array
+ * + các giá trị distinct (giải mã UTF-8 1 lần cho mỗi giá trị, không phải mỗi dòng)
+ */
+
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+
+const BUNDLE_FORMAT = 'listing-bundle';
+const BUNDLE_VERSION = 1;
+const TYPED_ARRAYS = {
+  float64: Float64Array,
+  float32: Float32Array,
+  int32: Int32Array,
+  uint32: Uint32Array,
+  uint8: Uint8Array
+};
+
+class ListingBundle {
+  constructor(manifest, buffer, { verify = true } = {}) {
+    if (manifest.format !== BUNDLE_FORMAT || manifest.version !== BUNDLE_VERSION) {
+      throw new Error(`Unsupported listing bundle: ${manifest.format} v${manifest.version}`);
+    }
+    if (buffer.byteLength !== manifest.size) {
+      throw new Error(`Listing bundle has ${buffer.byteLength} bytes, manifest says ${manifest.size}`);
+    }
+
+    if (buffer.byteOffset % 8 !== 0) {
+      // Buffer nhỏ có thể nằm lệch trong pool của Node -> copy sang ArrayBuffer riêng
+      buffer = new Uint8Array(buffer);
+    }
+
+    this.nRows = manifest.n_rows;
+    this.columns = {};
+
+    const segment = (spec) => {
+      const bytes = buffer.subarray(spec.offset, spec.offset + spec.length);
+      if (verify && crypto.createHash('sha256').update(bytes).digest('hex') !== spec.sha256) {
+        throw new Error(`Checksum mismatch in listing bundle segment at offset ${spec.offset}`);
+      }
+      const TypedArray = TYPED_ARRAYS[spec.dtype];
+      // Segment căn 8 byte -> view trực tiếp, không copy
+      return new TypedArray(bytes.buffer, bytes.byteOffset, spec.length / TypedArray.BYTES_PER_ELEMENT);
+    };
+
+    for (const column of manifest.columns) {
+      if (column.kind === 'numeric') {
+        this.columns[column.name] = segment(column.values);
+        continue;
+      }
+      const offsets = segment(column.offsets);
+      const data = segment(column.data);
+      const blob = Buffer.from(data.buffer, data.byteOffset, data.byteLength);
+      const values = new Array(column.n_values);
+      for (let i = 0; i < column.n_values; i++) {
+        values[i] = blob.toString('utf8', offsets[i], offsets[i + 1]);
+      }
+      this.columns[column.name] = { codes: segment(column.codes), values };
+    }
+  }
+
+  /**
+   * 1 dòng dạng object như recommendation_houses.json (NaN / code -1 -> null)
+   */
+  get(i) {
+    const record = {};
+    for (const [name, column] of Object.entries(this.columns)) {
+      record[name] = ListingBundle.valueAt(column, i);
+    }
+    return record;
+  }
+
+  /**
+   * Tất cả dòng dạng object; điền theo từng cột nên mọi object có cùng thứ tự key (cùng hidden class)
+   */
+  toRecords() {
+    const records = new Array(this.nRows);
+    for (let i = 0; i < this.nRows; i++) {
+      records[i] = {};
+    }
+    for (const [name, column] of Object.entries(this.columns)) {
+      if (column.codes) {
+        const { codes, values } = column;
+        for (let i = 0; i < this.nRows; i++) {
+          records[i][name] = codes[i] < 0 ? null : values[codes[i]];
+        }
+      } else {
+        for (let i = 0; i < this.nRows; i++) {
+          const value = column[i];
+          records[i][name] = Number.isNaN(value) ? null : value;
+        }
+      }
+    }
+    return records;
+  }
+
+  static valueAt(column, i) {
+    if (column.codes) {
+      const code = column.codes[i];
+      return code < 0 ? null : column.values[code];
+    }
+    const value = column[i];
+    return Number.isNaN(value) ? null : value;
+  }
+}
+
+function bundlePaths(dir, name) {
+  return [path.join(dir, `${name}.manifest.json`), path.join(dir, `${name}.bin`)];
+}
+
+async function loadListingBundle(dir, name = 'recommendation_houses', options = {}) {
+  const [manifestPath, binPath] = bundlePaths(dir, name);
+  const manifest = JSON.parse(await fs.promises.readFile(manifestPath, 'utf8'));
+  return new ListingBundle(manifest, await fs.promises.readFile(binPath), options);
+}
+
+function loadListingBundleSync(dir, name = 'recommendation_houses', options = {}) {
+  const [manifestPath, binPath] = bundlePaths(dir, name);
+  const manifest = JSON.parse(fs.readFileSync(manifestPath, 'utf8'));
+  return new ListingBundle(manifest, fs.readFileSync(binPath), options);
+}
+
+module.exports = { ListingBundle, loadListingBundle, loadListingBundleSync };
@@ -6,10 +6,14 @@
 const ort = require('onnxruntime-node');
 const fs = require('fs').promises;
 const path = require('path');
+const { ListingBundle, loadListingBundle } = require('./listingBundle');
+
+const fileExists = (filePath) => fs.access(filePath).then(() => true, () => false);
 
 class MLPredictor {
   constructor() {
-    // ONNX models
+    // ONNX models (predictionPipeline = scaler + model trong 1 graph, nếu có)
+    this.predictionPipeline = null;
     this.predictionModel = null;
     this.predictionScaler = null;
 
@@ -17,10 +21,14 @@ class MLPredictor {
     this.predictionFeatures = null;
     this.predictionEncoders = null;
 
-    // Recommendation data
+    // Recommendation (recommendationQuery = scaler + L2 normalize trong 1 graph, nếu có)
+    this.recommendationQuery = null;
     this.recommendationScaler = null;
-    this.recommendationXScaled = null;
+    // recommendation_X_scaled đã L2-normalize theo dòng: { data: Float64Array row-major, rows, cols }
+    this.recommendationUnit = null;
+    // ListingBundle (giữ dạng cột, record chỉ tạo cho nhà được trả về) hoặc mảng record của JSON cũ
     this.recommendationHouses = null;
+    this.nHouses = 0;
     this.recommendationFeatures = null;
     this.recommendationEncoders = null;
 
@@ -44,12 +52,17 @@ class MLPredictor {
     try {
       // Load Price Prediction Models
       console.log('\n--- Loading Price Prediction Models ---');
-      this.predictionModel = await ort.InferenceSession.create(
-        path.join(modelsDir, 'price_prediction_model.onnx')
-      );
-      this.predictionScaler = await ort.InferenceSession.create(
-        path.join(modelsDir, 'price_prediction_scaler.onnx')
-      );
+      const pipelinePath = path.join(modelsDir, 'price_prediction_pipeline.onnx');
+      if (await fileExists(pipelinePath)) {
+        this.predictionPipeline = await ort.InferenceSession.create(pipelinePath);
+      } else {
+        this.predictionModel = await ort.InferenceSession.create(
+          path.join(modelsDir, 'price_prediction_model.onnx')
+        );
+        this.predictionScaler = await ort.InferenceSession.create(
+          path.join(modelsDir, 'price_prediction_scaler.onnx')
+        );
+      }
 
       // Load JSON metadata
       this.predictionFeatures = JSON.parse(
@@ -64,9 +77,14 @@ class MLPredictor {
 
       // Load Recommendation Models & Data
       console.log('\n--- Loading Recommendation Models ---');
-      this.recommendationScaler = await ort.InferenceSession.create(
-        path.join(modelsDir, 'recommendation_scaler.onnx')
-      );
+      const queryPath = path.join(modelsDir, 'recommendation_query.onnx');
+      if (await fileExists(queryPath)) {
+        this.recommendationQuery = await ort.InferenceSession.create(queryPath);
+      } else {
+        this.recommendationScaler = await ort.InferenceSession.create(
+          path.join(modelsDir, 'recommendation_scaler.onnx')
+        );
+      }
 
       this.recommendationFeatures = JSON.parse(
         await fs.readFile(path.join(modelsDir, 'recommendation_features.json'), 'utf8')
@@ -74,17 +92,27 @@ class MLPredictor {
       this.recommendationEncoders = JSON.parse(
         await fs.readFile(path.join(modelsDir, 'recommendation_encoders.json'), 'utf8')
       );
-      this.recommendationHouses = JSON.parse(
-        await fs.readFile(path.join(modelsDir, 'recommendation_houses.json'), 'utf8')
-      );
+      // Listing bundle nhị phân (convert_to_onnx.py mới), JSON cho bản export cũ
+      if (await fileExists(path.join(modelsDir, 'recommendation_houses.manifest.json'))) {
+        this.recommendationHouses = await loadListingBundle(modelsDir);
+        this.nHouses = this.recommendationHouses.nRows;
+      } else {
+        this.recommendationHouses = JSON.parse(
+          await fs.readFile(path.join(modelsDir, 'recommendation_houses.json'), 'utf8')
+        );
+        this.nHouses = this.recommendationHouses.length;
+      }
 
-      // Load pre-scaled features (numpy array)
-      const numpyData = await this.loadNumpyArray(
+      // Load pre-scaled features (numpy array), normalize 1 lần -> cosine = dot product
+      const xScaled = await this.loadNumpyArray(
         path.join(modelsDir, 'recommendation_X_scaled.npy')
       );
-      this.recommendationXScaled = numpyData;
+      for (let i = 0; i < xScaled.rows; i++) {
+        this.l2Normalize(xScaled.data.subarray(i * xScaled.cols, (i + 1) * xScaled.cols));
+      }
+      this.recommendationUnit = xScaled;
 
-      console.log(`✓ KNN data loaded: ${this.recommendationHouses.length} houses`);
+      console.log(`✓ KNN data loaded: ${this.nHouses} houses`);
       console.log(`✓ Features: ${this.recommendationFeatures.length}`);
 
       this.isLoaded = true;
@@ -100,37 +128,74 @@ class MLPredictor {
   }
 
   /**
-   * Load numpy .npy file (simple implementation)
+   * Load numpy .npy file 2 chiều float64 (simple implementation)
+   * Trả về { data: Float64Array row-major, rows, cols }; file fortran_order được chuyển sang row-major
    */
   async loadNumpyArray(filePath) {
     const buffer = await fs.readFile(filePath);
 
     // Parse numpy header (simple version)
-    // Skip header and read float64 array
     const headerLen = buffer.readUInt16LE(8) + 10;
-    const dataBuffer = buffer.slice(headerLen);
-
-    // Convert to Float32Array for ONNX
-    const float64Array = new Float64Array(
-      dataBuffer.buffer,
-      dataBuffer.byteOffset,
-      dataBuffer.byteLength / 8
-    );
-
-    // Determine shape from header
     const headerStr = buffer.slice(10, headerLen).toString();
+    if (!headerStr.includes("'<f8'")) {
+      throw new Error(`Unsupported dtype in ${filePath}: ${headerStr.trim()}`);
+    }
     const shapeMatch = headerStr.match(/'shape':\s*\((\d+),\s*(\d+)\)/);
     const rows = parseInt(shapeMatch[1]);
     const cols = parseInt(shapeMatch[2]);
+    const fortranOrder = /'fortran_order':\s*True/.test(headerStr);
 
-    // Convert to 2D array
-    const array2D = [];
-    for (let i = 0; i < rows; i++) {
-      const row = Array.from(float64Array.slice(i * cols, (i + 1) * cols));
-      array2D.push(row);
+    // Copy ra ArrayBuffer riêng (căn 8 byte, sửa tại chỗ được khi normalize)
+    const raw = new Float64Array(rows * cols);
+    new Uint8Array(raw.buffer).set(buffer.subarray(headerLen, headerLen + raw.byteLength));
+    if (!fortranOrder) {
+      return { data: raw, rows, cols };
     }
 
-    return array2D;
+    const data = new Float64Array(rows * cols);
+    for (let j = 0; j < cols; j++) {
+      for (let i = 0; i < rows; i++) {
+        data[i * cols + j] = raw[j * rows + i];
+      }
+    }
+    return { data, rows, cols };
+  }
+
+  /**
+   * Chuẩn hóa L2 tại chỗ (vector toàn 0 giữ nguyên, giống l2_normalize của ml_api)
+   */
+  l2Normalize(vector) {
+    let sum = 0;
+    for (let i = 0; i < vector.length; i++) {
+      sum += vector[i] * vector[i];
+    }
+    const norm = Math.sqrt(sum);
+    if (norm > 0) {
+      for (let i = 0; i < vector.length; i++) {
+        vector[i] /= norm;
+      }
+    }
+    return vector;
+  }
+
+  /**
+   * Nhà thứ i dạng record (chỉ tạo object cho dòng cần trả về)
+   */
+  houseAt(i) {
+    if (this.recommendationHouses instanceof ListingBundle) {
+      return this.recommendationHouses.get(i);
+    }
+    return this.recommendationHouses[i];
+  }
+
+  /**
+   * 1 cột của nhà thứ i, đọc thẳng từ typed array của bundle
+   */
+  houseValue(i, name) {
+    if (this.recommendationHouses instanceof ListingBundle) {
+      return ListingBundle.valueAt(this.recommendationHouses.columns[name], i);
+    }
+    return this.recommendationHouses[i][name];
   }
 
   /**
@@ -209,12 +274,18 @@ class MLPredictor {
       // Convert to Float32Array và reshape to [1, n_features]
       const inputTensor = new ort.Tensor('float32', Float32Array.from(featureVector), [1, featureVector.length]);
 
-      // Scale features
-      const scalerOutput = await this.predictionScaler.run({ float_input: inputTensor });
-      const scaledTensor = scalerOutput[Object.keys(scalerOutput)[0]];
-
-      // Predict
-      const modelOutput = await this.predictionModel.run({ float_input: scaledTensor });
+      let modelOutput;
+      if (this.predictionPipeline) {
+        // Scale + predict trong 1 lần run
+        modelOutput = await this.predictionPipeline.run({ float_input: inputTensor });
+      } else {
+        // Scale features
+        const scalerOutput = await this.predictionScaler.run({ float_input: inputTensor });
+        const scaledTensor = scalerOutput[Object.keys(scalerOutput)[0]];
+
+        // Predict
+        modelOutput = await this.predictionModel.run({ float_input: scaledTensor });
+      }
       const prediction = modelOutput[Object.keys(modelOutput)[0]].data[0];
 
       // Calculate confidence interval (85% - 115% of predicted price)
@@ -247,35 +318,37 @@ class MLPredictor {
    * Find similar houses based on features
    */
   findSimilarHouses(features, limit = 3) {
-    if (!this.recommendationHouses || this.recommendationHouses.length === 0) {
+    if (!this.recommendationHouses || this.nHouses === 0) {
       return [];
     }
 
+    // Lọc theo index trên cột area / district, không tạo record cho cả bảng
+    const areaDiff = (i) => Math.abs(this.houseValue(i, 'area') - features.area);
+
     // Filter houses with similar area (+/- 30m2) and same district
-    const candidates = this.recommendationHouses.filter(house => {
-      const areaDiff = Math.abs(house.area - features.area);
-      const sameDistrict = features.district && house.district === features.district;
-      return areaDiff <= 30 && sameDistrict;
-    });
+    const candidates = [];
+    if (features.district) {
+      for (let i = 0; i < this.nHouses; i++) {
+        if (areaDiff(i) <= 30 && this.houseValue(i, 'district') === features.district) {
+          candidates.push(i);
+        }
+      }
+    }
 
     // If not enough with same district, expand search
     if (candidates.length < limit) {
-      const moreCandidates = this.recommendationHouses.filter(house => {
-        const areaDiff = Math.abs(house.area - features.area);
-        return areaDiff <= 50;
-      });
-      candidates.push(...moreCandidates);
+      for (let i = 0; i < this.nHouses; i++) {
+        if (areaDiff(i) <= 50) {
+          candidates.push(i);
+        }
+      }
     }
 
     // Sort by area similarity and price
-    candidates.sort((a, b) => {
-      const aDiff = Math.abs(a.area - features.area);
-      const bDiff = Math.abs(b.area - features.area);
-      return aDiff - bDiff;
-    });
+    candidates.sort((a, b) => areaDiff(a) - areaDiff(b));
 
     // Return top N with distance calculation
-    return candidates.slice(0, limit).map(house => ({
+    return candidates.slice(0, limit).map(i => this.houseAt(i)).map(house => ({
       id: house.id,
       price: house.price,
       area: house.area,
@@ -305,26 +378,28 @@ class MLPredictor {
   }
 
   /**
-   * Tính khoảng cách Euclidean giữa 2 vectors
+   * Vector đã L2-normalize của nhà thứ i (view, không copy)
    */
-  euclideanDistance(vec1, vec2) {
-    let sum = 0;
-    for (let i = 0; i < vec1.length; i++) {
-      const diff = vec1[i] - vec2[i];
-      sum += diff * diff;
-    }
-    return Math.sqrt(sum);
+  unitVector(i) {
+    const { data, cols } = this.recommendationUnit;
+    return data.subarray(i * cols, (i + 1) * cols);
   }
 
   /**
    * KNN implementation in pure JavaScript
+   * Cosine distance (1 - dot product với vector đơn vị), như NearestNeighbors(metric='cosine') của notebook
    */
-  findKNearestNeighbors(queryVector, k) {
-    const distances = [];
+  findKNearestNeighbors(queryUnit, k) {
+    const { data, rows, cols } = this.recommendationUnit;
+    const distances = new Array(rows);
 
-    for (let i = 0; i < this.recommendationXScaled.length; i++) {
-      const distance = this.euclideanDistance(queryVector, this.recommendationXScaled[i]);
-      distances.push({ index: i, distance });
+    for (let i = 0; i < rows; i++) {
+      let dot = 0;
+      const offset = i * cols;
+      for (let j = 0; j < cols; j++) {
+        dot += queryUnit[j] * data[offset + j];
+      }
+      distances[i] = { index: i, distance: 1 - dot };
     }
 
     // Sort by distance và lấy k nearest
@@ -340,17 +415,16 @@ class MLPredictor {
       throw new Error('Models not loaded. Call loadModels() first.');
     }
 
-    if (houseId >= this.recommendationXScaled.length || houseId < 0) {
+    if (houseId >= this.nHouses || houseId < 0) {
       throw new Error('House ID not found');
     }
 
     try {
-      const houseFeatures = this.recommendationXScaled[houseId];
-      const neighbors = this.findKNearestNeighbors(houseFeatures, limit + 1);
+      const neighbors = this.findKNearestNeighbors(this.unitVector(houseId), limit + 1);
 
       // Remove first item (itself)
       const recommendations = neighbors.slice(1).map((neighbor, i) => {
-        const house = this.recommendationHouses[neighbor.index];
+        const house = this.houseAt(neighbor.index);
         const similarityScore = 1 - neighbor.distance;
 
         return {
@@ -381,6 +455,20 @@ class MLPredictor {
     }
   }
 
+  /**
+   * Scale + L2 normalize query: 1 lần run recommendation_query.onnx,
+   * hoặc recommendation_scaler.onnx rồi normalize trong JS (export cũ)
+   */
+  async scaleRecommendationQuery(featureVector) {
+    const inputTensor = new ort.Tensor('float32', Float32Array.from(featureVector), [1, featureVector.length]);
+    if (this.recommendationQuery) {
+      const queryOutput = await this.recommendationQuery.run({ float_input: inputTensor });
+      return Float64Array.from(queryOutput[Object.keys(queryOutput)[0]].data);
+    }
+    const scalerOutput = await this.recommendationScaler.run({ float_input: inputTensor });
+    return this.l2Normalize(Float64Array.from(scalerOutput[Object.keys(scalerOutput)[0]].data));
+  }
+
   /**
    * Tính toán features cho recommendation
    */
@@ -431,17 +519,15 @@ class MLPredictor {
       // Create feature vector theo đúng thứ tự
       const featureVector = this.recommendationFeatures.map(name => features[name] || 0);
 
-      // Scale features
-      const inputTensor = new ort.Tensor('float32', Float32Array.from(featureVector), [1, featureVector.length]);
-      const scalerOutput = await this.recommendationScaler.run({ float_input: inputTensor });
-      const scaledData = Array.from(scalerOutput[Object.keys(scalerOutput)[0]].data);
+      // Scale + normalize features
+      const queryUnit = await this.scaleRecommendationQuery(featureVector);
 
       // Find neighbors
       const limit = input.n_recommendations || 5;
-      const neighbors = this.findKNearestNeighbors(scaledData, limit);
+      const neighbors = this.findKNearestNeighbors(queryUnit, limit);
 
       const recommendations = neighbors.map((neighbor, i) => {
-        const house = this.recommendationHouses[neighbor.index];
+        const house = this.houseAt(neighbor.index);
         let similarityScore = 1 - neighbor.distance;
 
         // District bonus
@@ -499,11 +585,11 @@ class MLPredictor {
       status: this.isLoaded ? 'healthy' : 'not loaded',
       service: 'House ML API (Node.js)',
       models: {
-        prediction: this.predictionModel !== null,
+        prediction: this.predictionPipeline !== null || this.predictionModel !== null,
         recommendation: this.recommendationHouses !== null
       },
       data: {
-        total_houses: this.recommendationHouses ? this.recommendationHouses.length : 0
+        total_houses: this.nHouses
       }
     };
   }
@@ -0,0 +1,107 @@
+"""
+CSV vs Parquet vs Arrow IPC for crawled ads: write time, file size, read time.
+
+    python crawler/benchmark_columnar.py --ads 1000000 --out-dir /tmp/columnar
+
+Ads are synthetic (stub_server.synthetic_ads) and go through `_extract_item`, then
+stream into all three writers at once. Reads are timed as a notebook would do them:
+the whole file into pandas, and only price/lat/lng.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from chotot_batch_crawl import _extract_item
+from columnar import DEFAULT_ROW_GROUP_ROWS, SUFFIXES, RowWriter, convert_csv, read_table
+from stub_server import synthetic_ads
+
+
+NUMERIC_COLUMNS = ["price", "lat", "lng"]
+
+
+def synthetic_items(n: int, chunk: int = 50_000) -> Iterator[Dict[str, Any]]:
+    for start in range(0, n, chunk):
+        ads = synthetic_ads(min(chunk, n - start), seed=start, start_id=150_000_000 - start)
+        for i, ad in enumerate(ads):
+            item = _extract_item(ad)
+            item["page"] = (start + i) // 20
+            yield item
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Benchmark typed columnar crawl output against CSV.")
+    p.add_argument("--ads", type=int, default=1_000_000)
+    p.add_argument("--row-group-rows", type=int, default=DEFAULT_ROW_GROUP_ROWS)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--out-dir", default="/tmp/chotot_columnar")
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import pyarrow as pa
+
+    args = build_arg_parser().parse_args(argv)
+    out_dir = Path(args.out_dir)
+    paths = {fmt: out_dir / f"ads{suffix}" for fmt, suffix in SUFFIXES.items()}
+
+    writers = {fmt: RowWriter(path, fmt=fmt, row_group_rows=args.row_group_rows) for fmt, path in paths.items()}
+    write_s = dict.fromkeys(writers, 0.0)
+    for item in synthetic_items(args.ads):
+        for fmt, writer in writers.items():
+            start = time.perf_counter()
+            writer.write(item)
+            write_s[fmt] += time.perf_counter() - start
+    for fmt, writer in writers.items():
+        start = time.perf_counter()
+        writer.close()
+        write_s[fmt] += time.perf_counter() - start
+    print(f"{args.ads:,} ads, row groups of {args.row_group_rows:,} rows "
+          f"(arrow pool peak {pa.default_memory_pool().max_memory() / 1e6:.1f} MB)\n")
+
+    reads = {
+        "csv": (lambda: pd.read_csv(paths["csv"]), lambda: pd.read_csv(paths["csv"], usecols=NUMERIC_COLUMNS)),
+        "parquet": (lambda: read_table(paths["parquet"]).to_pandas(),
+                    lambda: pd.read_parquet(paths["parquet"], columns=NUMERIC_COLUMNS)),
+        "arrow": (lambda: read_table(paths["arrow"]).to_pandas(),
+                  lambda: read_table(paths["arrow"]).select(NUMERIC_COLUMNS).to_pandas()),
+    }
+    csv_size = paths["csv"].stat().st_size
+    csv_read = None
+    print(f"{'format':<8} {'size MB':>9} {'vs csv':>7} {'write s':>8} {'read all s':>11} {'vs csv':>7} {'read 3 cols s':>14}")
+    for fmt, (read_all, read_cols) in reads.items():
+        size = paths[fmt].stat().st_size
+        all_s = best_of(args.repeat, read_all)
+        cols_s = best_of(args.repeat, read_cols)
+        csv_read = csv_read or all_s
+        print(f"{fmt:<8} {size / 1e6:>9.1f} {size / csv_size:>6.2f}x {write_s[fmt]:>8.1f} {all_s:>11.2f} "
+              f"{all_s / csv_read:>6.2f}x {cols_s:>14.2f}")
+
+    df = pd.read_csv(paths["csv"], usecols=NUMERIC_COLUMNS + ["pty_characteristics"], nrows=1)
+    print(f"\ncsv dtypes after read: {dict(df.dtypes.astype(str))}")
+    typed = pd.read_parquet(paths["parquet"], columns=list(df.columns))
+    print(f"parquet dtypes:        {dict(typed.dtypes.astype(str))}")
+
+    start = time.perf_counter()
+    converted = convert_csv([paths["csv"]], out_dir / "converted.parquet", row_group_rows=args.row_group_rows)
+    print(f"\nconvert csv -> parquet: {converted.rows:,} rows in {time.perf_counter() - start:.1f} s "
+          f"(nulls from bad values: {converted.invalid or 'none'})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
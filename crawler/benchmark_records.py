@@ -0,0 +1,149 @@
+"""
+Slotted AdRecord vs the previous 35-key dicts on a recorded page fixture.
+
+    python crawler/benchmark_records.py --pages 1000 --fixture-dir /tmp/chotot_fixture
+
+The fixture is recorded once by running the crawler (`record_dir`) against the stub
+server, then replayed from the parsed JSON so only extraction and writing are timed.
+Memory is what the extracted rows of one pass keep alive (tracemalloc), i.e. the
+per-row container overhead; the strings themselves are shared with the page JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from chotot_batch_crawl import CrawlConfig, _extract_item, crawl_chotot_items
+from columnar import RowWriter
+from stub_server import StubServer, load_recorded_pages, synthetic_ads
+
+
+def _extract_item_dict(ad: Dict[str, Any]) -> Dict[str, Any]:
+    """`_extract_item` as it was before AdRecord (baseline)."""
+    return {
+        "id": ad.get("ad_id"),
+        "title": ad.get("subject"),
+        "price": ad.get("price"),
+        "area": ad.get("size"),
+        "date": ad.get("list_time"),
+        "city": ad.get("region_name"),
+        "district": ad.get("area_name"),
+        "ward": ad.get("ward_name"),
+        "street": ad.get("street_name"),
+        "address": ad.get("address"),
+        "lat": ad.get("latitude"),
+        "lng": ad.get("longitude"),
+        "body": ad.get("body"),
+        "rooms": ad.get("rooms"),
+        "toilets": ad.get("toilets"),
+        "floors": ad.get("floors"),
+        "legal": ad.get("property_legal_document"),
+        "furniture": ad.get("furnishing_sell"),
+        "house_type": ad.get("property_road_type"),
+        "direction": ad.get("direction"),
+        "living_size": ad.get("living_size"),
+        "seller_type": ad.get("company_ad", False),
+        "protection": ad.get("protection_entitlement"),
+        "image_count": len(ad.get("images", []) or []),
+        "image_thumb": ad.get("image"),
+        "property_type": ad.get("property_type"),
+        "width": ad.get("width"),
+        "length": ad.get("length"),
+        "num_floors": ad.get("num_floors"),
+        "alley_width": ad.get("alley_width"),
+        "pty_characteristics": ad.get("pty_characteristics"),
+        "owner_type": ad.get("company_ad"),
+        "is_pro": ad.get("company_ad", False),
+        "verified": ad.get("protection_entitlement"),
+    }
+
+
+def record_fixture(fixture_dir: Path, pages: int, limit_per_page: int) -> None:
+    ads = synthetic_ads(pages * limit_per_page)
+    with StubServer(ads=ads) as server:
+        cfg = CrawlConfig(
+            region_v2=13000, start_page=0, limit_pages=pages, batch_pages=pages, limit_per_page=limit_per_page,
+            min_sleep_s=0.0, max_sleep_s=0.0, timeout_s=30.0, api_url=server.url, record_dir=str(fixture_dir),
+        )
+        for _ in crawl_chotot_items(cfg):
+            pass
+
+
+def extract_all(pages: List[List[Dict[str, Any]]], extract: Callable[[Dict[str, Any]], Any]) -> List[Any]:
+    items = []
+    for page, ads in enumerate(pages):
+        for ad in ads:
+            item = extract(ad)
+            item["page"] = page
+            items.append(item)
+    return items
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Benchmark AdRecord against dict rows on recorded pages.")
+    p.add_argument("--pages", type=int, default=1000)
+    p.add_argument("--limit-per-page", type=int, default=20)
+    p.add_argument("--fixture-dir", default="/tmp/chotot_fixture")
+    p.add_argument("--repeat", type=int, default=5)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    fixture_dir = Path(args.fixture_dir)
+    if len(list(fixture_dir.glob("region*_o*_l*.json"))) < args.pages:
+        print(f"Recording {args.pages} pages to {fixture_dir} ...")
+        record_fixture(fixture_dir, args.pages, args.limit_per_page)
+    recorded = load_recorded_pages(fixture_dir)
+    pages = [page["ads"] for _, page in sorted(recorded.items())][:args.pages]
+    n_ads = sum(len(ads) for ads in pages)
+    print(f"{len(pages)} pages, {n_ads:,} ads\n")
+
+    variants = {"dict": _extract_item_dict, "AdRecord": _extract_item}
+    if [dict(item) for item in extract_all(pages, _extract_item)] != extract_all(pages, _extract_item_dict):
+        raise SystemExit("AdRecord rows differ from the dict rows")
+
+    print(f"{'rows':<9} {'extract ads/s':>14} {'bytes/row':>10} {'gc.collect ms':>14} "
+          f"{'csv ads/s':>10} {'parquet ads/s':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, extract in variants.items():
+            extract_s = best_of(args.repeat, lambda: extract_all(pages, extract))
+
+            gc.collect()
+            tracemalloc.start()
+            items = extract_all(pages, extract)
+            retained, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            gc_s = best_of(args.repeat, gc.collect)
+
+            write = {}
+            for fmt in ("csv", "parquet"):
+                def run() -> None:
+                    with RowWriter(Path(tmp) / f"{name}.{fmt}", fmt=fmt) as writer:
+                        writer.write_many(extract_all(pages, extract))
+                write[fmt] = best_of(args.repeat, run)
+            del items
+
+            per_row = retained / n_ads
+            print(f"{name:<9} {n_ads / extract_s:>14,.0f} {per_row:>10.0f} {gc_s * 1000:>14.1f} "
+                  f"{n_ads / write['csv']:>10,.0f} {n_ads / write['parquet']:>14,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
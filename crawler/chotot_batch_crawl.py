@@ -1,16 +1,24 @@
 from __future__ import annotations
 
 import argparse
-import csv
+import asyncio
+import dataclasses
+import json
+import os
 import random
 import time
-from dataclasses import dataclass
-from datetime import datetime
+from contextlib import aclosing, nullcontext
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 
+from columnar import DEFAULT_ROW_GROUP_ROWS, FORMATS, SUFFIXES, AdRecord, RowWriter
+from seen_index import SeenIndex
+
 
 API = "https://gateway.chotot.com/v1/public/ad-listing"
 
@@ -31,6 +39,12 @@ class CrawlConfig:
     min_sleep_s: float
     max_sleep_s: float
     timeout_s: float
+    # concurrency > 0 switches to the asyncio crawler (N pages in flight, token bucket instead of sleeps)
+    concurrency: int = 0
+    rate_per_s: float = 4.0
+    max_retries: int = 5
+    api_url: str = API
+    record_dir: Optional[str] = None
 
 
 def _now_tag() -> str:
@@ -54,9 +68,10 @@ def _fetch_ads(
     offset: int,
     limit: int,
     timeout_s: float,
+    api_url: str = API,
 ) -> Dict[str, Any]:
     params = {"region_v2": region_v2, "cg": 1000, "o": offset, "limit": limit}
-    r = session.get(API, params=params, timeout=timeout_s)
+    r = session.get(api_url, params=params, timeout=timeout_s)
     r.raise_for_status()
     data = r.json()
     if not isinstance(data, dict):
@@ -64,46 +79,47 @@ def _fetch_ads(
     return data
 
 
-def _extract_item(ad: Dict[str, Any]) -> Dict[str, Any]:
-    return {
-        "id": ad.get("ad_id"),
-        "title": ad.get("subject"),
-        "price": ad.get("price"),
-        "area": ad.get("size"),
-        "date": ad.get("list_time"),
-        "city": ad.get("region_name"),
-        "district": ad.get("area_name"),
-        "ward": ad.get("ward_name"),
-        "street": ad.get("street_name"),
-        "address": ad.get("address"),
-        "lat": ad.get("latitude"),
-        "lng": ad.get("longitude"),
-        "body": ad.get("body"),
-        "rooms": ad.get("rooms"),
-        "toilets": ad.get("toilets"),
-        "floors": ad.get("floors"),
-        "legal": ad.get("property_legal_document"),
-        "furniture": ad.get("furnishing_sell"),
-        "house_type": ad.get("property_road_type"),
-        "direction": ad.get("direction"),
-        "living_size": ad.get("living_size"),
-        "seller_type": ad.get("company_ad", False),
-        "protection": ad.get("protection_entitlement"),
-        "image_count": len(ad.get("images", []) or []),
-        "image_thumb": ad.get("image"),
-        "property_type": ad.get("property_type"),
-        "width": ad.get("width"),
-        "length": ad.get("length"),
-        "num_floors": ad.get("num_floors"),
-        "alley_width": ad.get("alley_width"),
-        "pty_characteristics": ad.get("pty_characteristics"),
-        "owner_type": ad.get("company_ad"),
-        "is_pro": ad.get("company_ad", False),
-        "verified": ad.get("protection_entitlement"),
-    }
-
-
-def crawl_chotot_items(cfg: CrawlConfig, *, headers: Optional[Dict[str, str]] = None) -> Iterable[Dict[str, Any]]:
+def _extract_item(ad: Dict[str, Any]) -> AdRecord:
+    # Positional: ~4x cheaper than 35 keyword arguments on the per-ad hot path
+    return AdRecord(
+        ad.get("ad_id"),  # id
+        ad.get("subject"),  # title
+        ad.get("price"),  # price
+        ad.get("size"),  # area
+        ad.get("list_time"),  # date
+        ad.get("region_name"),  # city
+        ad.get("area_name"),  # district
+        ad.get("ward_name"),  # ward
+        ad.get("street_name"),  # street
+        ad.get("address"),  # address
+        ad.get("latitude"),  # lat
+        ad.get("longitude"),  # lng
+        ad.get("body"),  # body
+        ad.get("rooms"),  # rooms
+        ad.get("toilets"),  # toilets
+        ad.get("floors"),  # floors
+        ad.get("property_legal_document"),  # legal
+        ad.get("furnishing_sell"),  # furniture
+        ad.get("property_road_type"),  # house_type
+        ad.get("direction"),  # direction
+        ad.get("living_size"),  # living_size
+        ad.get("company_ad", False),  # seller_type
+        ad.get("protection_entitlement"),  # protection
+        len(ad.get("images", []) or []),  # image_count
+        ad.get("image"),  # image_thumb
+        ad.get("property_type"),  # property_type
+        ad.get("width"),  # width
+        ad.get("length"),  # length
+        ad.get("num_floors"),  # num_floors
+        ad.get("alley_width"),  # alley_width
+        ad.get("pty_characteristics"),  # pty_characteristics
+        ad.get("company_ad"),  # owner_type
+        ad.get("company_ad", False),  # is_pro
+        ad.get("protection_entitlement"),  # verified
+    )
+
+
+def crawl_chotot_items(cfg: CrawlConfig, *, headers: Optional[Dict[str, str]] = None) -> Iterable[AdRecord]:
     session = requests.Session()
     session.headers.update(DEFAULT_HEADERS)
     if headers:
@@ -117,7 +133,9 @@ def crawl_chotot_items(cfg: CrawlConfig, *, headers: Optional[Dict[str, str]] =
             offset=offset,
             limit=cfg.limit_per_page,
             timeout_s=cfg.timeout_s,
+            api_url=cfg.api_url,
         )
+        _record_page(cfg.record_dir, cfg.region_v2, offset, cfg.limit_per_page, data)
         ads = data.get("ads", [])
         if not ads:
             break
@@ -127,63 +145,460 @@ def crawl_chotot_items(cfg: CrawlConfig, *, headers: Optional[Dict[str, str]] =
         for ad in ads:
             if isinstance(ad, dict):
                 item = _extract_item(ad)
-                item["page"] = p
+                item.page = p
                 yield item
 
         _polite_sleep(cfg.min_sleep_s, cfg.max_sleep_s)
 
 
-def write_csv(path: Path, rows: List[Dict[str, Any]]) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    keys: List[str] = []
-    seen = set()
-    for r in rows:
-        for k in r.keys():
-            if k not in seen:
-                seen.add(k)
-                keys.append(k)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _record_path(record_dir: str, region_v2: int, offset: int, limit: int) -> Path:
+    return Path(record_dir) / f"region{region_v2}_o{offset}_l{limit}.json"
 
-    with path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=keys)
-        w.writeheader()
-        w.writerows(rows)
 
+def _record_page(record_dir: Optional[str], region_v2: int, offset: int, limit: int, data: Dict[str, Any]) -> None:
+    if not record_dir:
+        return
+    path = _record_path(record_dir, region_v2, offset, limit)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as delay seconds or an HTTP date; None if absent/invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Request rate limiter shared by all in-flight pages (one event loop, no locking).
+
+    Refills at `rate` tokens/s up to `burst`. On 429/5xx the rate is halved (down to
+    `min_rate`) and all requests wait for Retry-After; every success adds back 5% of
+    the configured rate (AIMD).
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: Optional[float] = None) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoffs = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def backoff(self, delay_s: float) -> None:
+        self.backoffs += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = max(self.blocked_until, self.updated + delay_s)
+
+    def success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+async def _fetch_ads_async(
+    client: Any,
+    limiter: TokenBucket,
+    *,
+    api_url: str,
+    region_v2: int,
+    offset: int,
+    limit: int,
+    max_retries: int,
+) -> Dict[str, Any]:
+    params = {"region_v2": region_v2, "cg": 1000, "o": offset, "limit": limit}
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        r = await client.get(api_url, params=params)
+        if r.status_code in RETRY_STATUSES and attempt < max_retries:
+            delay = _parse_retry_after(r.headers.get("Retry-After"))
+            if delay is None:
+                delay = min(60.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            limiter.backoff(delay)
+            continue
+        r.raise_for_status()
+        limiter.success()
+        data = r.json()
+        if not isinstance(data, dict):
+            raise ValueError("Unexpected API response (not a JSON object)")
+        return data
+    raise RuntimeError("unreachable")
+
+
+def _page_items(data: Dict[str, Any], page: int) -> List[AdRecord]:
+    ads = data.get("ads", [])
+    if not isinstance(ads, list):
+        raise ValueError("Unexpected API response: 'ads' is not a list")
+    items = []
+    for ad in ads:
+        if isinstance(ad, dict):
+            item = _extract_item(ad)
+            item.page = page
+            items.append(item)
+    return items
+
+
+def _async_client(timeout_s: float, connections: int, headers: Optional[Dict[str, str]] = None) -> Any:
+    import httpx
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    return httpx.AsyncClient(headers={**DEFAULT_HEADERS, **(headers or {})}, limits=limits, timeout=timeout_s)
+
+
+async def crawl_chotot_pages_async(
+    cfg: CrawlConfig,
+    *,
+    headers: Optional[Dict[str, str]] = None,
+    client: Any = None,
+    limiter: Optional[TokenBucket] = None,
+    budget: Optional[asyncio.Semaphore] = None,
+) -> AsyncIterator[Tuple[int, List[AdRecord]]]:
+    """
+    Yield (page, items) in page order with up to cfg.concurrency pages in flight.
+
+    Pages are fetched over a fixed pool of keep-alive connections; a page that comes
+    back early is held until every earlier page has been yielded, so the output is the
+    same as the sequential crawler. Stops at the first page without ads.
+
+    `client`, `limiter` and `budget` (a semaphore bounding requests across crawls) can
+    be shared between several regions; by default each crawl gets its own.
+    """
+    concurrency = max(1, cfg.concurrency)
+    if client is None:
+        async with _async_client(cfg.timeout_s, concurrency, headers) as own_client:
+            async with aclosing(crawl_chotot_pages_async(cfg, client=own_client, limiter=limiter, budget=budget)) as pages:
+                async for page, items in pages:
+                    yield page, items
+        return
 
-def run_batched(cfg: CrawlConfig, *, out_dir: Path, out_prefix: str = "chotot") -> List[Path]:
+    limiter = limiter or TokenBucket(cfg.rate_per_s)
+    end_page = cfg.start_page + cfg.limit_pages
+
+    async def fetch(page: int) -> Dict[str, Any]:
+        offset = page * cfg.limit_per_page
+        async with budget or nullcontext():
+            data = await _fetch_ads_async(
+                client,
+                limiter,
+                api_url=cfg.api_url,
+                region_v2=cfg.region_v2,
+                offset=offset,
+                limit=cfg.limit_per_page,
+                max_retries=cfg.max_retries,
+            )
+        _record_page(cfg.record_dir, cfg.region_v2, offset, cfg.limit_per_page, data)
+        return data
+
+    in_flight: Dict[int, asyncio.Task] = {}
+    next_page = cfg.start_page
+    try:
+        for page in range(cfg.start_page, end_page):
+            while next_page < end_page and len(in_flight) < concurrency:
+                in_flight[next_page] = asyncio.create_task(fetch(next_page))
+                next_page += 1
+            data = await in_flight.pop(page)
+            items = _page_items(data, page)
+            if not data.get("ads"):
+                break
+            yield page, items
+    finally:
+        for task in in_flight.values():
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight.values(), return_exceptions=True)
+
+
+def crawl_chotot_items_concurrent(cfg: CrawlConfig, *, headers: Optional[Dict[str, str]] = None) -> Iterator[AdRecord]:
+    """Synchronous view of crawl_chotot_pages_async (drives its own event loop)."""
+    loop = asyncio.new_event_loop()
+    pages = crawl_chotot_pages_async(cfg, headers=headers)
+    try:
+        while True:
+            try:
+                _, items = loop.run_until_complete(pages.__anext__())
+            except StopAsyncIteration:
+                break
+            yield from items
+    finally:
+        loop.run_until_complete(pages.aclose())
+        loop.close()
+
+
+def run_batched(
+    cfg: CrawlConfig,
+    *,
+    out_dir: Path,
+    out_prefix: str = "chotot",
+    fmt: str = "csv",
+    row_group_rows: int = DEFAULT_ROW_GROUP_ROWS,
+) -> List[Path]:
     written: List[Path] = []
-    batch_rows: List[Dict[str, Any]] = []
+    writer: Optional[RowWriter] = None
 
     batch_start_page = cfg.start_page
     last_seen_page: Optional[int] = None
 
+    def batch_path(end_page: Any) -> Path:
+        return out_dir / f"{out_prefix}_region{cfg.region_v2}_p{batch_start_page}-{end_page}_{_now_tag()}{SUFFIXES[fmt]}"
+
     def flush() -> None:
-        nonlocal batch_rows, written, batch_start_page, last_seen_page
-        if not batch_rows:
+        nonlocal writer, batch_start_page, last_seen_page
+        if writer is None:
             return
         end_page = last_seen_page if last_seen_page is not None else (batch_start_page + cfg.batch_pages - 1)
-        out_path = out_dir / f"{out_prefix}_region{cfg.region_v2}_p{batch_start_page}-{end_page}_{_now_tag()}.csv"
-        write_csv(out_path, batch_rows)
-        written.append(out_path)
-        batch_rows = []
+        written.append(writer.close(batch_path(end_page)))
+        writer = None
         batch_start_page = (end_page + 1)
         last_seen_page = None
 
-    for item in crawl_chotot_items(cfg):
-        batch_rows.append(item)
-        p = item.get("page")
-        if isinstance(p, int):
-            last_seen_page = p
-            pages_in_batch = (p - batch_start_page + 1)
-            if pages_in_batch >= cfg.batch_pages:
+    items = crawl_chotot_items_concurrent(cfg) if cfg.concurrency > 0 else crawl_chotot_items(cfg)
+    try:
+        for item in items:
+            p = item.get("page")
+            # Flush on the page boundary so a page is never split across two files
+            if isinstance(p, int) and p - batch_start_page + 1 > cfg.batch_pages:
                 flush()
+            if writer is None:
+                writer = RowWriter(batch_path("open"), fmt=fmt, row_group_rows=row_group_rows)
+            writer.write(item)
+            if isinstance(p, int):
+                last_seen_page = p
+    except BaseException:
+        # Keep the pages that were fully written before the failure
+        flush()
+        raise
 
     flush()
     return written
 
 
+@dataclass
+class RegionCheckpoint:
+    region_v2: int
+    next_page: int
+    files: List[str] = field(default_factory=list)
+    pages: int = 0
+    ads: int = 0
+    known: int = 0
+    elapsed_s: float = 0.0
+    done: bool = False
+    stop_reason: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def pages_per_s(self) -> float:
+        return self.pages / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    @property
+    def ads_per_s(self) -> float:
+        return self.ads / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+
+class CrawlCheckpoint:
+    """
+    Per-region progress in one JSON file, rewritten atomically after every committed batch.
+
+    A page counts as committed only once its CSV is on disk, so a rerun resumes from
+    `next_page` without losing or duplicating rows.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+    def load(self) -> Dict[int, RegionCheckpoint]:
+        if not self.path.exists():
+            return {}
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        return {int(region): RegionCheckpoint(**state) for region, state in data.get("regions", {}).items()}
+
+    def save(self, states: Dict[int, RegionCheckpoint]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"updated": datetime.now().isoformat(timespec="seconds"),
+                   "regions": {str(region): asdict(state) for region, state in sorted(states.items())}}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def _page_is_stale(items: List[AdRecord], cutoff_ms: Optional[float]) -> bool:
+    if cutoff_ms is None:
+        return False
+    times = [item["date"] for item in items if isinstance(item.get("date"), (int, float))]
+    return bool(times) and max(times) < cutoff_ms
+
+
+async def crawl_regions_async(
+    cfg: CrawlConfig,
+    regions: List[int],
+    *,
+    out_dir: Path,
+    out_prefix: str = "chotot",
+    checkpoint_path: Optional[Path] = None,
+    max_in_flight: int = 16,
+    stale_after_days: float = 0.0,
+    seen_index: Optional[SeenIndex] = None,
+    stop_after_known_pages: int = 3,
+    fmt: str = "csv",
+    row_group_rows: int = DEFAULT_ROW_GROUP_ROWS,
+    headers: Optional[Dict[str, str]] = None,
+) -> Dict[int, RegionCheckpoint]:
+    """
+    Crawl several regions in parallel, resuming from (and updating) a durable checkpoint.
+
+    All regions share one connection pool, one TokenBucket and a global budget of
+    `max_in_flight` requests; each region keeps up to cfg.concurrency pages in flight.
+    A region stops at the page limit, at an empty page, or when a whole page is older
+    than `stale_after_days`.
+
+    With a `seen_index` the crawl is incremental: only new or changed ads are written,
+    a region stops after `stop_after_known_pages` consecutive pages of known ads, and
+    a region finished by an earlier run starts over from cfg.start_page.
+    """
+    store = CrawlCheckpoint(checkpoint_path or out_dir / f"{out_prefix}_checkpoint.json")
+    states = store.load()
+    limiter = TokenBucket(cfg.rate_per_s)
+    budget = asyncio.Semaphore(max_in_flight)
+    end_page = cfg.start_page + cfg.limit_pages
+    cutoff_ms = (time.time() - stale_after_days * 86400) * 1000 if stale_after_days > 0 else None
+
+    async def run_region(client: Any, region: int) -> None:
+        state = states.setdefault(region, RegionCheckpoint(region_v2=region, next_page=cfg.start_page))
+        if state.done and seen_index is not None:
+            state = states[region] = RegionCheckpoint(region_v2=region, next_page=cfg.start_page)
+        if state.done:
+            return
+        state.error = None
+        region_cfg = dataclasses.replace(
+            cfg, region_v2=region, start_page=state.next_page, limit_pages=max(0, end_page - state.next_page)
+        )
+        started = time.perf_counter()
+        elapsed_before = state.elapsed_s
+        writer: Optional[RowWriter] = None
+        batch_start = state.next_page
+        last_page: Optional[int] = None
+        # Uncommitted ad_id -> list_time, so an ad repeated on the next page is not written twice
+        pending: Dict[int, Optional[int]] = {}
+        known_streak = 0
+
+        def commit(done: bool = False, reason: Optional[str] = None) -> None:
+            nonlocal writer, batch_start
+            if writer is not None and writer.rows:
+                out_path = writer.close(out_dir / f"{out_prefix}_region{region}_p{batch_start}-{last_page}_{_now_tag()}{SUFFIXES[fmt]}")
+                state.files.append(str(out_path))
+                state.ads += writer.rows
+                if seen_index is not None:
+                    seen_index.add(({"id": ad_id, "date": list_time} for ad_id, list_time in pending.items()), region_v2=region)
+            elif writer is not None:
+                writer.abort()
+            writer = None
+            pending.clear()
+            if last_page is not None and last_page >= batch_start:
+                state.pages += last_page - batch_start + 1
+                state.next_page = last_page + 1
+            state.elapsed_s = elapsed_before + time.perf_counter() - started
+            state.done = done
+            state.stop_reason = reason
+            store.save(states)
+            batch_start = state.next_page
+
+        reason = "empty"
+        try:
+            async with aclosing(crawl_chotot_pages_async(region_cfg, client=client, limiter=limiter, budget=budget)) as pages:
+                async for page, items in pages:
+                    if _page_is_stale(items, cutoff_ms):
+                        reason = "stale"
+                        break
+                    if seen_index is not None:
+                        fresh = seen_index.unseen(items, pending)
+                        state.known += len(items) - len(fresh)
+                        known_streak = 0 if fresh else known_streak + 1
+                        pending.update((item["id"], item.get("date")) for item in fresh if item.get("id") is not None)
+                        items = fresh
+                    if items and writer is None:
+                        writer = RowWriter(out_dir / f"{out_prefix}_region{region}_p{batch_start}-open{SUFFIXES[fmt]}",
+                                           fmt=fmt, row_group_rows=row_group_rows)
+                    if writer is not None:
+                        writer.write_many(items)
+                    last_page = page
+                    if seen_index is not None and known_streak >= stop_after_known_pages:
+                        reason = "known"
+                        break
+                    if page - batch_start + 1 >= cfg.batch_pages:
+                        commit()
+                else:
+                    if (last_page if last_page is not None else state.next_page - 1) >= end_page - 1:
+                        reason = "limit"
+        except Exception as e:
+            # Pages before the failure are committed; the rerun retries from the failed page
+            commit()
+            state.error = f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+            store.save(states)
+            raise
+        commit(done=True, reason=reason)
+
+    async with _async_client(cfg.timeout_s, max_in_flight, headers) as client:
+        results = await asyncio.gather(*(run_region(client, region) for region in regions), return_exceptions=True)
+    for region, result in zip(regions, results):
+        if isinstance(result, Exception):
+            print(f"region {region} failed: {states[region].error}")
+    return {region: states[region] for region in regions}
+
+
+def run_regions(cfg: CrawlConfig, regions: List[int], **kwargs: Any) -> Dict[int, RegionCheckpoint]:
+    return asyncio.run(crawl_regions_async(cfg, regions, **kwargs))
+
+
+def print_region_report(states: Dict[int, RegionCheckpoint]) -> None:
+    print(f"{'region':>8} {'pages':>7} {'ads':>8} {'known':>8} {'seconds':>9} {'pages/s':>8} {'ads/s':>8}  status")
+    for region, state in states.items():
+        status = state.stop_reason if state.done else f"incomplete (next page {state.next_page})"
+        if state.error:
+            status += f" - {state.error}"
+        print(f"{region:>8} {state.pages:>7} {state.ads:>8} {state.known:>8} {state.elapsed_s:>9.1f} "
+              f"{state.pages_per_s:>8.2f} {state.ads_per_s:>8.1f}  {status}")
+
+
 def build_arg_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="Crawl Chợ Tốt API and checkpoint CSV every N pages.")
-    p.add_argument("--region", type=int, required=True, help="region_v2 (e.g. 13000)")
+    p.add_argument("--region", type=int, nargs="+", required=True,
+                   help="region_v2 (e.g. 13000); several regions run in parallel with a checkpoint")
     p.add_argument("--start-page", type=int, default=0)
     p.add_argument("--limit-pages", type=int, default=200)
     p.add_argument("--batch-pages", type=int, default=200, help="Write 1 CSV per N pages")
@@ -191,6 +606,24 @@ def build_arg_parser() -> argparse.ArgumentParser:
     p.add_argument("--min-sleep", type=float, default=1.0)
     p.add_argument("--max-sleep", type=float, default=3.0)
     p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--concurrency", type=int, default=0, help="Pages in flight (asyncio crawler); 0 = sequential with sleeps")
+    p.add_argument("--rate", type=float, default=4.0, help="Max requests/s for the concurrent crawler")
+    p.add_argument("--max-retries", type=int, default=5, help="Retries per page on 429/5xx")
+    p.add_argument("--api-url", default=API, help="ad-listing endpoint (e.g. a local stub server)")
+    p.add_argument("--record-dir", default=None, help="Also save every raw page JSON here (replayable by crawler/stub_server.py)")
+    p.add_argument("--checkpoint", default=None,
+                   help="Checkpoint JSON for resumable multi-region crawls (default: <out-dir>/<prefix>_checkpoint.json)")
+    p.add_argument("--max-in-flight", type=int, default=16, help="Global request budget across regions")
+    p.add_argument("--stale-after-days", type=float, default=0.0,
+                   help="Stop a region at the first page whose newest ad is older than this (0 = off)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Write only ads not in the seen index and stop after --stop-after-known pages of known ads")
+    p.add_argument("--seen-index", default=None, help="SQLite seen-ads index (default: <out-dir>/seen_ads.sqlite)")
+    p.add_argument("--stop-after-known", type=int, default=3,
+                   help="Incremental mode: consecutive pages of known, unchanged ads before a region stops")
+    p.add_argument("--format", choices=FORMATS, default="csv", help="Output file format (parquet/arrow need pyarrow)")
+    p.add_argument("--row-group-rows", type=int, default=DEFAULT_ROW_GROUP_ROWS,
+                   help="Rows buffered per parquet row group / arrow record batch")
     p.add_argument("--out-dir", default="data")
     p.add_argument("--out-prefix", default="chotot")
     return p
@@ -199,7 +632,7 @@ def build_arg_parser() -> argparse.ArgumentParser:
 def main(argv: Optional[List[str]] = None) -> int:
     args = build_arg_parser().parse_args(argv)
     cfg = CrawlConfig(
-        region_v2=args.region,
+        region_v2=args.region[0],
         start_page=args.start_page,
         limit_pages=args.limit_pages,
         batch_pages=args.batch_pages,
@@ -207,8 +640,35 @@ def main(argv: Optional[List[str]] = None) -> int:
         min_sleep_s=args.min_sleep,
         max_sleep_s=args.max_sleep,
         timeout_s=args.timeout,
+        concurrency=args.concurrency,
+        rate_per_s=args.rate,
+        max_retries=args.max_retries,
+        api_url=args.api_url,
+        record_dir=args.record_dir,
     )
-    paths = run_batched(cfg, out_dir=Path(args.out_dir), out_prefix=args.out_prefix)
+    if len(args.region) > 1 or args.checkpoint or args.stale_after_days > 0 or args.incremental:
+        seen_index = SeenIndex(Path(args.seen_index or Path(args.out_dir) / "seen_ads.sqlite")) if args.incremental else None
+        states = run_regions(
+            dataclasses.replace(cfg, concurrency=max(1, cfg.concurrency)),
+            args.region,
+            out_dir=Path(args.out_dir),
+            out_prefix=args.out_prefix,
+            checkpoint_path=Path(args.checkpoint) if args.checkpoint else None,
+            max_in_flight=args.max_in_flight,
+            stale_after_days=args.stale_after_days,
+            seen_index=seen_index,
+            stop_after_known_pages=args.stop_after_known,
+            fmt=args.format,
+            row_group_rows=args.row_group_rows,
+        )
+        if seen_index is not None:
+            print(f"Seen index: {len(seen_index)} ads in {seen_index.path}")
+            seen_index.close()
+        print_region_report(states)
+        return 0 if all(state.done for state in states.values()) else 1
+
+    paths = run_batched(cfg, out_dir=Path(args.out_dir), out_prefix=args.out_prefix,
+                        fmt=args.format, row_group_rows=args.row_group_rows)
     print(f"Wrote {len(paths)} file(s).")
     for p in paths:
         print(p)
@@ -0,0 +1,173 @@
+"""
+Persistent index of ads already collected, keyed on ad_id with its list_time.
+
+Chợ Tốt bumps `list_time` when an ad is edited or re-pushed, so an (id, list_time)
+pair that is already in the index means "known and unchanged". The incremental
+crawl (`chotot_batch_crawl.py --incremental`) writes only rows that are not, and
+stops a region after N consecutive pages of known ads.
+
+    python crawler/seen_index.py --index data/seen_ads.sqlite seed data/*.csv
+    python crawler/seen_index.py --index data/seen_ads.sqlite stats
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_ads (
+    ad_id INTEGER PRIMARY KEY,
+    list_time INTEGER,
+    region_v2 INTEGER,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL
+)
+"""
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER on older builds
+MAX_PARAMS = 999
+
+
+def _as_int(value: Any) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class SeenIndex:
+    """
+    SQLite table of (ad_id -> list_time). The primary key is the B-tree lookup, so a
+    page of 20 ids is one indexed IN query regardless of how many ads are stored.
+
+    Rows are only added after their CSV is written (`add`), so a crash never marks
+    an ad as seen that is not on disk.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "SeenIndex":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM seen_ads").fetchone()[0]
+
+    def lookup(self, ad_ids: Iterable[int]) -> Dict[int, Optional[int]]:
+        """ad_id -> stored list_time for the ids that are in the index."""
+        ids = list({i for i in ad_ids if i is not None})
+        found: Dict[int, Optional[int]] = {}
+        for start in range(0, len(ids), MAX_PARAMS):
+            chunk = ids[start:start + MAX_PARAMS]
+            query = f"SELECT ad_id, list_time FROM seen_ads WHERE ad_id IN ({','.join('?' * len(chunk))})"
+            found.update(self.conn.execute(query, chunk))
+        return found
+
+    def unseen(self, items: List[Dict[str, Any]], pending: Optional[Dict[int, Optional[int]]] = None) -> List[Dict[str, Any]]:
+        """
+        Items that are new or changed (different list_time). `pending` holds ids taken
+        earlier in the same run but not committed yet; pages shift while new ads are
+        posted, so the same ad can show up on two consecutive pages.
+        """
+        known = self.lookup(_as_int(item.get("id")) for item in items)
+        if pending:
+            known.update(pending)
+        fresh = []
+        for item in items:
+            ad_id = _as_int(item.get("id"))
+            if ad_id is None:
+                fresh.append(item)
+                continue
+            list_time = _as_int(item.get("date"))
+            if ad_id in known and known[ad_id] == list_time:
+                continue
+            known[ad_id] = list_time
+            fresh.append(item)
+        return fresh
+
+    def add(self, items: Iterable[Dict[str, Any]], *, region_v2: Optional[int] = None) -> int:
+        now = int(time.time())
+        rows = [
+            (ad_id, _as_int(item.get("date")), region_v2, now, now)
+            for item in items
+            if (ad_id := _as_int(item.get("id"))) is not None
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO seen_ads (ad_id, list_time, region_v2, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(ad_id) DO UPDATE SET list_time = excluded.list_time, "
+                "region_v2 = COALESCE(excluded.region_v2, seen_ads.region_v2), last_seen = excluded.last_seen",
+                rows,
+            )
+        return len(rows)
+
+    def seed_from_csv(self, paths: Iterable[Path], *, region_v2: Optional[int] = None) -> int:
+        """Load ids from CSVs written by earlier (full) crawls."""
+        total = 0
+        for path in paths:
+            with Path(path).open(newline="", encoding="utf-8") as f:
+                total += self.add(csv.DictReader(f), region_v2=region_v2)
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        count, newest, oldest = self.conn.execute(
+            "SELECT COUNT(*), MAX(list_time), MIN(list_time) FROM seen_ads"
+        ).fetchone()
+        regions = dict(self.conn.execute(
+            "SELECT COALESCE(region_v2, -1), COUNT(*) FROM seen_ads GROUP BY region_v2 ORDER BY region_v2"
+        ))
+        return {
+            "path": str(self.path),
+            "ads": count,
+            "newest_list_time": newest,
+            "oldest_list_time": oldest,
+            "by_region": regions,
+            "size_bytes": self.path.stat().st_size if self.path.exists() else 0,
+        }
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Manage the seen-ads index used by incremental crawls.")
+    p.add_argument("--index", default="data/seen_ads.sqlite")
+    sub = p.add_subparsers(dest="command", required=True)
+    seed = sub.add_parser("seed", help="Add every ad in existing crawl CSVs")
+    seed.add_argument("csv", nargs="+")
+    seed.add_argument("--region", type=int, default=None)
+    sub.add_parser("stats", help="Print index size and coverage")
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    with SeenIndex(Path(args.index)) as index:
+        if args.command == "seed":
+            added = index.seed_from_csv([Path(p) for p in args.csv], region_v2=args.region)
+            print(f"Indexed {added} row(s); {len(index)} distinct ads in {index.path}")
+        else:
+            for key, value in index.stats().items():
+                print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,277 @@
+"""
+Local stand-in for the Chợ Tốt ad-listing API.
+
+Replays recorded pages (saved by `chotot_batch_crawl.py --record-dir`) or serves
+deterministic synthetic ads, with injected latency, 5xx errors and 429 throttling.
+
+    python crawler/stub_server.py --synthetic-pages 200 --latency-ms 150 --error-rate 0.05
+    python crawler/chotot_batch_crawl.py --region 13000 --concurrency 8 --api-url http://127.0.0.1:8765/v1/public/ad-listing
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+API_PATH = "/v1/public/ad-listing"
+RECORD_NAME = re.compile(r"region(\d+)_o(\d+)_l(\d+)\.json$")
+
+DISTRICTS = [
+    ("Quận Cầu Giấy", ["Phường Dịch Vọng", "Phường Nghĩa Đô", "Phường Quan Hoa"]),
+    ("Quận Đống Đa", ["Phường Láng Hạ", "Phường Ô Chợ Dừa", "Phường Trung Liệt"]),
+    ("Quận Hoàng Mai", ["Phường Định Công", "Phường Hoàng Liệt", "Phường Tương Mai"]),
+    ("Quận Thanh Xuân", ["Phường Khương Trung", "Phường Nhân Chính", "Phường Thanh Xuân Bắc"]),
+    ("Quận Hà Đông", ["Phường Mộ Lao", "Phường Văn Quán", "Phường Yết Kiêu"]),
+]
+
+
+def synthetic_ads(n: int, *, seed: int = 0, start_id: int = 150_000_000) -> List[Dict[str, Any]]:
+    """Deterministic ads shaped like the real ad-listing payload, newest first."""
+    rng = random.Random(seed)
+    now_ms = 1_700_000_000_000
+    ads = []
+    for i in range(n):
+        district, wards = DISTRICTS[rng.randrange(len(DISTRICTS))]
+        area = round(rng.uniform(25, 150), 1)
+        rooms = rng.randint(1, 6)
+        ads.append({
+            "ad_id": start_id - i,
+            "list_time": now_ms - i * 60_000,
+            "subject": f"Bán nhà {district} {area}m2 {rooms} phòng ngủ",
+            "price": int(area * rng.uniform(80, 200)) * 1_000_000,
+            "size": area,
+            "region_name": "Hà Nội",
+            "area_name": district,
+            "ward_name": rng.choice(wards),
+            "street_name": f"Ngõ {rng.randint(1, 300)}",
+            "address": f"{rng.choice(wards)}, {district}, Hà Nội",
+            "latitude": round(21.0 + rng.uniform(-0.08, 0.08), 6),
+            "longitude": round(105.82 + rng.uniform(-0.08, 0.08), 6),
+            "body": "Nhà chính chủ, sổ đỏ, ngõ ô tô đỗ cửa. " * rng.randint(1, 4),
+            "rooms": rooms,
+            "toilets": rng.randint(1, rooms + 1),
+            "floors": rng.randint(1, 7),
+            "property_legal_document": rng.choice([1, 2, 3]),
+            "furnishing_sell": rng.choice([1, 2, 3, None]),
+            "property_road_type": rng.choice([1, 2, 3]),
+            "direction": rng.choice([1, 2, 3, 4, 5, 6, 7, 8, None]),
+            "living_size": round(area * rng.uniform(1, 4), 1),
+            "company_ad": rng.random() < 0.3,
+            "protection_entitlement": rng.random() < 0.5,
+            "images": [f"https://cdn.example/{start_id - i}/{k}.jpg" for k in range(rng.randint(0, 8))],
+            "image": f"https://cdn.example/{start_id - i}/thumb.jpg",
+            "property_type": rng.choice([1, 2, 3]),
+            "width": round(rng.uniform(3, 8), 1),
+            "length": round(rng.uniform(8, 20), 1),
+            "pty_characteristics": [rng.randint(1, 5)],
+        })
+    return ads
+
+
+def load_recorded_pages(record_dir: Path) -> Dict[Tuple[int, int, int], Dict[str, Any]]:
+    pages = {}
+    for path in sorted(Path(record_dir).glob("region*_o*_l*.json")):
+        match = RECORD_NAME.search(path.name)
+        if match:
+            key = tuple(int(g) for g in match.groups())
+            pages[key] = json.loads(path.read_text(encoding="utf-8"))
+    return pages
+
+
+class StubServer:
+    """
+    Threaded HTTP/1.1 (keep-alive) server replaying ad-listing pages.
+
+    Recorded pages are looked up by (region_v2, o, limit); otherwise `ads` is sliced
+    by offset. Faults are drawn from a seeded RNG so a run is reproducible.
+    """
+
+    def __init__(
+        self,
+        *,
+        ads: Optional[List[Dict[str, Any]]] = None,
+        recorded: Optional[Dict[Tuple[int, int, int], Dict[str, Any]]] = None,
+        latency_s: float = 0.0,
+        jitter_s: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after_s: float = 1.0,
+        max_rps: float = 0.0,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.ads = ads or []
+        self.recorded = recorded or {}
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after_s = retry_after_s
+        self.max_rps = max_rps
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: List[float] = []
+        self.stats = {"requests": 0, "pages": 0, "errors": 0, "throttled": 0, "connections": 0}
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PATH}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="chotot-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _fault(self) -> Tuple[Optional[int], float]:
+        """(status to fail with or None, latency) for the next request."""
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if self.max_rps > 0:
+                self._recent = [t for t in self._recent if now - t < 1.0]
+                if len(self._recent) >= self.max_rps:
+                    self.stats["throttled"] += 1
+                    return 429, 0.0
+                self._recent.append(now)
+            latency = max(0.0, self.latency_s + self._rng.uniform(-self.jitter_s, self.jitter_s))
+            draw = self._rng.random()
+            if draw < self.throttle_rate:
+                self.stats["throttled"] += 1
+                return 429, latency
+            if draw < self.throttle_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return self._rng.choice([500, 502, 503]), latency
+            self.stats["pages"] += 1
+            return None, latency
+
+    def page(self, region_v2: int, offset: int, limit: int) -> Dict[str, Any]:
+        recorded = self.recorded.get((region_v2, offset, limit))
+        if recorded is not None:
+            return recorded
+        return {"ads": self.ads[offset:offset + limit], "total": len(self.ads)}
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                with server._lock:
+                    server.stats["connections"] += 1
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client cancelled an in-flight page (crawl stopped early)
+                    self.close_connection = True
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                if url.path != API_PATH:
+                    self._send(404, b'{"error": "not found"}')
+                    return
+                query = parse_qs(url.query)
+                try:
+                    region_v2 = int(query.get("region_v2", ["0"])[0])
+                    offset = int(query.get("o", ["0"])[0])
+                    limit = int(query.get("limit", ["20"])[0])
+                except ValueError:
+                    self._send(400, b'{"error": "bad query"}')
+                    return
+
+                status, latency = server._fault()
+                if latency:
+                    time.sleep(latency)
+                if status == 429:
+                    self._send(429, b'{"error": "too many requests"}', {"Retry-After": f"{server.retry_after_s:g}"})
+                elif status is not None:
+                    self._send(status, b'{"error": "upstream error"}')
+                else:
+                    body = json.dumps(server.page(region_v2, offset, limit), ensure_ascii=False).encode("utf-8")
+                    self._send(200, body)
+
+        return Handler
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Serve recorded or synthetic Chợ Tốt ad-listing pages locally.")
+    p.add_argument("--record-dir", default=None, help="Directory of pages saved with chotot_batch_crawl.py --record-dir")
+    p.add_argument("--synthetic-pages", type=int, default=200, help="Synthetic pages when no recording matches")
+    p.add_argument("--limit-per-page", type=int, default=20)
+    p.add_argument("--latency-ms", type=float, default=100.0)
+    p.add_argument("--jitter-ms", type=float, default=50.0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 5xx")
+    p.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    p.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    p.add_argument("--max-rps", type=float, default=0.0, help="Answer 429 above this many requests/s (0 = off)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    server = StubServer(
+        ads=synthetic_ads(args.synthetic_pages * args.limit_per_page, seed=args.seed),
+        recorded=load_recorded_pages(Path(args.record_dir)) if args.record_dir else None,
+        latency_s=args.latency_ms / 1000,
+        jitter_s=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after_s=args.retry_after,
+        max_rps=args.max_rps,
+        seed=args.seed,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Serving {len(server.recorded)} recorded + {len(server.ads)} synthetic ads at {server.url}")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
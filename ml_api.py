@@ -3,14 +3,28 @@ FastAPI service cho House Price Prediction và Recommendation
 Load pre-trained models từ notebooks (không train lại)
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List, Dict, Any
+from dataclasses import dataclass, field, asdict, replace
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import joblib
+import asyncio
+import bisect
+import hmac
+import itertools
+import json
 import os
+import re
+import sys
+import threading
+import time
+import unicodedata
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -28,46 +42,2355 @@ app.add_middleware(
 # ============================================================================
 # GLOBAL VARIABLES
 # ============================================================================
-prediction_model = None
-prediction_scaler = None
-prediction_features = None
-prediction_encoders = None
+# Models đang serve nằm trong model_registry.active (ModelBundle), xem MODEL REGISTRY
 
-recommendation_knn = None
-recommendation_scaler = None
-recommendation_X_scaled = None
-recommendation_df = None
-recommendation_features = None
-recommendation_encoders = None
+# ============================================================================
+# PYDANTIC MODELS
+# ============================================================================
+
+class PredictRequest(BaseModel):
+    area: float
+    rooms: Optional[float] = None
+    toilets: Optional[float] = None
+    floors: Optional[float] = None
+    width: Optional[float] = None
+    length: Optional[float] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    district: Optional[str] = None
+    ward: Optional[str] = None
+    legal: Optional[str] = None
+    seller_type: Optional[str] = None
+
+class RecommendationFilters(BaseModel):
+    # Điều kiện bắt buộc (khác district của request chỉ là bonus khi xếp hạng)
+    district: Optional[str] = None
+    ward: Optional[str] = None
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    area_min: Optional[float] = None
+    area_max: Optional[float] = None
+    rooms_min: Optional[float] = None
+
+DEFAULT_N_RECOMMENDATIONS = 5
+
+class RecommendByFeaturesRequest(BaseModel):
+    price: float
+    area: float
+    rooms: Optional[float] = None
+    toilets: Optional[float] = None
+    floors: Optional[float] = None
+    district: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    n_recommendations: Optional[int] = DEFAULT_N_RECOMMENDATIONS  # null -> mặc định
+    filters: Optional[RecommendationFilters] = None
+
+class PredictBatchRequest(BaseModel):
+    # Mỗi item có schema của PredictRequest, validate riêng từng dòng
+    # để 1 dòng lỗi không làm hỏng cả batch
+    items: List[Dict[str, Any]]
+
+# ============================================================================
+# METRICS - latency histograms theo stage + sampling profiler
+# ============================================================================
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'  # 0 = không đo stage / request
+# Upper bound (giây) của các bucket, kiểu Prometheus: 50µs .. 10s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Pipeline -> các stage được đo (thứ tự chạy). predict_rows phục vụ cả /predict (đã gộp batch)
+# và /predict/batch; engine compiled / onnx scale luôn trong 'predict', sklearn đo 'scale' riêng
+PIPELINE_STAGES = {
+    'predict': ('defaults', 'features', 'encode', 'scale', 'predict'),
+    'predict_batch': ('validate', 'response'),
+    'recommend_by_id': ('search', 'response'),
+    'recommend_by_features': ('defaults', 'features', 'encode', 'scale', 'search', 'response'),
+}
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))  # chu kỳ lấy mẫu stack
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '120'))
+PROFILE_MAX_DEPTH = 64  # số frame tối đa mỗi stack (tính từ frame trong cùng)
+
+class LatencyHistogram:
+    """
+    Histogram bucket cố định: observe() = 1 bisect + vài phép cộng, không lưu từng giá trị
+    
+    Các inference thread cùng ghi nên dùng 1 lock (giữ vài trăm ns, gần như không tranh chấp).
+    """
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # phần tử cuối = +Inf
+        self.total = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds: float):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += seconds
+    
+    def snapshot(self):
+        """Returns: (cumulative counts theo bucket + '+Inf', sum)"""
+        with self._lock:
+            counts, total = list(self.counts), self.total
+        return list(itertools.accumulate(counts)), total
+
+class StageTimer:
+    """
+    Đo các stage liên tiếp của 1 pipeline: lap(stage) ghi thời gian từ lap trước (hoặc lúc tạo)
+        
+        timer = StageTimer('predict')
+        columns = build_prediction_columns(...)
+        timer.lap('defaults')
+    """
+    __slots__ = ('histograms', 'last')
+    
+    def __init__(self, pipeline: str):
+        self.histograms = service_metrics.stages[pipeline] if METRICS_ENABLED else None
+        self.last = time.perf_counter()
+    
+    def lap(self, stage: str):
+        if self.histograms is not None:
+            now = time.perf_counter()
+            self.histograms[stage].observe(now - self.last)
+            self.last = now
+    
+    def skip(self):
+        """Bỏ qua khoảng từ lap trước (đã được đo ở pipeline khác)"""
+        self.last = time.perf_counter()
+
+class ServiceMetrics:
+    """
+    Histogram theo (pipeline, stage), latency + số request theo (endpoint, status)
+    
+    Counter của request chỉ được sửa trên event loop thread (MetricsMiddleware) nên không cần lock.
+    """
+    
+    def __init__(self):
+        self.stages = {
+            pipeline: {stage: LatencyHistogram() for stage in stages}
+            for pipeline, stages in PIPELINE_STAGES.items()
+        }
+        self.request_latency: Dict[str, LatencyHistogram] = {}
+        self.requests: Dict[tuple, int] = {}  # (endpoint, method, status) -> count
+        self.model_loads = {"success": 0, "error": 0}
+        self.started_at = time.time()
+    
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float):
+        histogram = self.request_latency.get(endpoint)
+        if histogram is None:
+            histogram = self.request_latency[endpoint] = LatencyHistogram()
+        histogram.observe(seconds)
+        key = (endpoint, method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+service_metrics = ServiceMetrics()
+
+class MetricsMiddleware:
+    """
+    ASGI middleware đo latency + status của mọi request HTTP
+    
+    Endpoint là path template của route ('/recommend/by-id/{house_id}'), không phải URL thật,
+    nên số series không tăng theo house id; request không khớp route nào -> 'unmatched'.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        
+        start = time.perf_counter()
+        status = 500  # exception trước khi gửi response
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            endpoint = getattr(route, 'path', None) or 'unmatched'
+            service_metrics.observe_request(endpoint, scope['method'], status, time.perf_counter() - start)
+
+app.add_middleware(MetricsMiddleware)
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+class PrometheusText:
+    """Ghi metrics theo text exposition format 0.0.4 của Prometheus (HELP + TYPE 1 lần mỗi metric)"""
+    
+    def __init__(self, prefix='ml_api_'):
+        self.prefix = prefix
+        self.lines = []
+    
+    def header(self, name, kind, help_text):
+        self.lines.append(f'# HELP {self.prefix}{name} {help_text}')
+        self.lines.append(f'# TYPE {self.prefix}{name} {kind}')
+    
+    def sample(self, name, value, labels=None):
+        value = value if isinstance(value, int) else repr(float(value))
+        self.lines.append(f'{self.prefix}{name}{format_labels(labels or {})} {value}')
+    
+    def histogram(self, name, histogram: LatencyHistogram, labels: Dict[str, Any]):
+        cumulative, total = histogram.snapshot()
+        for bound, count in zip(histogram.buckets + ('+Inf',), cumulative):
+            self.sample(f'{name}_bucket', count, {**labels, 'le': bound})
+        self.sample(f'{name}_sum', total, labels)
+        self.sample(f'{name}_count', cumulative[-1], labels)
+    
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+class SamplingProfiler:
+    """
+    Sampling profiler bật lúc runtime trong 1 cửa sổ cố định
+    
+    Thread nền đọc sys._current_frames() mỗi interval_ms và đếm các stack (không trace từng lời gọi
+    nên overhead không phụ thuộc số lời gọi hàm). Kết quả dạng collapsed stack ('a;b;c count',
+    dùng được với flamegraph.pl / speedscope) + bảng hàm tốn nhiều sample nhất.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.result: Optional[Dict[str, Any]] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self, seconds: float, interval_ms: float = PROFILE_INTERVAL_MS,
+              thread_prefix: Optional[str] = None) -> bool:
+        """Bắt đầu lấy mẫu trong `seconds` giây; False nếu đang có 1 lần profile khác"""
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(seconds, interval_ms, thread_prefix),
+                                            name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return True
+    
+    def _run(self, seconds, interval_ms, thread_prefix):
+        stacks: Dict[str, int] = {}
+        own = threading.get_ident()
+        n_samples = 0
+        started_at = time.time()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == own or (thread_prefix and not name.startswith(thread_prefix)):
+                    continue
+                frames = []
+                while frame is not None and len(frames) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                key = ';'.join([name] + frames[::-1])
+                stacks[key] = stacks.get(key, 0) + 1
+            n_samples += 1
+            time.sleep(interval_ms / 1000)
+        
+        # Self samples: frame trong cùng của mỗi stack
+        functions: Dict[str, int] = {}
+        for key, count in stacks.items():
+            leaf = key.rsplit(';', 1)[-1]
+            functions[leaf] = functions.get(leaf, 0) + count
+        self.result = {
+            "started_at": started_at,
+            "seconds": seconds,
+            "interval_ms": interval_ms,
+            "thread_prefix": thread_prefix,
+            "samples": n_samples,
+            "top": [{"frame": frame, "samples": count}
+                    for frame, count in sorted(functions.items(), key=lambda item: -item[1])[:30]],
+            "stacks": stacks,
+        }
+    
+    def collapsed(self) -> str:
+        stacks = self.result["stacks"] if self.result else {}
+        return ''.join(f'{key} {count}\n' for key, count in sorted(stacks.items()))
+
+sampling_profiler = SamplingProfiler()
+
+# ============================================================================
+# FEATURE ENGINEERING (vectorized)
+# ============================================================================
+
+CENTER_LAT, CENTER_LNG = 21.0285, 105.8542
+
+PREDICT_NUMERIC_INPUTS = ['area', 'rooms', 'toilets', 'floors', 'width', 'length', 'lat', 'lng']
+PREDICT_CATEGORICAL_INPUTS = ['district', 'ward', 'legal', 'seller_type']
+PREDICT_BATCH_MAX_ROWS = 50000
+
+# ============================================================================
+# MODEL DEFAULTS
+# ============================================================================
+
+MODEL_DEFAULTS_FILE = 'model_defaults.json'
+DEFAULT_MEDIAN_COLUMNS = ['rooms', 'toilets', 'floors', 'width', 'length']
+
+@dataclass
+class ModelDefaults:
+    """
+    Default values tính 1 lần từ recommendation_df lúc load models
+    (request không bao giờ phải scan cả DataFrame)
+    """
+    medians: Dict[str, float]
+    center_lat: float = CENTER_LAT
+    center_lng: float = CENTER_LNG
+    # district -> [lat, lng] median, dùng khi request thiếu lat/lng
+    district_coords: Dict[str, List[float]] = field(default_factory=dict)
+    n_samples: int = 0
+    
+    @classmethod
+    def from_dataframe(cls, df):
+        medians = {col: float(df[col].median()) for col in DEFAULT_MEDIAN_COLUMNS}
+        coords = df.dropna(subset=['lat', 'lng']).groupby('district')[['lat', 'lng']].median()
+        district_coords = {
+            str(district): [float(lat), float(lng)]
+            for district, lat, lng in zip(coords.index, coords['lat'], coords['lng'])
+        }
+        return cls(medians=medians, district_coords=district_coords, n_samples=len(df))
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(**json.load(f))
+    
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(asdict(self), f, indent=2, ensure_ascii=False)
+    
+    def coords_for(self, district):
+        """Tọa độ fallback: median của quận nếu biết, không thì trung tâm Hà Nội"""
+        coords = self.district_coords.get(district) if district else None
+        if coords:
+            return coords[0], coords[1]
+        return self.center_lat, self.center_lng
+    
+    def fill_lat_lng(self, lat: np.ndarray, lng: np.ndarray, districts: np.ndarray):
+        """Điền lat/lng bị thiếu (NaN) in-place theo coords_for"""
+        for i in np.flatnonzero(np.isnan(lat) | np.isnan(lng)):
+            fallback_lat, fallback_lng = self.coords_for(districts[i])
+            if np.isnan(lat[i]):
+                lat[i] = fallback_lat
+            if np.isnan(lng[i]):
+                lng[i] = fallback_lng
+
+def load_model_defaults(models_dir, n_samples, load_df):
+    """
+    Load model_defaults.json nếu còn mới, không thì tính lại và lưu cạnh artifacts
+    
+    load_df chỉ được gọi khi cần tính lại (tránh unpickle recommendation_df lúc startup).
+    """
+    path = f'{models_dir}/{MODEL_DEFAULTS_FILE}'
+    df_path = f'{models_dir}/recommendation_df.pkl'
+    
+    if os.path.exists(path) and (not os.path.exists(df_path) or os.path.getmtime(path) >= os.path.getmtime(df_path)):
+        defaults = ModelDefaults.load(path)
+        if defaults.n_samples == n_samples:
+            return defaults
+    
+    defaults = ModelDefaults.from_dataframe(load_df())
+    try:
+        defaults.save(path)
+    except OSError as e:
+        print(f"Could not save {path}: {e}")
+    return defaults
+
+def build_prediction_columns(requests: List[PredictRequest], defaults: ModelDefaults) -> Dict[str, np.ndarray]:
+    """Chuyển list PredictRequest thành các cột NumPy (None -> default)"""
+    columns = {}
+    for name in PREDICT_NUMERIC_INPUTS:
+        columns[name] = np.array([getattr(r, name) for r in requests], dtype=np.float64)
+    
+    # has_dimensions phải tính trước khi điền default (giống notebook)
+    columns['has_dimensions'] = (~np.isnan(columns['width']) & ~np.isnan(columns['length'])).astype(np.float64)
+    
+    for name in DEFAULT_MEDIAN_COLUMNS:
+        col = columns[name]
+        col[np.isnan(col)] = defaults.medians[name]
+    
+    for name in PREDICT_CATEGORICAL_INPUTS:
+        columns[name] = np.array([getattr(r, name) or 'Unknown' for r in requests], dtype=object)
+    
+    defaults.fill_lat_lng(columns['lat'], columns['lng'], columns['district'])
+    
+    return columns
+
+def engineer_prediction_features(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Tính engineered features cho cả batch bằng phép toán mảng (công thức như notebook 01)"""
+    area, rooms, toilets, floors = columns['area'], columns['rooms'], columns['toilets'], columns['floors']
+    lat, lng = columns['lat'], columns['lng']
+    
+    columns['total_rooms'] = rooms + toilets
+    columns['toilet_room_ratio'] = toilets / (rooms + 1)
+    columns['area_per_floor'] = area / (floors + 0.1)
+    columns['total_floor_area'] = area * floors
+    columns['room_density'] = columns['total_rooms'] / (area + 1)
+    columns['rooms_per_sqm'] = columns['room_density']
+    columns['width_length_ratio'] = columns['width'] / (columns['length'] + 0.1)
+    columns['distance_from_center'] = np.sqrt((lat - CENTER_LAT)**2 + (lng - CENTER_LNG)**2)
+    columns['is_central'] = (columns['distance_from_center'] < 0.05).astype(np.float64)
+    columns['lat_lng_interaction'] = lat * lng
+    return columns
+
+# ============================================================================
+# CATEGORY DICTIONARIES (string -> code)
+# ============================================================================
+
+# Viết tắt đầu chuỗi (sau casefold) -> tên đầy đủ: 'Q.1', 'Q 1', 'Q1', 'q. Cầu Giấy' -> 'quận ...'
+CATEGORY_ABBREVIATIONS = re.compile(r'^(tp|tx|tt|q|p|h|x)(?:\.\s*|\s+|(?=\d))')
+CATEGORY_ABBREVIATION_NAMES = {'tp': 'thành phố', 'tx': 'thị xã', 'tt': 'thị trấn', 'q': 'quận', 'p': 'phường',
+                               'h': 'huyện', 'x': 'xã'}
+CATEGORY_PREFIX_NAMES = re.compile(r'^(thành phố|thị xã|thị trấn|quận|phường|huyện|xã) ')
+# Dấu thanh kiểu cũ ở cuối âm tiết ('Hoà', 'Thuỷ') -> kiểu mới ('Hòa', 'Thủy'); 'Hoàng' giữ nguyên
+CATEGORY_TONE_MARKS = {
+    'oà': 'òa', 'oá': 'óa', 'oả': 'ỏa', 'oã': 'õa', 'oạ': 'ọa',
+    'oè': 'òe', 'oé': 'óe', 'oẻ': 'ỏe', 'oẽ': 'õe', 'oẹ': 'ọe',
+    'uỳ': 'ùy', 'uý': 'úy', 'uỷ': 'ủy', 'uỹ': 'ũy', 'uỵ': 'ụy',
+}
+CATEGORY_TONE_PATTERN = re.compile(f"({'|'.join(CATEGORY_TONE_MARKS)})(?!\\w)")
+
+def category_key(value) -> str:
+    """
+    Key so khớp cho district / ward: NFC (input NFD từ macOS / iOS), casefold, gộp khoảng trắng,
+    viết tắt Q. / P. / H. / TX. -> tên đầy đủ, bỏ số 0 đầu ('Quận 01'), dấu thanh kiểu mới
+    """
+    text = ' '.join(unicodedata.normalize('NFC', str(value)).casefold().split())
+    match = CATEGORY_ABBREVIATIONS.match(text)
+    if match:
+        text = f"{CATEGORY_ABBREVIATION_NAMES[match.group(1)]} {text[match.end():]}"
+    text = re.sub(r'\b0+(\d)', r'\1', text)
+    return CATEGORY_TONE_PATTERN.sub(lambda m: CATEGORY_TONE_MARKS[m.group(1)], text)
+
+class CategoryDictionary:
+    """
+    Hash lookup string -> code cho 1 cột categorical, build 1 lúc load từ classes của encoder
+    
+    Code = index trong classes (giống LabelEncoder.transform). Thứ tự lookup: đúng chuỗi ->
+    category_key -> key không có tiền tố ('Cầu Giấy' -> 'Quận Cầu Giấy'); key trùng giữa
+    nhiều class (vd. 'Phường X' / 'Xã X' khi bỏ tiền tố) bị bỏ thay vì đoán.
+    """
+    
+    def __init__(self, classes, unknown_code: int = 0):
+        self.classes = [str(value) for value in classes]
+        self.unknown_code = unknown_code
+        self.exact = {value: code for code, value in enumerate(self.classes)}
+        self.keys = {}
+        aliases = {}
+        for code, value in enumerate(self.classes):
+            key = category_key(value)
+            self.keys[key] = code if self.keys.get(key, code) == code else None
+            short = CATEGORY_PREFIX_NAMES.sub('', key)
+            if short != key:
+                aliases[short] = code if aliases.get(short, code) == code else None
+        for short, code in aliases.items():
+            self.keys.setdefault(short, code)
+    
+    @classmethod
+    def from_encoder(cls, encoder, unknown_value: Optional[str] = None):
+        """LabelEncoder hoặc {'classes': [...]}; unknown_value (vd. 'Unknown') là code cho giá trị lạ nếu có"""
+        classes = [str(value) for value in encoder_classes(encoder)]
+        return cls(classes, classes.index(unknown_value) if unknown_value in classes else 0)
+    
+    def __len__(self):
+        return len(self.classes)
+    
+    def lookup(self, value) -> Optional[int]:
+        """Code của value, None nếu không khớp class nào"""
+        if value is None:
+            return None
+        code = self.exact.get(value)
+        if code is None and isinstance(value, str) and value:
+            code = self.keys.get(category_key(value))
+        return code
+    
+    def encode(self, value) -> int:
+        code = self.lookup(value)
+        return self.unknown_code if code is None else code
+    
+    def canonical(self, value) -> Optional[str]:
+        """Tên class đúng chính tả của value (None nếu không khớp)"""
+        code = self.lookup(value)
+        return None if code is None else self.classes[code]
+    
+    def lookup_many(self, values) -> np.ndarray:
+        """Encode cả cột: lookup 1 lần / giá trị unique (pd.factorize), không khớp -> -1"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        table = np.array([-1 if (code := self.lookup(value)) is None else code for value in uniques] + [-1],
+                         dtype=np.int64)
+        return table[codes]
+    
+    def encode_many(self, values) -> np.ndarray:
+        codes = self.lookup_many(values)
+        codes[codes < 0] = self.unknown_code
+        return codes
+
+def category_dictionaries(encoders: Dict[str, Any], unknown_value: Optional[str] = None) -> Dict[str, CategoryDictionary]:
+    return {col: CategoryDictionary.from_encoder(encoder, unknown_value) for col, encoder in (encoders or {}).items()}
+
+# ============================================================================
+# PREDICTION ENCODER
+# ============================================================================
+
+def encoder_classes(encoder):
+    """Lấy list classes từ LabelEncoder hoặc dict {'classes': [...]} (format của convert_to_onnx)"""
+    if encoder is None:
+        return []
+    if isinstance(encoder, dict):
+        return list(encoder.get('classes', []))
+    return list(getattr(encoder, 'classes_', []))
+
+class PredictionEncoder:
+    """
+    Encoder biên dịch sẵn từ prediction_features (build 1 lần lúc startup)
+    
+    - Numeric feature -> index cột
+    - '<col>_encoded' -> label code (CategoryDictionary từ classes của LabelEncoder lúc train)
+    - '<col>_<value>' -> cột one-hot (CategoryDictionary của các value -> index cột)
+    
+    Hot path chỉ ghi trực tiếp vào row buffer float32, không tạo DataFrame.
+    """
+    
+    def __init__(self, features, encoders=None, categorical_columns=PREDICT_CATEGORICAL_INPUTS):
+        encoders = encoders or {}
+        self.features = list(features)
+        self.n_features = len(self.features)
+        
+        # col -> (column index, CategoryDictionary); lúc train missing được fill 'Unknown'
+        # trước khi encode nên giá trị lạ nhận code của 'Unknown'
+        self.label_columns = {}
+        # col -> (CategoryDictionary của các value, column index theo code)
+        self.onehot_columns = {}
+        # feature name -> column index
+        self.numeric_columns = {}
+        
+        onehot_prefixes = [(col, col + '_') for col in categorical_columns]
+        onehot = {}
+        for j, feature in enumerate(self.features):
+            if feature.endswith('_encoded'):
+                col = feature[:-len('_encoded')]
+                self.label_columns[col] = (j, CategoryDictionary.from_encoder(encoders.get(col), 'Unknown'))
+                continue
+            
+            for col, prefix in onehot_prefixes:
+                if feature.startswith(prefix):
+                    onehot.setdefault(col, {})[feature[len(prefix):]] = j
+                    break
+            else:
+                self.numeric_columns[feature] = j
+        for col, mapping in onehot.items():
+            self.onehot_columns[col] = (CategoryDictionary(list(mapping)), np.array(list(mapping.values()), dtype=np.int64))
+        
+        self._local = threading.local()
+    
+    def _row_buffer(self):
+        # Buffer riêng cho mỗi thread, tái sử dụng giữa các request
+        row = getattr(self._local, 'row', None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features), dtype=np.float32)
+        return row
+    
+    def transform(self, values: Dict[str, Any]) -> np.ndarray:
+        """
+        Encode 1 dòng vào row buffer (1, n_features)
+        
+        Buffer được tái sử dụng ở lần gọi sau trên cùng thread - copy nếu cần giữ lại.
+        """
+        row = self._row_buffer()
+        row.fill(0)
+        out = row[0]
+        
+        for feature, j in self.numeric_columns.items():
+            value = values.get(feature)
+            if value is not None:
+                out[j] = value
+        
+        for col, (j, dictionary) in self.label_columns.items():
+            out[j] = dictionary.encode(values.get(col) or 'Unknown')
+        
+        for col, (dictionary, onehot_columns) in self.onehot_columns.items():
+            code = dictionary.lookup(values.get(col) or 'Unknown')
+            if code is not None:
+                out[onehot_columns[code]] = 1
+        
+        return row
+    
+    def transform_many(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Encode cả batch từ các cột NumPy -> ma trận float32 (n_rows, n_features)"""
+        n = len(next(iter(columns.values())))
+        X = np.zeros((n, self.n_features), dtype=np.float32)
+        
+        for feature, j in self.numeric_columns.items():
+            if feature in columns:
+                X[:, j] = columns[feature]
+        
+        for col, (j, dictionary) in self.label_columns.items():
+            if col in columns:
+                X[:, j] = dictionary.encode_many(columns[col])
+            else:
+                X[:, j] = dictionary.encode('Unknown')
+        
+        for col, (dictionary, onehot_columns) in self.onehot_columns.items():
+            if col not in columns:
+                continue
+            codes = dictionary.lookup_many(columns[col])
+            rows = np.flatnonzero(codes >= 0)
+            X[rows, onehot_columns[codes[rows]]] = 1
+        
+        return X
+
+def predict_rows(models: 'ModelBundle', requests: List[PredictRequest]):
+    """
+    Dự đoán giá cho nhiều nhà với 1 lần scale + 1 lần predict
+    
+    Returns: (prices, errors) - errors[i] là None nếu dòng i thành công
+    """
+    n = len(requests)
+    timer = StageTimer('predict')
+    columns = build_prediction_columns(requests, models.model_defaults)
+    timer.lap('defaults')
+    columns = engineer_prediction_features(columns)
+    timer.lap('features')
+    if n == 1:
+        X = models.prediction_encoder.transform({name: col[0] for name, col in columns.items()})
+    else:
+        X = models.prediction_encoder.transform_many(columns)
+    timer.lap('encode')
+    
+    errors = [None] * n
+    prices = np.full(n, np.nan)
+    
+    valid = np.isfinite(X).all(axis=1)
+    for i in np.flatnonzero(~valid):
+        errors[i] = "Non-finite feature values"
+    
+    if valid.any():
+        if models.prediction_engine is not None:
+            prices[valid] = models.prediction_engine.predict(X[valid])  # scale nằm trong engine
+        else:
+            X_scaled = models.prediction_scaler.transform(X[valid])
+            timer.lap('scale')
+            prices[valid] = models.prediction_model.predict(X_scaled)
+        timer.lap('predict')
+    
+    for i in np.flatnonzero(valid & ~np.isfinite(prices)):
+        errors[i] = "Model returned a non-finite price"
+    
+    return prices, errors
+
+# ============================================================================
+# COMPILED TREE ENSEMBLE - price model không qua sklearn predict
+# ============================================================================
+
+PREDICTION_ENGINE = os.environ.get('PREDICTION_ENGINE', 'compiled')  # 'compiled' | 'onnx' | 'sklearn'
+# type(model).__name__ -> cách cộng output các cây
+FOREST_REGRESSORS = ('RandomForestRegressor', 'ExtraTreesRegressor')
+BOOSTING_REGRESSORS = ('GradientBoostingRegressor',)
+BOOSTING_RAW_LOSSES = ('squared_error', 'absolute_error', 'huber', 'quantile')  # predict = raw score
+COMPILED_BLOCK_ROWS = 1024  # node index của 1 block (n_trees x rows) nằm gọn trong cache
+
+def float32_floor(values: np.ndarray) -> np.ndarray:
+    """Số float32 lớn nhất <= value: với x float32, x <= t (float64) <=> x <= float32_floor(t)"""
+    rounded = values.astype(np.float32)
+    above = rounded.astype(np.float64) > values
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+class CompiledTreeEnsemble:
+    """
+    Các cây của RandomForest / ExtraTrees / GradientBoosting / DecisionTree (regression)
+    flatten thành mảng node liền nhau: feature, threshold, children (left, right), value
+    
+    predict() duyệt mọi cây cho cả block dòng cùng lúc theo từng level (max_depth bước NumPy),
+    không qua validation + dispatch từng estimator của sklearn. Node lá trỏ về chính nó
+    (threshold = +inf) nên cây nông hơn max_depth đứng yên ở lá.
+    StandardScaler (nếu có) chạy trước với đúng phép tính float32 của sklearn, và sklearn
+    cũng so sánh X dạng float32 với threshold; output cộng dồn theo đúng thứ tự của sklearn
+    (bias trước, từng cây theo thứ tự, rồi chia cho số cây với forest) nên khớp model.predict.
+    """
+    
+    name = 'compiled'
+    rtol = 1e-9  # sai số cho phép so với sklearn khi validate
+    
+    def __init__(self, trees, learning_rate=1.0, bias=0.0, divisor=1, scaler=None):
+        offsets = np.cumsum([0] + [tree.tree_.node_count for tree in trees])
+        n_nodes = int(offsets[-1])
+        self.n_trees = len(trees)
+        self.n_features = int(trees[0].n_features_in_)
+        self.max_depth = max(int(tree.tree_.max_depth) for tree in trees)
+        self.roots = offsets[:-1].astype(np.intp)
+        self.feature = np.zeros(n_nodes, dtype=np.intp)
+        self.threshold = np.full(n_nodes, np.inf, dtype=np.float32)
+        # children[2 * node] = left, children[2 * node + 1] = right
+        children = np.repeat(np.arange(n_nodes, dtype=np.intp), 2).reshape(n_nodes, 2)
+        self.value = np.empty(n_nodes, dtype=np.float64)
+        for tree, offset in zip(trees, offsets[:-1]):
+            t = tree.tree_
+            if t.n_outputs != 1 or t.value.shape[2] != 1:
+                raise ValueError("Only single-output regression trees can be compiled")
+            nodes = slice(offset, offset + t.node_count)
+            split = t.children_left >= 0
+            self.feature[nodes][split] = t.feature[split]
+            self.threshold[nodes][split] = float32_floor(t.threshold[split])
+            children[nodes][split, 0] = t.children_left[split] + offset
+            children[nodes][split, 1] = t.children_right[split] + offset
+            self.value[nodes] = learning_rate * t.value[:, 0, 0]
+        self.children = children.ravel()
+        self.bias = float(bias)
+        self.divisor = divisor
+        self.mean = getattr(scaler, 'mean_', None)
+        self.scale = getattr(scaler, 'scale_', None)
+    
+    @classmethod
+    def from_estimator(cls, model, scaler=None) -> Optional['CompiledTreeEnsemble']:
+        """None nếu model / scaler không compile được (khi đó dùng model.predict)"""
+        if scaler is not None and type(scaler).__name__ != 'StandardScaler':
+            return None
+        if hasattr(model, 'classes_') or getattr(model, 'n_outputs_', 1) != 1:
+            return None
+        kind = type(model).__name__
+        if hasattr(model, 'tree_'):
+            return cls([model], scaler=scaler)
+        if kind in FOREST_REGRESSORS:
+            return cls(list(model.estimators_), divisor=len(model.estimators_), scaler=scaler)
+        if kind in BOOSTING_REGRESSORS and model.loss in BOOSTING_RAW_LOSSES:
+            trees = list(np.ravel(model.estimators_))
+            if isinstance(model.init_, str):
+                bias = 0.0  # init='zero'
+            elif type(model.init_).__name__ == 'DummyRegressor':
+                bias = float(np.ravel(model.init_.constant_)[0])
+            else:
+                return None
+            return cls(trees, model.learning_rate, bias, scaler=scaler)
+        return None
+    
+    @property
+    def n_nodes(self):
+        return len(self.value)
+    
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """X chưa scale (n_rows, n_features) -> giá dự đoán float64 (n_rows,)"""
+        X = np.array(X, dtype=np.float32)
+        if self.mean is not None:
+            X -= self.mean
+        if self.scale is not None:
+            X /= self.scale
+        
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), COMPILED_BLOCK_ROWS):
+            out[start:start + COMPILED_BLOCK_ROWS] = self._sum_leaves(X[start:start + COMPILED_BLOCK_ROWS])
+        if self.divisor != 1:
+            out /= self.divisor
+        return out
+    
+    def _sum_leaves(self, X):
+        # X theo cột (feature-major) -> giá trị của dòng i, feature f ở flat[f * n + i]
+        n = len(X)
+        flat = np.ascontiguousarray(X.T).ravel()
+        feature_offsets = self.feature * n
+        rows = np.arange(n, dtype=np.intp)
+        
+        # Level 0: mọi dòng cùng ở root -> so sánh cả cột, không cần gather
+        go_right = X.T[self.feature[self.roots]] > self.threshold[self.roots, None]
+        node = np.take(self.children, (self.roots[:, None] << 1) + go_right)  # (n_trees, n)
+        for _ in range(self.max_depth - 1):
+            index = np.take(feature_offsets, node)
+            index += rows
+            go_right = np.take(flat, index) > np.take(self.threshold, node)
+            node <<= 1
+            node += go_right
+            node = np.take(self.children, node)
+        # cumsum luôn cộng tuần tự (sum() dùng pairwise khi n = 1) -> cùng thứ tự với sklearn
+        leaves = np.empty((self.n_trees + 1, n), dtype=np.float64)
+        leaves[0] = self.bias
+        np.take(self.value, node, out=leaves[1:])
+        return np.cumsum(leaves, axis=0)[-1]
+
+def compile_prediction_model(model, scaler) -> Optional[CompiledTreeEnsemble]:
+    """Compiled engine cho price model, None nếu PREDICTION_ENGINE=sklearn hoặc model không phải cây"""
+    if PREDICTION_ENGINE == 'sklearn':
+        return None
+    return CompiledTreeEnsemble.from_estimator(model, scaler)
+
+def parity_rows(scaler, n_features, n_rows=32):
+    """Vài dòng float32 quanh mean của scaler để so engine với sklearn"""
+    X = np.random.default_rng(0).normal(size=(n_rows, n_features))
+    X = X * getattr(scaler, 'scale_', 1.0) + getattr(scaler, 'mean_', 0.0)
+    return X.astype(np.float32)
+
+def engine_matches(engine, model, scaler, n_features) -> bool:
+    X = parity_rows(scaler, n_features)
+    expected = model.predict(scaler.transform(X))
+    return bool(np.allclose(engine.predict(X), expected, rtol=engine.rtol, atol=1e-6))
+
+# ============================================================================
+# ONNX RUNTIME BACKEND (PREDICTION_ENGINE=onnx)
+# ============================================================================
+
+# Graph do scripts/convert_to_onnx.py export (backend Node dùng cùng file): price_prediction_pipeline.onnx
+# (scaler + model gộp, 1 lần run) hoặc cặp scaler / model của bản export cũ.
+# Tìm trong <version>/onnx/ trước, rồi ONNX_MODELS_DIR.
+ONNX_MODELS_DIR = os.environ.get('ONNX_MODELS_DIR', 'backend/ml/models')
+ONNX_MODELS_SUBDIR = 'onnx'
+ONNX_PRICE_GRAPHS = [('price_prediction_pipeline.onnx',),
+                     ('price_prediction_scaler.onnx', 'price_prediction_model.onnx')]
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', '1'))  # mỗi inference thread 1 core
+ONNX_BUFFER_ROWS = int(os.environ.get('ONNX_BUFFER_ROWS', '4096'))
+
+def find_onnx_graphs(models_dir) -> List[str]:
+    """Đường dẫn các graph chạy nối tiếp (fused trước), [] nếu không có"""
+    for directory in (f'{models_dir}/{ONNX_MODELS_SUBDIR}', ONNX_MODELS_DIR):
+        for names in ONNX_PRICE_GRAPHS:
+            paths = [f'{directory}/{name}' for name in names]
+            if all(os.path.exists(path) for path in paths):
+                return paths
+    return []
+
+class OnnxPricePredictor:
+    """
+    Scaler + price model chạy bằng ONNX Runtime CPU: 1 session với graph gộp, hoặc 2 session
+    (output scaler -> input model) với bản export cũ
+    
+    Input được copy (và ép float32) vào 1 buffer cấp phát sẵn ONNX_BUFFER_ROWS dòng cho mỗi
+    inference thread, batch lớn hơn chạy theo từng block. Tree ensemble của ONNX cộng dồn
+    bằng float32 nên chỉ khớp sklearn tới ~1e-6 tương đối.
+    """
+    
+    name = 'onnx'
+    rtol = 1e-5
+    
+    def __init__(self, sessions, n_features, buffer_rows=ONNX_BUFFER_ROWS):
+        self.sessions = [(session, session.get_inputs()[0].name) for session in sessions]
+        self.n_features = n_features
+        self.buffer_rows = max(1, buffer_rows)
+        self.paths = []
+        self._local = threading.local()
+    
+    @classmethod
+    def load(cls, models_dir, n_features) -> Optional['OnnxPricePredictor']:
+        """None nếu thiếu onnxruntime hoặc file .onnx (khi đó dùng pickle)"""
+        paths = find_onnx_graphs(models_dir)
+        if not paths:
+            print("ONNX: price_prediction_pipeline.onnx (or scaler + model .onnx) not found, using pickles")
+            return None
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            print("ONNX: onnxruntime is not installed, using pickles")
+            return None
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sessions = [ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+                    for path in paths]
+        engine = cls(sessions, n_features)
+        engine.paths = paths
+        return engine
+    
+    def _buffer(self) -> np.ndarray:
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = np.empty((self.buffer_rows, self.n_features), dtype=np.float32)
+        return buffer
+    
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """X chưa scale (n_rows, n_features) -> giá dự đoán float64 (n_rows,)"""
+        buffer = self._buffer()
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), self.buffer_rows):
+            block = X[start:start + self.buffer_rows]
+            inputs = buffer[:len(block)]
+            np.copyto(inputs, block, casting='same_kind')
+            for session, input_name in self.sessions:
+                inputs = session.run(None, {input_name: inputs})[0]
+            out[start:start + len(block)] = inputs.reshape(-1)
+        return out
+
+def load_prediction_engine(models_dir, model, scaler, n_features):
+    """
+    Engine theo PREDICTION_ENGINE; ONNX không load được hoặc lệch pickle -> compiled / sklearn
+    
+    Returns: OnnxPricePredictor | CompiledTreeEnsemble | None (None = scaler + model.predict)
+    """
+    if PREDICTION_ENGINE == 'onnx':
+        engine = OnnxPricePredictor.load(models_dir, n_features)
+        if engine is not None:
+            if engine_matches(engine, model, scaler, n_features):
+                return engine
+            print(f"ONNX: {', '.join(engine.paths)} do not match the pickles, using pickles")
+    return compile_prediction_model(model, scaler)
+
+# ============================================================================
+# LISTING TABLE (columnar)
+# ============================================================================
+
+LISTING_NUMERIC_COLUMNS = ['price', 'area', 'rooms', 'toilets', 'floors', 'lat', 'lng']
+LISTING_STRING_COLUMNS = ['title', 'district', 'ward']
+TITLE_MAX_LENGTH = 100
+
+class StringTable:
+    """Cột string dạng dictionary: các giá trị unique + code int32 cho từng dòng"""
+    
+    def __init__(self, vocab, codes: np.ndarray):
+        self.vocab = np.array(vocab, dtype=object)
+        self.codes = codes
+    
+    @classmethod
+    def from_values(cls, values):
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        # Giá trị thiếu (code -1) trỏ tới '' ở cuối vocab
+        vocab = [str(value) for value in uniques] + ['']
+        return cls(vocab, np.where(codes < 0, len(uniques), codes).astype(np.int32))
+    
+    def take(self, indices) -> np.ndarray:
+        return self.vocab[self.codes[indices]]
+
+def nullable_ints(values: np.ndarray) -> list:
+    """float array (NaN = thiếu) -> list int/None"""
+    missing = np.isnan(values)
+    ints = np.where(missing, 0, values).astype(np.int64).tolist()
+    return [None if m else v for v, m in zip(ints, missing.tolist())]
+
+def nullable_floats(values: np.ndarray) -> list:
+    missing = np.isnan(values)
+    return [None if m else v for v, m in zip(values.tolist(), missing.tolist())]
+
+class ListingTable:
+    """
+    Listing data của recommendation_df ở dạng cột, build 1 lần lúc load models
+    
+    Response được build bằng 1 lần fancy-index cho mỗi cột thay vì iloc từng dòng.
+    """
+    
+    def __init__(self, numeric: Dict[str, np.ndarray], strings: Dict[str, StringTable]):
+        self.numeric = numeric
+        self.strings = strings
+        self.n_rows = len(numeric['price'])
+    
+    @classmethod
+    def from_dataframe(cls, df):
+        numeric = {col: df[col].to_numpy(dtype=np.float64) for col in LISTING_NUMERIC_COLUMNS}
+        strings = {}
+        for col in LISTING_STRING_COLUMNS:
+            values = df[col] if col in df.columns else [None] * len(df)
+            if col == 'title':
+                values = [value[:TITLE_MAX_LENGTH] if isinstance(value, str) else value for value in values]
+            strings[col] = StringTable.from_values(values)
+        return cls(numeric, strings)
+    
+    def save(self, directory):
+        """Numeric columns + string codes -> .npy, vocab -> listing_strings.json"""
+        for col, values in self.numeric.items():
+            save_npy_atomic(f'{directory}/listing_{col}.npy', values)
+        for col, table in self.strings.items():
+            save_npy_atomic(f'{directory}/listing_{col}_codes.npy', table.codes)
+        vocab = {col: table.vocab.tolist() for col, table in self.strings.items()}
+        save_json_atomic(f'{directory}/listing_strings.json', vocab)
+    
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        numeric = {
+            col: np.load(f'{directory}/listing_{col}.npy', mmap_mode=mmap_mode)
+            for col in LISTING_NUMERIC_COLUMNS
+        }
+        with open(f'{directory}/listing_strings.json', 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        strings = {
+            col: StringTable(vocab[col], np.load(f'{directory}/listing_{col}_codes.npy', mmap_mode=mmap_mode))
+            for col in LISTING_STRING_COLUMNS
+        }
+        return cls(numeric, strings)
+    
+    @classmethod
+    def concat(cls, tables):
+        """Nối nhiều bảng (vocab được gộp, codes map sang vocab chung)"""
+        numeric = {col: np.concatenate([table.numeric[col] for table in tables]) for col in LISTING_NUMERIC_COLUMNS}
+        strings = {}
+        for col in LISTING_STRING_COLUMNS:
+            vocab = pd.Index(np.concatenate([table.strings[col].vocab for table in tables])).unique()
+            codes = [vocab.get_indexer(table.strings[col].vocab)[table.strings[col].codes] for table in tables]
+            strings[col] = StringTable(vocab.tolist(), np.concatenate(codes).astype(np.int32))
+        return cls(numeric, strings)
+    
+    def take_numeric(self, col, indices) -> np.ndarray:
+        return self.numeric[col][indices]
+    
+    def take_strings(self, col, indices) -> np.ndarray:
+        return self.strings[col].take(indices)
+    
+    def records(self, indices, similarity_scores) -> List[Dict[str, Any]]:
+        """Build list recommendation (rank theo thứ tự indices)"""
+        indices = np.asarray(indices)
+        numeric = {col: self.take_numeric(col, indices) for col in LISTING_NUMERIC_COLUMNS}
+        prices = numeric['price'].tolist()
+        
+        columns = zip(
+            similarity_scores.tolist(),
+            prices,
+            numeric['area'].tolist(),
+            nullable_ints(numeric['rooms']),
+            nullable_ints(numeric['toilets']),
+            nullable_ints(numeric['floors']),
+            self.take_strings('district', indices).tolist(),
+            self.take_strings('ward', indices).tolist(),
+            self.take_strings('title', indices).tolist(),
+            nullable_floats(numeric['lat']),
+            nullable_floats(numeric['lng']),
+        )
+        return [
+            {
+                "rank": i + 1,
+                "similarity_score": round(score, 4),
+                "price": price,
+                "price_billions": round(price / 1e9, 2),
+                "area": area,
+                "rooms": rooms,
+                "toilets": toilets,
+                "floors": floors,
+                "district": district,
+                "ward": ward,
+                "title": title,
+                "lat": lat,
+                "lng": lng,
+            }
+            for i, (score, price, area, rooms, toilets, floors, district, ward, title, lat, lng) in enumerate(columns)
+        ]
+
+# ============================================================================
+# COSINE TOP-K ENGINE
+# ============================================================================
+
+def l2_normalize(X: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa L2 theo dòng (dòng toàn 0 giữ nguyên, giống sklearn.preprocessing.normalize)"""
+    norms = np.sqrt(np.einsum('ij,ij->i', X, X))
+    norms[norms == 0] = 1
+    return X / norms[:, None]
+
+def unit_matrix(X: np.ndarray) -> np.ndarray:
+    """Ma trận L2-normalize dạng float32 C-contiguous dùng để score"""
+    return np.ascontiguousarray(l2_normalize(np.asarray(X, dtype=np.float64)), dtype=np.float32)
+
+def check_n_neighbors(k, n_samples):
+    """Cùng điều kiện và message lỗi như NearestNeighbors.kneighbors"""
+    if k <= 0:
+        raise ValueError(f"Expected n_neighbors > 0. Got {k}")
+    if k > n_samples:
+        raise ValueError(f"Expected n_neighbors <= n_samples_fit, but n_neighbors = {k}, n_samples_fit = {n_samples}")
+
+def rerank_cosine(X: np.ndarray, candidates: np.ndarray, queries_unit: np.ndarray, k: int):
+    """
+    Tính lại cosine distance float64 cho candidates (n_queries, pool) và lấy top-k
+    
+    Sort theo distance, hòa thì index nhỏ trước.
+    """
+    candidate_unit = X[candidates]
+    candidate_unit /= np.maximum(np.sqrt(np.einsum('qpd,qpd->qp', candidate_unit, candidate_unit)), 1e-300)[..., None]
+    distances = 1 - np.einsum('qpd,qd->qp', candidate_unit, queries_unit)
+    np.clip(distances, 0, 2, out=distances)
+    
+    order = np.lexsort((candidates, distances), axis=-1)[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+class CosineTopK:
+    """
+    Exact cosine top-k trên recommendation_X_scaled (thay cho NearestNeighbors.kneighbors)
+    
+    - Ma trận được L2-normalize 1 lần thành float32 C-contiguous
+    - Query: 1 phép matrix-vector (batch: matrix-matrix) + np.argpartition
+    - Candidates được re-rank bằng float64 nên kết quả giống kneighbors(metric='cosine')
+    """
+    
+    name = 'exact'
+    
+    # Số candidate dư khi chọn bằng float32, bù cho sai số làm tròn
+    RERANK_MARGIN = 32
+    # Giới hạn số phần tử của ma trận score mỗi chunk khi query theo batch
+    BATCH_SCORE_ELEMENTS = 1 << 24
+    
+    def __init__(self, X: np.ndarray, unit: Optional[np.ndarray] = None):
+        self.X = np.asarray(X, dtype=np.float64)
+        self.n_samples, self.n_features = self.X.shape
+        # unit có thể là .npy mmap dùng chung giữa các worker
+        self.unit = unit if unit is not None else unit_matrix(self.X)
+    
+    def _select(self, scores: np.ndarray, queries_unit: np.ndarray, k: int):
+        """Chọn top-k từ score float32 (n_queries, n_samples), re-rank candidates bằng float64"""
+        pool = min(k + self.RERANK_MARGIN, self.n_samples)
+        if pool < self.n_samples:
+            kth = self.n_samples - pool
+            candidates = np.argpartition(scores, kth, axis=1)[:, kth:]
+        else:
+            candidates = np.broadcast_to(np.arange(self.n_samples), scores.shape)
+        
+        return rerank_cosine(self.X, candidates, queries_unit, k)
+    
+    def search(self, query: np.ndarray, k: int):
+        """Returns: (distances, indices) shape (k,)"""
+        distances, indices = self.search_batch(np.asarray(query).reshape(1, -1), k)
+        return distances[0], indices[0]
+    
+    def search_batch(self, queries: np.ndarray, k: int):
+        """Returns: (distances, indices) shape (n_queries, k)"""
+        check_n_neighbors(k, self.n_samples)
+        queries_unit = l2_normalize(np.asarray(queries, dtype=np.float64).reshape(-1, self.n_features))
+        if len(queries_unit) == 1:
+            scores = (self.unit @ queries_unit[0].astype(np.float32))[None, :]
+            return self._select(scores, queries_unit, k)
+        
+        distances, indices = [], []
+        chunk = max(1, self.BATCH_SCORE_ELEMENTS // self.n_samples)
+        for start in range(0, len(queries_unit), chunk):
+            block = queries_unit[start:start + chunk]
+            block_distances, block_indices = self._select(block.astype(np.float32) @ self.unit.T, block, k)
+            distances.append(block_distances)
+            indices.append(block_indices)
+        
+        return np.concatenate(distances), np.concatenate(indices)
+
+# ============================================================================
+# APPROXIMATE NEAREST NEIGHBOURS (IVF)
+# ============================================================================
+
+RECOMMENDATION_INDEX = os.environ.get('RECOMMENDATION_INDEX', 'exact')  # 'exact' | 'ivf'
+RECOMMENDATION_NPROBE = int(os.environ.get('RECOMMENDATION_NPROBE', '8'))
+IVF_INDEX_FILE = 'recommendation_ivf.npz'
+
+def spherical_kmeans(unit: np.ndarray, n_lists: int, n_iter: int = 20, seed: int = 0, chunk_rows: int = 65536):
+    """K-means trên vector đã L2-normalize (gán theo cosine similarity lớn nhất)"""
+    rng = np.random.default_rng(seed)
+    centroids = unit[rng.choice(len(unit), size=n_lists, replace=False)].copy()
+    
+    for _ in range(n_iter):
+        assign = assign_to_centroids(unit, centroids, chunk_rows)
+        sums = np.stack([np.bincount(assign, weights=unit[:, j], minlength=n_lists) for j in range(unit.shape[1])], axis=1)
+        counts = np.bincount(assign, minlength=n_lists)
+        
+        # List rỗng -> khởi tạo lại bằng 1 điểm ngẫu nhiên
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = unit[rng.choice(len(unit), size=len(empty), replace=False)]
+        centroids = l2_normalize(sums).astype(np.float32)
+    
+    return centroids
+
+def assign_to_centroids(unit: np.ndarray, centroids: np.ndarray, chunk_rows: int = 65536) -> np.ndarray:
+    assign = np.empty(len(unit), dtype=np.int64)
+    for start in range(0, len(unit), chunk_rows):
+        assign[start:start + chunk_rows] = np.argmax(unit[start:start + chunk_rows] @ centroids.T, axis=1)
+    return assign
+
+class IVFIndex:
+    """
+    Inverted-file index trên k-means centroids (cosine)
+    
+    Query chỉ score các dòng thuộc nprobe list gần nhất, rồi re-rank float64 như CosineTopK.
+    Build offline bằng scripts/build_ann_index.py, load trong load_models khi RECOMMENDATION_INDEX=ivf.
+    """
+    
+    name = 'ivf'
+    
+    def __init__(self, X: np.ndarray, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray,
+                 nprobe: int = 8, unit: Optional[np.ndarray] = None):
+        self.X = np.asarray(X, dtype=np.float64)
+        self.n_samples, self.n_features = self.X.shape
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+        self.n_lists = len(self.centroids)
+        self.nprobe = nprobe
+        if len(self.list_ids) != self.n_samples or self.list_offsets[-1] != self.n_samples:
+            raise ValueError(f"IVF index covers {len(self.list_ids):,} rows, feature matrix has {self.n_samples:,}")
+        
+        # Dùng chung ma trận unit với exact search (có thể là mmap)
+        self.unit = unit if unit is not None else unit_matrix(self.X)
+    
+    @classmethod
+    def build(cls, X: np.ndarray, n_lists: Optional[int] = None, n_iter: int = 20, seed: int = 0,
+              train_size: Optional[int] = None, nprobe: int = 8):
+        X = np.asarray(X, dtype=np.float64)
+        unit = l2_normalize(X).astype(np.float32)
+        n_lists = n_lists or max(1, int(4 * np.sqrt(len(X))))
+        
+        # Train k-means trên sample (mặc định 64 điểm / list)
+        rng = np.random.default_rng(seed)
+        train_size = min(len(X), train_size or 64 * n_lists)
+        train = unit[rng.choice(len(X), size=train_size, replace=False)] if train_size < len(X) else unit
+        centroids = spherical_kmeans(train, n_lists, n_iter=n_iter, seed=seed)
+        
+        assign = assign_to_centroids(unit, centroids)
+        list_ids = np.argsort(assign, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        return cls(X, centroids, list_offsets, list_ids, nprobe=nprobe, unit=unit)
+    
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, list_offsets=self.list_offsets, list_ids=self.list_ids)
+    
+    @classmethod
+    def load(cls, path, X: np.ndarray, nprobe: int = 8, unit: Optional[np.ndarray] = None):
+        with np.load(path) as data:
+            return cls(X, data['centroids'], data['list_offsets'], data['list_ids'], nprobe=nprobe, unit=unit)
+    
+    def _probe(self, query_unit: np.ndarray, k: int, nprobe: int) -> np.ndarray:
+        """Index các dòng thuộc nprobe list gần nhất - probe thêm nếu chưa đủ k"""
+        scores = self.centroids @ query_unit.astype(np.float32)
+        lists = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < self.n_lists else np.arange(self.n_lists)
+        starts, ends = self.list_offsets[lists], self.list_offsets[lists + 1]
+        if (ends - starts).sum() < k:
+            order = np.argsort(-scores)
+            sizes = np.diff(self.list_offsets)[order]
+            lists = order[:int(np.searchsorted(np.cumsum(sizes), k)) + 1]
+            starts, ends = self.list_offsets[lists], self.list_offsets[lists + 1]
+        return np.concatenate([self.list_ids[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+    
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None):
+        """Returns: (distances, indices) shape (k,)"""
+        distances, indices = self.search_batch(np.asarray(query).reshape(1, -1), k, nprobe)
+        return distances[0], indices[0]
+    
+    def search_batch(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None):
+        """Returns: (distances, indices) shape (n_queries, k)"""
+        check_n_neighbors(k, self.n_samples)
+        nprobe = nprobe or self.nprobe
+        queries_unit = l2_normalize(np.asarray(queries, dtype=np.float64).reshape(-1, self.n_features))
+        
+        distances = np.empty((len(queries_unit), k), dtype=np.float64)
+        indices = np.empty((len(queries_unit), k), dtype=np.int64)
+        for i, query_unit in enumerate(queries_unit):
+            candidates = self._probe(query_unit, k, nprobe)
+            scores = self.unit[candidates] @ query_unit.astype(np.float32)
+            pool = min(k + CosineTopK.RERANK_MARGIN, len(candidates))
+            if pool < len(candidates):
+                candidates = candidates[np.argpartition(scores, len(candidates) - pool)[len(candidates) - pool:]]
+            row_distances, row_indices = rerank_cosine(self.X, candidates[None, :], query_unit[None, :], k)
+            distances[i], indices[i] = row_distances[0], row_indices[0]
+        
+        return distances, indices
+
+def load_recommendation_index(models_dir, X, unit=None):
+    """Chọn search backend theo RECOMMENDATION_INDEX (fallback exact nếu chưa build IVF)"""
+    if RECOMMENDATION_INDEX == 'ivf':
+        path = f'{models_dir}/{IVF_INDEX_FILE}'
+        if os.path.exists(path):
+            return IVFIndex.load(path, X, nprobe=RECOMMENDATION_NPROBE, unit=unit)
+        print(f"IVF index not found: {path} - falling back to exact search")
+    elif RECOMMENDATION_INDEX != 'exact':
+        raise ValueError(f"Unknown RECOMMENDATION_INDEX: {RECOMMENDATION_INDEX} (expected 'exact' or 'ivf')")
+    return CosineTopK(X, unit=unit)
+
+# ============================================================================
+# MEMORY-MAPPED ARTIFACTS
+# ============================================================================
+
+# models/mmap/: ma trận feature + listing columns dạng .npy, mở bằng mmap_mode='r'
+# để các uvicorn worker dùng chung page cache thay vì mỗi worker 1 bản unpickle
+MMAP_DIR = 'mmap'
+MMAP_SOURCES = ['recommendation_X_scaled.pkl', 'recommendation_df.pkl']
+
+def save_npy_atomic(path, array):
+    # Ghi file tạm rồi rename: worker khác không bao giờ đọc phải file ghi dở
+    tmp_path = f'{path}.tmp-{os.getpid()}.npy'
+    np.save(tmp_path, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+def save_json_atomic(path, data):
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def mmap_sources_mtime(models_dir):
+    paths = [f'{models_dir}/{name}' for name in MMAP_SOURCES]
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0.0)
+
+def mmap_artifacts_fresh(models_dir):
+    """manifest.json tồn tại và mới hơn các pickle nguồn (không có pickle -> dùng luôn mmap)"""
+    manifest_path = f'{models_dir}/{MMAP_DIR}/manifest.json'
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest.get('source_mtime', 0.0) >= mmap_sources_mtime(models_dir)
+
+def export_mmap_artifacts(models_dir, X, df):
+    """Ghi recommendation_X_scaled / unit matrix / listing columns ra models/mmap/ (manifest ghi sau cùng)"""
+    directory = f'{models_dir}/{MMAP_DIR}'
+    os.makedirs(directory, exist_ok=True)
+    X = np.asarray(X, dtype=np.float64)
+    
+    save_npy_atomic(f'{directory}/recommendation_X_scaled.npy', X)
+    save_npy_atomic(f'{directory}/recommendation_X_unit.npy', unit_matrix(X))
+    ListingTable.from_dataframe(df).save(directory)
+    save_json_atomic(f'{directory}/manifest.json', {
+        'n_samples': len(X),
+        'n_features': X.shape[1],
+        'source_mtime': mmap_sources_mtime(models_dir),
+    })
+
+# ============================================================================
+# PRECOMPUTED NEIGHBOUR TABLE (/recommend/by-id)
+# ============================================================================
+
+# Top-K hàng xóm của mọi nhà, build offline bằng scripts/build_neighbor_table.py
+NEIGHBOR_IDS_FILE = 'recommendation_neighbor_ids.npy'
+NEIGHBOR_DISTANCES_FILE = 'recommendation_neighbor_distances.npy'
+NEIGHBOR_TABLE_K = 50
+
+class NeighborTable:
+    """
+    ids (N, K+1) int32 + distances (N, K+1) float16, mỗi dòng sort theo (distance, index)
+    
+    K+1 cột vì chính nhà đó (hoặc nhà trùng lặp) chiếm 1 chỗ. /recommend/by-id chỉ slice dòng này
+    rồi tính lại distance float64 cho vài candidate, nên score giống hệt live search.
+    """
+    
+    def __init__(self, ids: np.ndarray, distances: np.ndarray):
+        if ids.shape != distances.shape:
+            raise ValueError(f"neighbor ids {ids.shape} and distances {distances.shape} differ")
+        self.ids = ids
+        self.distances = distances
+        self.n_samples, self.width = ids.shape
+        self.k = self.width - 1
+    
+    @classmethod
+    def build(cls, index: CosineTopK, k: int = NEIGHBOR_TABLE_K, block_rows: int = 4096, progress=None):
+        """Top-(k+1) cho mọi dòng của index.X, query theo block để memory chỉ phụ thuộc block_rows"""
+        n = index.n_samples
+        width = min(k + 1, n)
+        ids = np.empty((n, width), dtype=np.int32)
+        distances = np.empty((n, width), dtype=np.float16)
+        for start in range(0, n, block_rows):
+            stop = min(start + block_rows, n)
+            block_distances, block_ids = index.search_batch(index.X[start:stop], width)
+            ids[start:stop] = block_ids
+            distances[start:stop] = block_distances
+            if progress is not None:
+                progress(stop, n)
+        return cls(ids, distances)
+    
+    def save(self, models_dir):
+        save_npy_atomic(f'{models_dir}/{NEIGHBOR_IDS_FILE}', self.ids)
+        save_npy_atomic(f'{models_dir}/{NEIGHBOR_DISTANCES_FILE}', self.distances)
+    
+    @classmethod
+    def load(cls, models_dir, mmap_mode='r'):
+        return cls(
+            np.load(f'{models_dir}/{NEIGHBOR_IDS_FILE}', mmap_mode=mmap_mode),
+            np.load(f'{models_dir}/{NEIGHBOR_DISTANCES_FILE}', mmap_mode=mmap_mode),
+        )
+    
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.distances.nbytes
+    
+    def lookup(self, X: np.ndarray, house_id: int, k: int):
+        """
+        Top-k của house_id (gồm cả chính nó) từ bảng - chỉ hợp lệ khi k <= width
+        
+        Returns: (distances float64, indices) như CosineTopK.search
+        """
+        # k âm sẽ slice từ cuối hàng thay vì báo lỗi
+        if not 0 < k <= self.width:
+            raise ValueError(f"Expected 0 < k <= {self.width}. Got {k}")
+        candidates = np.asarray(self.ids[house_id, :k], dtype=np.int64)
+        query_unit = l2_normalize(np.asarray(X[house_id], dtype=np.float64).reshape(1, -1))
+        distances, indices = rerank_cosine(X, candidates[None, :], query_unit, k)
+        return distances[0], indices[0]
+
+def load_neighbor_table(models_dir, n_samples) -> Optional[NeighborTable]:
+    """Bảng hàng xóm nếu đã build và còn khớp recommendation_X_scaled, không thì None (live search)"""
+    path = f'{models_dir}/{NEIGHBOR_IDS_FILE}'
+    if not os.path.exists(path):
+        return None
+    if os.path.getmtime(path) < mmap_sources_mtime(models_dir):
+        print(f"Neighbor table older than recommendation_X_scaled - ignoring {path}")
+        return None
+    table = NeighborTable.load(models_dir)
+    if table.n_samples != n_samples:
+        print(f"Neighbor table has {table.n_samples:,} rows, expected {n_samples:,} - ignoring")
+        return None
+    return table
+
+# ============================================================================
+# DELTA SEGMENTS - listing mới giữa 2 lần rebuild
+# ============================================================================
+
+# <version>/delta/: segment append-only (listing mới đã scale bằng recommendation_scaler +
+# encoders của version, không fit lại) + tombstones (house id bị ẩn: tin hết hạn / đã bán / bị
+# tin re-push thay thế). House id của delta nối tiếp base: base_rows, base_rows + 1, ...
+# Ghi bởi scripts/delta_index.py; manifest.json ghi sau cùng nên reader chỉ thấy segment đã ghi xong.
+DELTA_DIR = 'delta'
+DELTA_MANIFEST_FILE = 'manifest.json'
+DELTA_TOMBSTONES_FILE = 'tombstones.npy'
+
+def delta_mtime(models_dir):
+    path = f'{models_dir}/{DELTA_DIR}/{DELTA_MANIFEST_FILE}'
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+def read_delta_manifest(models_dir) -> Optional[Dict[str, Any]]:
+    path = f'{models_dir}/{DELTA_DIR}/{DELTA_MANIFEST_FILE}'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_delta_segment(directory, X, ad_ids, df):
+    """1 segment: X đã scale + ad id (NaN = không rõ) + listing columns (.npy) + df cho lúc compact"""
+    os.makedirs(directory)
+    save_npy_atomic(f'{directory}/recommendation_X_scaled.npy', np.asarray(X, dtype=np.float64))
+    save_npy_atomic(f'{directory}/ad_ids.npy', np.asarray(ad_ids, dtype=np.float64))
+    ListingTable.from_dataframe(df).save(directory)
+    joblib.dump(df, f'{directory}/recommendation_df.pkl')
+
+class DeltaSegments:
+    """
+    Các segment của delta/ gộp lại trong memory (nhỏ so với base) + mask tombstone
+    
+    dead có độ dài base_rows + n_rows: True = house id bị ẩn khỏi mọi kết quả.
+    """
+    
+    def __init__(self, base_rows, X, ad_ids, listing_table, tombstones, segments):
+        self.base_rows = base_rows
+        self.X = X
+        self.ad_ids = ad_ids
+        self.listing_table = listing_table
+        self.segments = segments
+        self.n_rows = len(X)
+        self.dead = np.zeros(base_rows + self.n_rows, dtype=bool)
+        self.dead[tombstones[(tombstones >= 0) & (tombstones < len(self.dead))]] = True
+        self.n_tombstones = int(self.dead.sum())
+        self.index = CosineTopK(X) if self.n_rows else None
+        self.filter_index = ListingFilterIndex(listing_table) if self.n_rows else None
+    
+    @classmethod
+    def load(cls, models_dir, manifest, n_features):
+        directory = f'{models_dir}/{DELTA_DIR}'
+        names = [segment['name'] for segment in manifest['segments']]
+        X = [np.load(f'{directory}/{name}/recommendation_X_scaled.npy') for name in names]
+        ad_ids = [np.load(f'{directory}/{name}/ad_ids.npy') for name in names]
+        tables = [ListingTable.load(f'{directory}/{name}', mmap_mode=None) for name in names]
+        tombstones_path = f'{directory}/{DELTA_TOMBSTONES_FILE}'
+        tombstones = np.load(tombstones_path) if os.path.exists(tombstones_path) else np.empty(0, dtype=np.int64)
+        return cls(
+            manifest['base_rows'],
+            np.concatenate(X) if X else np.empty((0, n_features)),
+            np.concatenate(ad_ids) if ad_ids else np.empty(0),
+            ListingTable.concat(tables) if tables else None,
+            tombstones,
+            names,
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"segments": len(self.segments), "rows": self.n_rows, "tombstones": self.n_tombstones}
+
+def load_delta_segments(models_dir, base_rows, n_features) -> Optional[DeltaSegments]:
+    """delta/ của version nếu có và còn khớp base, không thì None"""
+    manifest = read_delta_manifest(models_dir)
+    if manifest is None:
+        return None
+    if manifest['base_rows'] != base_rows:
+        print(f"Delta segments were built for {manifest['base_rows']:,} base rows, found {base_rows:,} - ignoring")
+        return None
+    delta = DeltaSegments.load(models_dir, manifest, n_features)
+    if delta.n_rows and delta.X.shape[1] != n_features:
+        raise ValueError(f"Delta segments have {delta.X.shape[1]} features, expected {n_features}")
+    return delta
+
+class SegmentedIndex:
+    """
+    Base index + delta segment
+    
+    Mỗi phần tìm top-(k + số tombstone của phần đó) nên luôn còn đủ k dòng sống, tombstone bị
+    đẩy xuống cuối (distance inf) rồi merge theo (distance, house id) - cùng thứ tự hòa như CosineTopK.
+    Không có tombstone và delta rỗng thì kết quả giống hệt base.
+    """
+    
+    def __init__(self, base, delta: DeltaSegments):
+        self.base = base
+        self.delta = delta
+        self.name = f'{base.name}+delta'
+        self.n_features = base.n_features
+        self.n_samples = base.n_samples + delta.n_rows
+        self.n_live = self.n_samples - delta.n_tombstones
+        self.parts = [(base, 0, int(delta.dead[:base.n_samples].sum()))]
+        if delta.n_rows:
+            self.parts.append((delta.index, base.n_samples, int(delta.dead[base.n_samples:].sum())))
+    
+    def _merge(self, distances, indices, k):
+        distances = np.where(self.delta.dead[indices], np.inf, distances)
+        order = np.lexsort((indices, distances), axis=-1)[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+    
+    def search(self, query: np.ndarray, k: int):
+        """Returns: (distances, indices) shape (k,)"""
+        distances, indices = self.search_batch(np.asarray(query).reshape(1, -1), k)
+        return distances[0], indices[0]
+    
+    def search_batch(self, queries: np.ndarray, k: int):
+        """Returns: (distances, indices) shape (n_queries, k)"""
+        check_n_neighbors(k, self.n_live)
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.n_features)
+        distances, indices = [], []
+        for index, offset, n_dead in self.parts:
+            part_distances, part_indices = index.search_batch(queries, min(k + n_dead, index.n_samples))
+            distances.append(part_distances)
+            indices.append(part_indices + offset)
+        return self._merge(np.concatenate(distances, axis=1), np.concatenate(indices, axis=1), k)
+    
+    def merge_base_result(self, query: np.ndarray, distances: np.ndarray, indices: np.ndarray, k: int):
+        """
+        Top-k khi top-k của base đã có sẵn (neighbour table): chỉ cần search thêm delta
+        
+        Returns None nếu 1 candidate của base đã bị tombstone (không biết dòng thay thế -> live search)
+        """
+        if self.delta.dead[indices].any():
+            return None
+        distances, indices = distances[None, :], indices[None, :]
+        if self.delta.n_rows:
+            index, offset, n_dead = self.parts[1]
+            delta_distances, delta_indices = index.search_batch(np.asarray(query).reshape(1, -1),
+                                                                min(k + n_dead, index.n_samples))
+            distances = np.concatenate([distances, delta_distances], axis=1)
+            indices = np.concatenate([indices, delta_indices + offset], axis=1)
+        distances, indices = self._merge(distances, indices, k)
+        return distances[0], indices[0]
+
+class SegmentedListingTable(ListingTable):
+    """Listing của base (mmap) + delta (memory), không copy base"""
+    
+    def __init__(self, base: ListingTable, delta: ListingTable):
+        self.base = base
+        self.delta = delta
+        self.n_rows = base.n_rows + delta.n_rows
+    
+    def _take(self, take, col, indices):
+        indices = np.asarray(indices)
+        in_delta = indices >= self.base.n_rows
+        if not in_delta.any():
+            return take(self.base, col, indices)
+        base_values = take(self.base, col, indices[~in_delta])
+        delta_values = take(self.delta, col, indices[in_delta] - self.base.n_rows)
+        values = np.empty(indices.shape, dtype=np.result_type(base_values, delta_values))
+        values[~in_delta] = base_values
+        values[in_delta] = delta_values
+        return values
+    
+    def take_numeric(self, col, indices) -> np.ndarray:
+        return self._take(ListingTable.take_numeric, col, indices)
+    
+    def take_strings(self, col, indices) -> np.ndarray:
+        return self._take(ListingTable.take_strings, col, indices)
+
+# ============================================================================
+# FILTERED SEARCH (district / ward / price / area / rooms)
+# ============================================================================
+
+# District bonus được cộng trên n * DISTRICT_RERANK_POOL hàng xóm rồi mới cắt còn n
+DISTRICT_RERANK_POOL = int(os.environ.get('DISTRICT_RERANK_POOL', '4'))
+# Candidates >= 1/FILTER_FULL_SCAN_RATIO số dòng: score cả ma trận 1 lần rẻ hơn gather từng dòng
+FILTER_FULL_SCAN_RATIO = 4
+FILTER_POSTINGS = ['district', 'ward']
+FILTER_RANGES = {'price': ('price_min', 'price_max'), 'area': ('area_min', 'area_max'), 'rooms': ('rooms_min', None)}
+
+class ListingFilterIndex:
+    """
+    Posting list (row ids tăng dần) cho mỗi district / ward + thứ tự sort theo price / area / rooms
+    
+    rows(filters) chỉ materialize điều kiện hẹp nhất (1 posting list hoặc 1 khoảng đã sort),
+    các điều kiện còn lại được kiểm tra trên tập đó.
+    """
+    
+    def __init__(self, table: ListingTable):
+        self.n_rows = table.n_rows
+        self.postings = {}
+        for col in FILTER_POSTINGS:
+            strings = table.strings[col]
+            codes = np.asarray(strings.codes)
+            order = np.argsort(codes, kind='stable').astype(np.int64)
+            offsets = np.searchsorted(codes[order], np.arange(len(strings.vocab) + 1))
+            lookup = {value: code for code, value in enumerate(strings.vocab.tolist()) if value}
+            self.postings[col] = (lookup, codes, order, offsets)
+        self.sorted = {}
+        for col in FILTER_RANGES:
+            values = np.asarray(table.numeric[col])
+            order = np.argsort(values, kind='stable')[:int((~np.isnan(values)).sum())]  # bỏ NaN (ở cuối)
+            self.sorted[col] = (values, values[order], order.astype(np.int64))
+    
+    def conditions(self, filters: RecommendationFilters):
+        """[(số dòng thỏa, col, low, high)]; với district / ward low = high = code"""
+        conditions = []
+        for col in FILTER_POSTINGS:
+            value = getattr(filters, col)
+            if value is not None:
+                lookup, _, _, offsets = self.postings[col]
+                code = lookup.get(value, -1)
+                size = int(offsets[code + 1] - offsets[code]) if code >= 0 else 0
+                conditions.append((size, col, code, code))
+        for col, (low_name, high_name) in FILTER_RANGES.items():
+            low = getattr(filters, low_name)
+            high = getattr(filters, high_name) if high_name else None
+            if low is not None or high is not None:
+                low = -np.inf if low is None else low
+                high = np.inf if high is None else high
+                _, sorted_values, _ = self.sorted[col]
+                size = int(np.searchsorted(sorted_values, high, 'right') - np.searchsorted(sorted_values, low, 'left'))
+                conditions.append((max(size, 0), col, low, high))
+        return conditions
+    
+    def _materialize(self, col, low, high) -> np.ndarray:
+        if col in self.postings:
+            _, _, order, offsets = self.postings[col]
+            return order[offsets[low]:offsets[low + 1]] if low >= 0 else order[:0]
+        _, sorted_values, order = self.sorted[col]
+        rows = order[np.searchsorted(sorted_values, low, 'left'):np.searchsorted(sorted_values, high, 'right')]
+        if len(rows) * 16 < self.n_rows:
+            return np.sort(rows)
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return np.flatnonzero(mask)
+    
+    def _check(self, rows, col, low, high) -> np.ndarray:
+        if col in self.postings:
+            return np.asarray(self.postings[col][1][rows]) == low
+        values = self.sorted[col][0][rows]
+        return (values >= low) & (values <= high)
+    
+    def rows(self, filters: RecommendationFilters) -> Optional[np.ndarray]:
+        """Row ids (tăng dần) thỏa mọi điều kiện; None nếu filters không có điều kiện nào"""
+        conditions = sorted(self.conditions(filters), key=lambda condition: condition[0])
+        if not conditions:
+            return None
+        if conditions[0][0] * FILTER_FULL_SCAN_RATIO >= self.n_rows:
+            # Không điều kiện nào hẹp: so sánh cả cột (liên tục trong memory) nhanh hơn đi qua index
+            mask = np.ones(self.n_rows, dtype=bool)
+            for _, col, low, high in conditions:
+                mask &= self._check(slice(None), col, low, high)
+            return np.flatnonzero(mask)
+        _, col, low, high = conditions[0]
+        rows = self._materialize(col, low, high)
+        for _, col, low, high in conditions[1:]:
+            if not len(rows):
+                break
+            rows = rows[self._check(rows, col, low, high)]
+        return rows
 
 # ============================================================================
-# PYDANTIC MODELS
+# MODEL REGISTRY - versioned artifacts + hot reload
 # ============================================================================
 
-class PredictRequest(BaseModel):
-    area: float
-    rooms: Optional[float] = None
-    toilets: Optional[float] = None
-    floors: Optional[float] = None
-    width: Optional[float] = None
-    length: Optional[float] = None
-    lat: Optional[float] = None
-    lng: Optional[float] = None
-    district: Optional[str] = None
-    ward: Optional[str] = None
-    legal: Optional[str] = None
-    seller_type: Optional[str] = None
+# models/<version>/ chứa 1 bộ artifacts đầy đủ; version mới nhất = tên lớn nhất (natural sort,
+# vd. 2024-06-01_1200 hoặc v2 < v10). Nếu không có version nào thì dùng thẳng models/ (layout cũ).
+MODELS_ROOT = os.environ.get('MODELS_DIR', 'models')
+ROOT_VERSION = 'root'
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '0'))  # giây, 0 = không watch
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # /admin/* cần header X-Admin-Token; không set = tắt /admin/* (404)
+REQUIRED_ARTIFACTS = [
+    'price_prediction_model.pkl',
+    'price_prediction_scaler.pkl',
+    'price_prediction_features.pkl',
+    'price_prediction_encoders.pkl',
+    'recommendation_scaler.pkl',
+    'recommendation_features.pkl',
+    'recommendation_encoders.pkl',
+]
+# Encoders lúc train của notebook 01 (price_prediction_encoders.pkl của notebook là {})
+NOTEBOOK_LABEL_ENCODERS = 'label_encoders.pkl'
 
-class RecommendByFeaturesRequest(BaseModel):
-    price: float
-    area: float
-    rooms: Optional[float] = None
-    toilets: Optional[float] = None
-    floors: Optional[float] = None
-    district: Optional[str] = None
-    lat: Optional[float] = None
-    lng: Optional[float] = None
-    n_recommendations: Optional[int] = 5
+@dataclass
+class ModelBundle:
+    """
+    Toàn bộ models + data của 1 version, load xong mới được swap vào registry
+    
+    Request đọc model_registry.active 1 lần rồi chỉ dùng bundle đó, nên không bao giờ
+    thấy nửa version cũ nửa version mới.
+    """
+    version: str
+    path: str
+    prediction_model: Any
+    prediction_scaler: Any
+    prediction_features: List[str]
+    prediction_encoders: Dict[str, Any]
+    prediction_encoder: PredictionEncoder
+    recommendation_scaler: Any
+    recommendation_X_scaled: np.ndarray
+    recommendation_features: List[str]
+    recommendation_encoders: Dict[str, Any]
+    recommendation_categories: Dict[str, CategoryDictionary]
+    recommendation_index: Any
+    listing_table: ListingTable
+    model_defaults: ModelDefaults
+    prediction_engine: Any = None  # OnnxPricePredictor | CompiledTreeEnsemble | None (sklearn predict)
+    neighbor_table: Optional[NeighborTable] = None
+    filter_index: Optional[ListingFilterIndex] = None
+    delta: Optional[DeltaSegments] = None
+    source_mtime: float = 0.0
+    delta_mtime: float = 0.0
+    load_seconds: float = 0.0
+    loaded_at: float = 0.0
+    artifact_bytes: Dict[str, int] = field(default_factory=dict)
+
+def natural_sort_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def artifacts_mtime(models_dir):
+    paths = [f'{models_dir}/{name}' for name in REQUIRED_ARTIFACTS + MMAP_SOURCES + [NEIGHBOR_IDS_FILE, NOTEBOOK_LABEL_ENCODERS]]
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0.0)
+
+def load_prediction_encoders(models_dir, prediction_features) -> Dict[str, Any]:
+    """
+    Encoders cho các feature '<col>_encoded' của price model
+    
+    Notebook 01 lưu price_prediction_encoders.pkl rỗng, encoders lúc train nằm trong label_encoders.pkl:
+    cột thiếu encoder được lấy từ đó. Vẫn thiếu thì raise (không encode mọi giá trị thành 0).
+    """
+    encoders = dict(joblib.load(f'{models_dir}/price_prediction_encoders.pkl') or {})
+    label_columns = [feature[:-len('_encoded')] for feature in prediction_features if feature.endswith('_encoded')]
+    missing = [col for col in label_columns if not encoder_classes(encoders.get(col))]
+    if missing and os.path.exists(f'{models_dir}/{NOTEBOOK_LABEL_ENCODERS}'):
+        notebook_encoders = joblib.load(f'{models_dir}/{NOTEBOOK_LABEL_ENCODERS}')
+        for col in missing:
+            if encoder_classes(notebook_encoders.get(col)):
+                encoders[col] = notebook_encoders[col]
+        missing = [col for col in label_columns if not encoder_classes(encoders.get(col))]
+    if missing:
+        raise ValueError(f"No label encoder for price features: {', '.join(col + '_encoded' for col in missing)} "
+                         f"(price_prediction_encoders.pkl / {NOTEBOOK_LABEL_ENCODERS})")
+    return encoders
+
+def artifact_sizes(bundle: ModelBundle) -> Dict[str, int]:
+    """Artifact (tên tương đối trong thư mục version) -> bytes, tính 1 lần lúc load cho /metrics"""
+    models_dir = bundle.path
+    names = REQUIRED_ARTIFACTS + [NOTEBOOK_LABEL_ENCODERS, NEIGHBOR_IDS_FILE, NEIGHBOR_DISTANCES_FILE]
+    mmap_dir = f'{models_dir}/{MMAP_DIR}'
+    if os.path.isdir(mmap_dir):
+        names = names + [f'{MMAP_DIR}/{name}' for name in sorted(os.listdir(mmap_dir))]
+    sizes = {name: os.path.getsize(f'{models_dir}/{name}') for name in names
+             if os.path.isfile(f'{models_dir}/{name}')}
+    for path in getattr(bundle.prediction_engine, 'paths', []):
+        if os.path.isfile(path):
+            sizes[f'{ONNX_MODELS_SUBDIR}/{os.path.basename(path)}'] = os.path.getsize(path)
+    return sizes
+
+def attach_delta(bundle: ModelBundle, delta: Optional[DeltaSegments], mtime: float) -> ModelBundle:
+    """Bundle mới dùng chung models / base của bundle, chỉ thay delta (không load lại pickle)"""
+    index, listing_table = bundle.recommendation_index, bundle.listing_table
+    if isinstance(index, SegmentedIndex):
+        index, listing_table = index.base, listing_table.base
+    if delta is not None:
+        index = SegmentedIndex(index, delta)
+        if delta.n_rows:
+            listing_table = SegmentedListingTable(listing_table, delta.listing_table)
+    return replace(bundle, recommendation_index=index, listing_table=listing_table, delta=delta, delta_mtime=mtime)
+
+def house_vector(models: ModelBundle, house_id: int) -> np.ndarray:
+    """Feature vector (đã scale) của house_id, base hoặc delta"""
+    base_rows = len(models.recommendation_X_scaled)
+    if house_id < base_rows:
+        return models.recommendation_X_scaled[house_id]
+    return models.delta.X[house_id - base_rows]
+
+def house_exists(models: ModelBundle, house_id: int) -> bool:
+    if house_id < 0 or house_id >= models.listing_table.n_rows:
+        return False
+    return models.delta is None or not models.delta.dead[house_id]
+
+def canonical_filters(models: ModelBundle, filters: RecommendationFilters) -> RecommendationFilters:
+    """district / ward của filters -> tên class đúng chính tả ('Q. Cầu Giấy' -> 'Quận Cầu Giấy')"""
+    updates = {}
+    for col in FILTER_POSTINGS:
+        value, dictionary = getattr(filters, col), models.recommendation_categories.get(col)
+        if value is not None and dictionary is not None:
+            updates[col] = dictionary.canonical(value) or value
+    return filters.model_copy(update=updates)
+
+def filtered_rows(models: ModelBundle, filters: RecommendationFilters) -> Optional[np.ndarray]:
+    """House ids (tăng dần, base + delta, bỏ tombstone) thỏa filters; None = không lọc"""
+    rows = models.filter_index.rows(filters)
+    delta = models.delta
+    if rows is None or delta is None:
+        return rows
+    if delta.n_rows:
+        rows = np.concatenate([rows, delta.filter_index.rows(filters) + delta.base_rows])
+    return rows[~delta.dead[rows]]
+
+def search_rows(X: np.ndarray, unit: np.ndarray, query_unit: np.ndarray, k: int, rows: np.ndarray):
+    """Exact top-k chỉ trong rows của 1 ma trận (chọn bằng float32, re-rank float64 như CosineTopK)"""
+    query32 = query_unit[0].astype(np.float32)
+    if len(rows) * FILTER_FULL_SCAN_RATIO >= len(unit):
+        scores = (unit @ query32)[rows]
+    else:
+        scores = unit[rows] @ query32
+    pool = min(k + CosineTopK.RERANK_MARGIN, len(rows))
+    if pool < len(rows):
+        rows = rows[np.argpartition(scores, len(rows) - pool)[len(rows) - pool:]]
+    return rerank_cosine(X, rows[None, :], query_unit, min(k, len(rows)))
+
+def filtered_search(models: ModelBundle, query: np.ndarray, k: int, rows: np.ndarray):
+    """
+    Top-k trong các house id `rows` (kết quả < k nếu không đủ nhà thỏa điều kiện)
+    
+    Returns: (distances, indices) sort theo (distance, house id) như search
+    """
+    query_unit = l2_normalize(np.asarray(query, dtype=np.float64).reshape(1, -1))
+    index = models.recommendation_index
+    base = index.base if isinstance(index, SegmentedIndex) else index
+    split = np.searchsorted(rows, base.n_samples)
+    parts = [(base, rows[:split], 0)]
+    if models.delta is not None and models.delta.n_rows:
+        parts.append((models.delta.index, rows[split:] - base.n_samples, base.n_samples))
+    
+    distances, indices = [np.empty(0)], [np.empty(0, dtype=np.int64)]
+    for part, part_rows, offset in parts:
+        if len(part_rows):
+            part_distances, part_indices = search_rows(part.X, part.unit, query_unit, k, part_rows)
+            distances.append(part_distances[0])
+            indices.append(part_indices[0] + offset)
+    distances, indices = np.concatenate(distances), np.concatenate(indices)
+    order = np.lexsort((indices, distances))[:k]
+    return distances[order], indices[order]
+
+def load_bundle(models_dir, version) -> ModelBundle:
+    """Load 1 bộ artifacts (chưa validate, chưa swap)"""
+    source_mtime = artifacts_mtime(models_dir)
+    
+    # Load Price Prediction Models
+    print("\n--- Loading Price Prediction Models ---")
+    prediction_model = joblib.load(f'{models_dir}/price_prediction_model.pkl')
+    prediction_scaler = joblib.load(f'{models_dir}/price_prediction_scaler.pkl')
+    prediction_features = joblib.load(f'{models_dir}/price_prediction_features.pkl')
+    prediction_encoders = load_prediction_encoders(models_dir, prediction_features)
+    print(f"Model loaded: {type(prediction_model).__name__}")
+    print(f"Features: {len(prediction_features)}")
+    prediction_engine = load_prediction_engine(models_dir, prediction_model, prediction_scaler, len(prediction_features))
+    if isinstance(prediction_engine, CompiledTreeEnsemble):
+        print(f"Compiled: {prediction_engine.n_trees} trees, {prediction_engine.n_nodes:,} nodes, "
+              f"depth {prediction_engine.max_depth}")
+    elif prediction_engine is not None:
+        print(f"ONNX Runtime: {', '.join(prediction_engine.paths)} ({ONNX_INTRA_OP_THREADS} intra-op thread(s))")
+    
+    # Load Recommendation Models
+    print("\n--- Loading Recommendation Models ---")
+    recommendation_scaler = joblib.load(f'{models_dir}/recommendation_scaler.pkl')
+    recommendation_features = joblib.load(f'{models_dir}/recommendation_features.pkl')
+    recommendation_encoders = joblib.load(f'{models_dir}/recommendation_encoders.pkl')
+    
+    # Không load recommendation_knn.pkl: nó chứa thêm 1 bản copy của recommendation_X_scaled
+    load_df = lambda: joblib.load(f'{models_dir}/recommendation_df.pkl')
+    if not mmap_artifacts_fresh(models_dir):
+        print("Exporting memory-mapped artifacts...")
+        export_mmap_artifacts(models_dir, joblib.load(f'{models_dir}/recommendation_X_scaled.pkl'), load_df())
+    
+    mmap_dir = f'{models_dir}/{MMAP_DIR}'
+    recommendation_X_scaled = np.load(f'{mmap_dir}/recommendation_X_scaled.npy', mmap_mode='r')
+    listing_table = ListingTable.load(mmap_dir)
+    recommendation_index = load_recommendation_index(
+        models_dir, recommendation_X_scaled,
+        unit=np.load(f'{mmap_dir}/recommendation_X_unit.npy', mmap_mode='r')
+    )
+    print(f"KNN loaded with {recommendation_X_scaled.shape[0]:,} houses ({recommendation_index.name} search, mmap)")
+    print(f"Features: {len(recommendation_features)}")
+    
+    neighbor_table = load_neighbor_table(models_dir, recommendation_X_scaled.shape[0])
+    if neighbor_table is not None:
+        print(f"Neighbor table: top-{neighbor_table.k} for every house ({neighbor_table.nbytes / 1e6:.1f} MB)")
+    
+    model_defaults = load_model_defaults(models_dir, listing_table.n_rows, load_df)
+    print(f"Defaults: {len(model_defaults.district_coords)} district coordinates")
+    
+    bundle = ModelBundle(
+        version=version,
+        path=models_dir,
+        prediction_model=prediction_model,
+        prediction_scaler=prediction_scaler,
+        prediction_features=prediction_features,
+        prediction_encoders=prediction_encoders,
+        prediction_encoder=PredictionEncoder(prediction_features, prediction_encoders),
+        recommendation_scaler=recommendation_scaler,
+        recommendation_X_scaled=recommendation_X_scaled,
+        recommendation_features=recommendation_features,
+        recommendation_encoders=recommendation_encoders,
+        recommendation_categories=category_dictionaries(recommendation_encoders),
+        recommendation_index=recommendation_index,
+        listing_table=listing_table,
+        model_defaults=model_defaults,
+        prediction_engine=prediction_engine,
+        neighbor_table=neighbor_table,
+        filter_index=ListingFilterIndex(listing_table),
+        source_mtime=source_mtime,
+    )
+    
+    # mtime đọc trước khi load: delta ghi trong lúc load sẽ được refresh ở lần poll sau
+    mtime = delta_mtime(models_dir)
+    delta = load_delta_segments(models_dir, recommendation_X_scaled.shape[0], len(recommendation_features))
+    if delta is not None:
+        print(f"Delta: {delta.n_rows:,} new houses in {len(delta.segments)} segment(s), {delta.n_tombstones:,} tombstones")
+    return attach_delta(bundle, delta, mtime)
+
+def validate_bundle(bundle: ModelBundle):
+    """Kiểm tra feature list / shapes + 1 smoke prediction và 1 smoke recommendation trước khi swap"""
+    n_features = len(bundle.prediction_features)
+    if n_features == 0:
+        raise ValueError("price_prediction_features is empty")
+    for name in ('prediction_scaler', 'prediction_model'):
+        expected = getattr(getattr(bundle, name), 'n_features_in_', n_features)
+        if expected != n_features:
+            raise ValueError(f"{name} expects {expected} features, price_prediction_features has {n_features}")
+    
+    n_houses, n_dims = bundle.recommendation_X_scaled.shape
+    if n_dims != len(bundle.recommendation_features):
+        raise ValueError(f"recommendation_X_scaled has {n_dims} columns, "
+                         f"recommendation_features has {len(bundle.recommendation_features)}")
+    expected = getattr(bundle.recommendation_scaler, 'n_features_in_', n_dims)
+    if expected != n_dims:
+        raise ValueError(f"recommendation_scaler expects {expected} features, got {n_dims}")
+    n_delta = bundle.delta.n_rows if bundle.delta is not None else 0
+    if bundle.listing_table.n_rows != n_houses + n_delta:
+        raise ValueError(f"listing table has {bundle.listing_table.n_rows} rows, "
+                         f"recommendation_X_scaled + delta have {n_houses + n_delta}")
+    
+    empty = [col for col, (_, dictionary) in bundle.prediction_encoder.label_columns.items() if len(dictionary) == 0]
+    if empty:
+        raise ValueError(f"Label encoders without classes: {', '.join(empty)}")
+    
+    medians = bundle.model_defaults.medians
+    smoke = PredictRequest(area=60.0, rooms=medians['rooms'], toilets=medians['toilets'], floors=medians['floors'])
+    prices, errors = predict_rows(bundle, [smoke])
+    if errors[0] is not None:
+        raise ValueError(f"Smoke prediction failed: {errors[0]}")
+    engine = bundle.prediction_engine
+    if engine is not None and not engine_matches(engine, bundle.prediction_model, bundle.prediction_scaler, n_features):
+        raise ValueError(f"{engine.name} prediction engine does not match prediction_model.predict")
+    
+    _, indices = bundle.recommendation_index.search(bundle.recommendation_X_scaled[0], min(2, n_houses))
+    if not ((indices >= 0) & (indices < n_houses + n_delta)).all():
+        raise ValueError("Smoke recommendation returned out-of-range house ids")
+    if bundle.neighbor_table is not None:
+        _, indices = bundle.neighbor_table.lookup(bundle.recommendation_X_scaled, 0, min(2, bundle.neighbor_table.width))
+        if not ((indices >= 0) & (indices < n_houses)).all():
+            raise ValueError("Neighbor table contains out-of-range house ids")
+
+class ModelRegistry:
+    """
+    Giữ ModelBundle đang active; load version mới ở background thread rồi swap atomic
+    
+    Version cũ vẫn serve trong lúc load, load/validate lỗi thì version cũ được giữ nguyên.
+    """
+    
+    def __init__(self, root=MODELS_ROOT):
+        self.root = root
+        self.active: Optional[ModelBundle] = None
+        self.loading_version: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._watcher = None
+    
+    def versions(self) -> List[str]:
+        """Các version hợp lệ (thư mục con có đủ REQUIRED_ARTIFACTS), cũ -> mới"""
+        if not os.path.isdir(self.root):
+            return []
+        names = [
+            name for name in os.listdir(self.root)
+            if all(os.path.exists(f'{self.root}/{name}/{artifact}') for artifact in REQUIRED_ARTIFACTS)
+        ]
+        if not names and all(os.path.exists(f'{self.root}/{artifact}') for artifact in REQUIRED_ARTIFACTS):
+            return [ROOT_VERSION]
+        return sorted(names, key=natural_sort_key)
+    
+    def latest_version(self) -> Optional[str]:
+        versions = self.versions()
+        return versions[-1] if versions else None
+    
+    def version_path(self, version) -> str:
+        return self.root if version == ROOT_VERSION else f'{self.root}/{version}'
+    
+    def load(self, version=None) -> ModelBundle:
+        """Load + validate + swap (blocking). Lỗi thì raise, active giữ nguyên."""
+        version = version or self.latest_version()
+        if version is None or version not in self.versions():
+            raise FileNotFoundError(f"Model version not found: {version} (in {self.root})")
+        
+        start = time.perf_counter()
+        try:
+            bundle = load_bundle(self.version_path(version), version)
+            validate_bundle(bundle)
+        except Exception:
+            service_metrics.model_loads["error"] += 1
+            raise
+        bundle.load_seconds = time.perf_counter() - start
+        bundle.loaded_at = time.time()
+        bundle.artifact_bytes = artifact_sizes(bundle)
+        service_metrics.model_loads["success"] += 1
+        self.active = bundle  # 1 phép gán: request đang chạy vẫn giữ bundle cũ
+        print(f"Model version {version} active (loaded in {bundle.load_seconds:.2f}s)")
+        return bundle
+    
+    def reload_async(self, version=None) -> Optional[threading.Thread]:
+        """Load ở background thread; trả về None nếu đang có 1 lần load khác"""
+        version = version or self.latest_version()
+        with self._lock:
+            if self.loading_version is not None:
+                return None
+            self.loading_version = version
+        
+        def run():
+            try:
+                self.load(version)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Model reload failed, keeping version {self.active.version if self.active else None}: {self.last_error}")
+            finally:
+                self.loading_version = None
+        
+        thread = threading.Thread(target=run, name='model-reload', daemon=True)
+        thread.start()
+        return thread
+    
+    def needs_reload(self) -> bool:
+        """Có version mới hơn, hoặc artifacts của version đang active bị ghi đè (notebook save lại)"""
+        latest = self.latest_version()
+        if latest is None or self.active is None:
+            return False
+        if latest != self.active.version:
+            return True
+        return artifacts_mtime(self.active.path) > self.active.source_mtime
+    
+    def delta_changed(self) -> bool:
+        """delta/ của version đang active có segment / tombstone mới"""
+        active = self.active
+        return active is not None and delta_mtime(active.path) != active.delta_mtime
+    
+    def refresh_delta(self) -> ModelBundle:
+        """Load lại delta/ của version đang active rồi swap (base + models giữ nguyên, vài ms)"""
+        with self._lock:
+            active = self.active
+            mtime = delta_mtime(active.path)
+            delta = load_delta_segments(active.path, len(active.recommendation_X_scaled),
+                                        len(active.recommendation_features))
+            bundle = attach_delta(active, delta, mtime)
+            # Không ghi đè version mới vừa được reload swap vào trong lúc đọc delta
+            if self.active is active:
+                self.active = bundle
+        return bundle
+    
+    def watch(self, interval):
+        """Thread poll thư mục models mỗi `interval` giây"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.needs_reload():
+                        thread = self.reload_async()
+                        if thread is not None:
+                            thread.join()
+                    elif self.delta_changed():
+                        self.refresh_delta()
+                except Exception as e:
+                    print(f"Model watcher error: {e}")
+        
+        self._watcher = threading.Thread(target=run, name='model-watcher', daemon=True)
+        self._watcher.start()
+    
+    def status(self) -> Dict[str, Any]:
+        active = self.active
+        return {
+            "version": active.version if active else None,
+            "load_seconds": round(active.load_seconds, 3) if active else None,
+            "loaded_at": active.loaded_at if active else None,
+            "loading_version": self.loading_version,
+            "last_error": self.last_error,
+            "delta": active.delta.stats() if active and active.delta is not None else None,
+        }
+
+model_registry = ModelRegistry()
+
+# ============================================================================
+# INFERENCE EXECUTOR + REQUEST COALESCING
+# ============================================================================
+
+# Inference (scaler / model / top-k search) chạy trong thread pool riêng, event loop chỉ nhận request,
+# nên 1 request chậm không chặn các request khác (kể cả /health). NumPy / sklearn nhả GIL khi tính toán.
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', str(min(4, os.cpu_count() or 1))))
+# Số request tối đa đang chờ + đang chạy; vượt quá -> 503 thay vì xếp hàng vô hạn
+INFERENCE_QUEUE_DEPTH = int(os.environ.get('INFERENCE_QUEUE_DEPTH', '1024'))
+# Các /predict đơn lẻ đến cùng lúc được gộp thành 1 lần scale + predict (tối đa COALESCE_MAX_BATCH dòng).
+# COALESCE_WAIT_MS: cửa sổ chờ gom thêm request; 0 = chỉ gom các request đến trong lúc mọi thread đang bận
+COALESCE_MAX_BATCH = int(os.environ.get('COALESCE_MAX_BATCH', '64'))
+COALESCE_WAIT_MS = float(os.environ.get('COALESCE_WAIT_MS', '0'))
+
+class InferenceQueueFull(Exception):
+    pass
+
+class InferenceExecutor:
+    """
+    Thread pool có giới hạn queue depth
+    
+    Các counter chỉ được sửa trên event loop thread nên không cần lock.
+    """
+    
+    def __init__(self, max_workers=INFERENCE_THREADS, max_queue_depth=INFERENCE_QUEUE_DEPTH):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference')
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+    
+    def acquire(self):
+        if self.queue_depth >= self.max_queue_depth:
+            self.rejected += 1
+            raise InferenceQueueFull(f"Server busy: inference queue full ({self.max_queue_depth} requests)")
+        self.queue_depth += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+    
+    def release(self):
+        self.queue_depth -= 1
+        self.completed += 1
+    
+    def submit(self, fn, *args):
+        """Chạy fn trong pool (không tính queue depth - caller đã acquire)"""
+        return asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+    
+    async def run(self, fn, *args):
+        self.acquire()
+        try:
+            return await self.submit(fn, *args)
+        finally:
+            self.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+class PredictionBatcher:
+    """
+    Gộp các /predict đơn lẻ đến gần nhau thành 1 lần predict_rows rồi trả kết quả về từng request
+    
+    Request đầu tiên mở cửa sổ wait_ms; hết cửa sổ (hoặc đủ max_batch) thì flush. Nếu lúc đó mọi
+    inference thread đều bận, request tiếp tục gom cho tới khi 1 batch chạy xong - tải càng cao batch càng lớn.
+    """
+    
+    def __init__(self, executor: InferenceExecutor, max_batch=COALESCE_MAX_BATCH, wait_ms=COALESCE_WAIT_MS):
+        self.executor = executor
+        self.max_batch = max_batch
+        self.wait_ms = wait_ms
+        self.pending = []  # (models, request, future)
+        self._timer = None
+        self.in_flight = 0
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+    
+    async def predict(self, models: 'ModelBundle', request: PredictRequest):
+        """Returns: (price, error) như 1 dòng của predict_rows"""
+        self.executor.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.pending.append((models, request, future))
+            if len(self.pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.wait_ms / 1000, self._window_closed)
+            return await future
+        finally:
+            self.executor.release()
+    
+    def _window_closed(self):
+        self._timer = None
+        if self.in_flight < self.executor.max_workers:
+            self._flush()
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        
+        # Reload có thể swap model giữa cửa sổ: mỗi request dùng đúng bundle nó đã đọc
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item[0]), []).append(item)
+        for items in groups.values():
+            asyncio.ensure_future(self._run(items))
+    
+    async def _run(self, items):
+        self.batches += 1
+        self.items += len(items)
+        self.largest_batch = max(self.largest_batch, len(items))
+        self.in_flight += 1
+        try:
+            prices, errors = await self.executor.submit(predict_rows, items[0][0], [request for _, request, _ in items])
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.in_flight -= 1
+            # Thread vừa rảnh: flush phần đã gom nếu cửa sổ đã đóng
+            if self.pending and self._timer is None:
+                self._flush()
+        for (_, _, future), price, error in zip(items, prices, errors):
+            if not future.done():
+                future.set_result((price, error))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "wait_ms": self.wait_ms,
+            "pending": len(self.pending),
+            "in_flight_batches": self.in_flight,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
+
+inference_executor = InferenceExecutor()
+prediction_batcher = PredictionBatcher(inference_executor)
+
+# ============================================================================
+# PREDICTION CACHE
+# ============================================================================
+
+# Frontend / Node backend hay gửi lại đúng payload cũ (sửa 1 field rồi quay lại, retry)
+PREDICT_CACHE_MAX_MB = float(os.environ.get('PREDICT_CACHE_MAX_MB', '16'))  # 0 = tắt cache
+PREDICT_CACHE_TTL = float(os.environ.get('PREDICT_CACHE_TTL', '600'))  # giây
+PREDICT_CACHE_DECIMALS = int(os.environ.get('PREDICT_CACHE_DECIMALS', '4'))  # lat/lng 4 số lẻ ~ 11m
+PREDICT_REQUEST_FIELDS = list(PredictRequest.model_fields)
+# OrderedDict node + tuple value + float, ước lượng cho mỗi entry
+CACHE_ENTRY_OVERHEAD = 200
+
+def normalize_category(value: Optional[str]) -> Optional[str]:
+    """NFC + bỏ khoảng trắng thừa; chuỗi rỗng -> None (được encode như 'Unknown')"""
+    if value is None:
+        return None
+    value = ' '.join(unicodedata.normalize('NFC', value).split())
+    return value or None
+
+def canonical_predict_request(request: PredictRequest, decimals: int = PREDICT_CACHE_DECIMALS):
+    """
+    Dạng chuẩn của request: float làm tròn `decimals` số lẻ, categorical đã normalize
+    
+    Returns: (cache key, PredictRequest chuẩn) - model predict trên request chuẩn
+    nên kết quả cache luôn đúng bằng kết quả tính lại.
+    """
+    values = {}
+    for name in PREDICT_REQUEST_FIELDS:
+        value = getattr(request, name)
+        if isinstance(value, str) or (value is None and name in PREDICT_CATEGORICAL_INPUTS):
+            value = normalize_category(value)
+        elif value is not None:
+            value = round(float(value), decimals) + 0.0  # +0.0: -0.0 -> 0.0
+        values[name] = value
+    return tuple(values.values()), PredictRequest.model_construct(**values)
+
+class PredictionCache:
+    """
+    LRU + TTL cache cho /predict, giới hạn theo bytes (ước lượng) thay vì chỉ số entry
+    
+    Chỉ dùng từ event loop thread nên không cần lock. Tự clear khi model version đổi.
+    """
+    
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (price, expires_at, size)
+        self.bytes = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+    
+    def _check_generation(self, models: 'ModelBundle'):
+        generation = (models.version, models.loaded_at)
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.generation = generation
+    
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+    
+    def get(self, models: 'ModelBundle', key) -> Optional[float]:
+        self._check_generation(models)
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def put(self, models: 'ModelBundle', key, price: float):
+        self._check_generation(models)
+        if key in self.entries:
+            self._remove(key)
+        size = CACHE_ENTRY_OVERHEAD + sys.getsizeof(key) + sum(sys.getsizeof(value) for value in key)
+        self.entries[key] = (price, time.monotonic() + self.ttl, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+    
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+prediction_cache = PredictionCache(int(PREDICT_CACHE_MAX_MB * 1024 * 1024), PREDICT_CACHE_TTL)
 
 # ============================================================================
 # STARTUP - Load Pre-trained Models
@@ -75,39 +2398,16 @@ class RecommendByFeaturesRequest(BaseModel):
 
 @app.on_event("startup")
 async def load_models():
-    """Load pre-trained models từ notebooks"""
-    global prediction_model, prediction_scaler, prediction_features, prediction_encoders
-    global recommendation_knn, recommendation_scaler, recommendation_X_scaled
-    global recommendation_df, recommendation_features, recommendation_encoders
-    
+    """Load pre-trained models từ notebooks (version mới nhất trong models/)"""
     print("=" * 80)
     print("LOADING PRE-TRAINED MODELS")
     print("=" * 80)
     
-    models_dir = 'models'
-    if not os.path.exists(models_dir):
-        raise Exception(f"Models directory not found: {models_dir}\nPlease run notebooks to save models first!")
+    if not os.path.exists(model_registry.root):
+        raise Exception(f"Models directory not found: {model_registry.root}\nPlease run notebooks to save models first!")
     
     try:
-        # Load Price Prediction Models
-        print("\n--- Loading Price Prediction Models ---")
-        prediction_model = joblib.load(f'{models_dir}/price_prediction_model.pkl')
-        prediction_scaler = joblib.load(f'{models_dir}/price_prediction_scaler.pkl')
-        prediction_features = joblib.load(f'{models_dir}/price_prediction_features.pkl')
-        prediction_encoders = joblib.load(f'{models_dir}/price_prediction_encoders.pkl')
-        print(f"Model loaded: {type(prediction_model).__name__}")
-        print(f"Features: {len(prediction_features)}")
-        
-        # Load Recommendation Models
-        print("\n--- Loading Recommendation Models ---")
-        recommendation_knn = joblib.load(f'{models_dir}/recommendation_knn.pkl')
-        recommendation_scaler = joblib.load(f'{models_dir}/recommendation_scaler.pkl')
-        recommendation_X_scaled = joblib.load(f'{models_dir}/recommendation_X_scaled.pkl')
-        recommendation_df = joblib.load(f'{models_dir}/recommendation_df.pkl')
-        recommendation_features = joblib.load(f'{models_dir}/recommendation_features.pkl')
-        recommendation_encoders = joblib.load(f'{models_dir}/recommendation_encoders.pkl')
-        print(f"KNN loaded with {recommendation_X_scaled.shape[0]:,} houses")
-        print(f"Features: {len(recommendation_features)}")
+        model_registry.load()
         
         print("\n" + "=" * 80)
         print("ALL MODELS LOADED SUCCESSFULLY")
@@ -117,6 +2417,9 @@ async def load_models():
         print(f"\nERROR loading models: {str(e)}")
         print("Please run the notebooks and execute the save models cells first!")
         raise
+    
+    if MODEL_WATCH_INTERVAL > 0 and model_registry._watcher is None:
+        model_registry.watch(MODEL_WATCH_INTERVAL)
 
 # ============================================================================
 # HEALTH CHECK
@@ -126,18 +2429,177 @@ async def load_models():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    models = model_registry.active
     return {
         "status": "healthy",
         "service": "House ML API",
         "models": {
-            "prediction": prediction_model is not None,
-            "recommendation": recommendation_knn is not None
+            "prediction": models is not None,
+            "recommendation": models is not None,
+            "recommendation_index": models.recommendation_index.name if models is not None else None,
+            "prediction_engine": (getattr(models.prediction_engine, 'name', 'sklearn')
+                                  if models is not None else None),
+            "neighbor_table_k": models.neighbor_table.k if models is not None and models.neighbor_table is not None else None,
+            **model_registry.status()
         },
         "data": {
-            "total_houses": len(recommendation_df) if recommendation_df is not None else 0
+            "total_houses": models.listing_table.n_rows if models is not None else 0
         }
     }
 
+@app.get("/stats")
+async def service_stats():
+    """Metrics của inference thread pool, request coalescing và prediction cache"""
+    return {
+        "inference": inference_executor.stats(),
+        "coalescing": prediction_batcher.stats(),
+        "prediction_cache": prediction_cache.stats()
+    }
+
+def render_metrics() -> str:
+    """Tất cả metrics theo Prometheus text format"""
+    out = PrometheusText()
+    
+    out.header('requests_total', 'counter', 'HTTP requests by route template, method and status code.')
+    for (endpoint, method, status), count in sorted(service_metrics.requests.items()):
+        out.sample('requests_total', count, {'endpoint': endpoint, 'method': method, 'status': status})
+    out.header('request_errors_total', 'counter', 'HTTP requests answered with a 5xx status.')
+    errors = dict.fromkeys(service_metrics.request_latency, 0)
+    for (endpoint, _, status), count in list(service_metrics.requests.items()):
+        if status >= 500:
+            errors[endpoint] += count
+    for endpoint, count in sorted(errors.items()):
+        out.sample('request_errors_total', count, {'endpoint': endpoint})
+    out.header('request_duration_seconds', 'histogram', 'End-to-end HTTP request latency.')
+    for endpoint, histogram in sorted(service_metrics.request_latency.items()):
+        out.histogram('request_duration_seconds', histogram, {'endpoint': endpoint})
+    out.header('stage_duration_seconds', 'histogram', 'Latency of each inference stage (predict counts one coalesced batch).')
+    for pipeline, stages in service_metrics.stages.items():
+        for stage, histogram in stages.items():
+            out.histogram('stage_duration_seconds', histogram, {'pipeline': pipeline, 'stage': stage})
+    
+    models = model_registry.active
+    out.header('model_loads_total', 'counter', 'Model bundle loads (startup, reload, watcher) by result.')
+    for result, count in service_metrics.model_loads.items():
+        out.sample('model_loads_total', count, {'result': result})
+    if models is not None:
+        labels = {'version': models.version}
+        out.header('model_load_seconds', 'gauge', 'Load + validation time of the active model version.')
+        out.sample('model_load_seconds', models.load_seconds, labels)
+        out.header('model_loaded_timestamp_seconds', 'gauge', 'Unix time the active model version was swapped in.')
+        out.sample('model_loaded_timestamp_seconds', models.loaded_at, labels)
+        out.header('artifact_size_bytes', 'gauge', 'Size of each artifact of the active model version.')
+        for name, size in sorted(models.artifact_bytes.items()):
+            out.sample('artifact_size_bytes', size, {**labels, 'artifact': name})
+        out.header('houses', 'gauge', 'Houses served by the recommendation index (base + delta).')
+        out.sample('houses', models.listing_table.n_rows, labels)
+    
+    inference = inference_executor.stats()
+    out.header('inference_queue_depth', 'gauge', 'Requests waiting for or running in the inference pool.')
+    out.sample('inference_queue_depth', inference["queue_depth"])
+    out.header('inference_completed_total', 'counter', 'Requests completed by the inference pool.')
+    out.sample('inference_completed_total', inference["completed"])
+    out.header('inference_rejected_total', 'counter', 'Requests rejected with 503 because the inference queue was full.')
+    out.sample('inference_rejected_total', inference["rejected"])
+    coalescing = prediction_batcher.stats()
+    out.header('coalesced_batches_total', 'counter', 'predict_rows batches built from coalesced /predict requests.')
+    out.sample('coalesced_batches_total', coalescing["batches"])
+    out.header('coalesced_items_total', 'counter', '/predict requests served through coalesced batches.')
+    out.sample('coalesced_items_total', coalescing["items"])
+    cache = prediction_cache.stats()
+    for name in ('hits', 'misses', 'evictions'):
+        out.header(f'prediction_cache_{name}_total', 'counter', f'Prediction cache {name}.')
+        out.sample(f'prediction_cache_{name}_total', cache[name])
+    out.header('prediction_cache_bytes', 'gauge', 'Estimated prediction cache size.')
+    out.sample('prediction_cache_bytes', cache["bytes"])
+    out.header('start_time_seconds', 'gauge', 'Unix time the process started serving.')
+    out.sample('start_time_seconds', service_metrics.started_at)
+    return out.text()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics cho Prometheus scrape (text exposition format 0.0.4)"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ============================================================================
+# ADMIN ENDPOINTS
+# ============================================================================
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Fail closed: không có ADMIN_TOKEN thì /admin/* coi như không tồn tại (404)
+    
+    App listen 0.0.0.0 + CORS "*", nên route admin không được mở mặc định; so token bằng compare_digest.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def list_model_versions():
+    """Các version có trong models/ và version đang active"""
+    return {"success": True, "versions": model_registry.versions(), **model_registry.status()}
+
+@app.post("/admin/reload", dependencies=[Depends(require_admin)])
+async def reload_models(version: Optional[str] = None, wait: bool = False):
+    """
+    Load version (mặc định: mới nhất) ở background rồi swap, không cần restart
+    
+    wait=true: chờ load xong và trả về kết quả
+    """
+    target = version or model_registry.latest_version()
+    if target is None or target not in model_registry.versions():
+        raise HTTPException(status_code=404, detail=f"Model version not found: {target}")
+    
+    thread = model_registry.reload_async(target)
+    if thread is None:
+        raise HTTPException(status_code=409, detail=f"Already loading version {model_registry.loading_version}")
+    
+    if not wait:
+        return {"success": True, "status": "loading", "version": target}
+    
+    await asyncio.to_thread(thread.join)
+    if model_registry.active is None or model_registry.active.version != target or model_registry.last_error:
+        raise HTTPException(status_code=500, detail=f"Reload error: {model_registry.last_error}")
+    return {"success": True, "status": "active", **model_registry.status()}
+
+@app.post("/admin/delta/refresh", dependencies=[Depends(require_admin)])
+async def refresh_delta():
+    """Load lại delta segments + tombstones của version đang active (không cần chờ watcher)"""
+    if model_registry.active is None:
+        raise HTTPException(status_code=500, detail="Recommendation model not loaded")
+    try:
+        await asyncio.to_thread(model_registry.refresh_delta)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Delta refresh error: {str(e)}")
+    return {"success": True, **model_registry.status()}
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(seconds: float = 10.0, interval_ms: float = PROFILE_INTERVAL_MS,
+                        threads: Optional[str] = None):
+    """
+    Bật sampling profiler trong `seconds` giây (lấy mẫu stack mỗi interval_ms)
+    
+    threads: chỉ lấy mẫu thread có tên bắt đầu bằng prefix này (vd. 'inference')
+    """
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or interval_ms <= 0:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS}], interval_ms > 0")
+    if not sampling_profiler.start(seconds, interval_ms, threads):
+        raise HTTPException(status_code=409, detail="Profiler already running")
+    return {"success": True, "status": "running", "seconds": seconds, "interval_ms": interval_ms}
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile(format: str = 'json'):
+    """
+    Kết quả lần profile gần nhất
+    
+    format=collapsed: text 'thread;frame;...;frame count' cho flamegraph.pl / speedscope
+    """
+    if format == 'collapsed':
+        return PlainTextResponse(sampling_profiler.collapsed())
+    return {"success": True, "running": sampling_profiler.running, "profile": sampling_profiler.result}
+
 # ============================================================================
 # PRICE PREDICTION ENDPOINTS
 # ============================================================================
@@ -149,64 +2611,24 @@ async def predict_price(request: PredictRequest):
     
     Returns: predicted_price (VNĐ)
     """
-    if prediction_model is None:
+    models = model_registry.active
+    if models is None:
         raise HTTPException(status_code=500, detail="Prediction model not loaded")
     
     try:
-        # Get default values from data
-        default_rooms = recommendation_df['rooms'].median()
-        default_toilets = recommendation_df['toilets'].median()
-        default_floors = recommendation_df['floors'].median()
-        default_width = recommendation_df['width'].median()
-        default_length = recommendation_df['length'].median()
-        
-        # Prepare input data
-        data = {
-            'area': request.area,
-            'rooms': request.rooms if request.rooms is not None else default_rooms,
-            'toilets': request.toilets if request.toilets is not None else default_toilets,
-            'floors': request.floors if request.floors is not None else default_floors,
-            'width': request.width if request.width is not None else default_width,
-            'length': request.length if request.length is not None else default_length,
-            'lat': request.lat if request.lat is not None else 21.0285,
-            'lng': request.lng if request.lng is not None else 105.8542,
-        }
-        
-        # Engineered features
-        data['total_rooms'] = data['rooms'] + data['toilets']
-        data['area_per_floor'] = data['area'] / (data['floors'] + 0.1)
-        data['room_density'] = data['total_rooms'] / (data['area'] + 1)
-        data['width_length_ratio'] = data['width'] / (data['length'] + 0.1)
-        
-        center_lat, center_lng = 21.0285, 105.8542
-        data['distance_from_center'] = np.sqrt((data['lat'] - center_lat)**2 + (data['lng'] - center_lng)**2)
-        data['is_central'] = 1 if data['distance_from_center'] < 0.05 else 0
-        data['lat_lng_interaction'] = data['lat'] * data['lng']
-        
-        # Categorical features
-        data['district'] = request.district if request.district else 'Unknown'
-        data['ward'] = request.ward if request.ward else 'Unknown'
-        data['legal'] = request.legal if request.legal else 'Unknown'
-        data['seller_type'] = request.seller_type if request.seller_type else 'Unknown'
-        
-        # Create dataframe
-        input_df = pd.DataFrame([data])
-        
-        # Encode categorical using saved encoders
-        input_encoded = pd.get_dummies(input_df, columns=['district', 'ward', 'legal', 'seller_type'], drop_first=True)
-        
-        # Align with training features
-        for col in prediction_features:
-            if col not in input_encoded.columns:
-                input_encoded[col] = 0
-        
-        input_encoded = input_encoded[prediction_features]
-        
-        # Scale
-        input_scaled = prediction_scaler.transform(input_encoded)
+        if prediction_cache.enabled:
+            key, request = canonical_predict_request(request)
+            predicted_price = prediction_cache.get(models, key)
+        else:
+            predicted_price = None
         
-        # Predict
-        predicted_price = prediction_model.predict(input_scaled)[0]
+        if predicted_price is None:
+            # Gộp với các /predict đến cùng lúc, chạy trong inference thread pool
+            predicted_price, error = await prediction_batcher.predict(models, request)
+            if error is not None:
+                raise ValueError(error)
+            if prediction_cache.enabled:
+                prediction_cache.put(models, key, float(predicted_price))
         
         return {
             "success": True,
@@ -214,67 +2636,229 @@ async def predict_price(request: PredictRequest):
             "predicted_price_billions": round(float(predicted_price / 1e9), 2)
         }
         
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+def predict_batch_response(models: ModelBundle, items: List[Dict[str, Any]]):
+    """Validate + predict cả batch (chạy trong inference thread pool)"""
+    timer = StageTimer('predict_batch')
+    errors = [None] * len(items)
+    parsed, parsed_index = [], []
+    for i, item in enumerate(items):
+        try:
+            parsed.append(PredictRequest(**item))
+            parsed_index.append(i)
+        except ValidationError as e:
+            errors[i] = "Invalid input: " + "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+    
+    timer.lap('validate')
+    
+    prices = np.full(len(items), np.nan)
+    if parsed:
+        row_prices, row_errors = predict_rows(models, parsed)
+        prices[parsed_index] = row_prices
+        for i, error in zip(parsed_index, row_errors):
+            errors[i] = error
+    
+    timer.skip()  # stage của predict_rows đã được đo riêng
+    results = []
+    for i, error in enumerate(errors):
+        if error is not None:
+            results.append({"index": i, "success": False, "error": error})
+        else:
+            results.append({
+                "index": i,
+                "success": True,
+                "predicted_price": float(prices[i]),
+                "predicted_price_billions": round(float(prices[i] / 1e9), 2)
+            })
+    
+    n_failed = sum(1 for error in errors if error is not None)
+    timer.lap('response')
+    return {
+        "success": True,
+        "count": len(results),
+        "n_failed": n_failed,
+        "results": results
+    }
+
+@app.post("/predict/batch")
+async def predict_price_batch(request: PredictBatchRequest):
+    """
+    Dự đoán giá cho nhiều nhà trong 1 request
+    
+    Returns: kết quả theo thứ tự input, dòng lỗi có "error" thay vì làm fail cả batch
+    """
+    models = model_registry.active
+    if models is None:
+        raise HTTPException(status_code=500, detail="Prediction model not loaded")
+    
+    if len(request.items) > PREDICT_BATCH_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Batch too large (max {PREDICT_BATCH_MAX_ROWS} items)")
+    
+    try:
+        return await inference_executor.run(predict_batch_response, models, request.items)
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch prediction error: {str(e)}")
+
 # ============================================================================
 # RECOMMENDATION ENDPOINTS
 # ============================================================================
 
+def similar_houses_response(models: ModelBundle, house_id: int, limit: int):
+    """Top nhà tương tự house_id (chạy trong inference thread pool)"""
+    timer = StageTimer('recommend_by_id')
+    # Get features
+    house_features = house_vector(models, house_id).reshape(1, -1)
+    
+    # Find neighbors: slice bảng precompute nếu đủ (+ search delta), không thì live search
+    table = models.neighbor_table
+    result = None
+    if table is not None and limit + 1 <= table.width and house_id < table.n_samples:
+        result = table.lookup(models.recommendation_X_scaled, house_id, limit + 1)
+        if models.delta is not None:
+            result = models.recommendation_index.merge_base_result(house_features, *result, limit + 1)
+    if result is None:
+        result = models.recommendation_index.search(house_features, limit + 1)
+    distances, indices = result
+    timer.lap('search')
+    
+    # Remove itself (nhà trùng lặp có thể đứng trước nó khi hòa distance)
+    keep = np.flatnonzero(indices != house_id)[:limit]
+    indices = indices[keep]
+    distances = distances[keep]
+    similarity_scores = 1 - distances
+    
+    # Get house info
+    recommendations = models.listing_table.records(indices, similarity_scores)
+    timer.lap('response')
+    
+    return {
+        "success": True,
+        "original_house_id": house_id,
+        "recommendations": recommendations
+    }
+
 @app.get("/recommend/by-id/{house_id}")
-async def recommend_by_house_id(house_id: int, limit: int = 5):
+async def recommend_by_house_id(house_id: int, limit: int = Query(5, ge=1)):
     """
     Gợi ý nhà tương tự dựa trên house ID
     
     Returns: list of similar houses
     """
-    if recommendation_knn is None or recommendation_X_scaled is None:
+    models = model_registry.active
+    if models is None:
         raise HTTPException(status_code=500, detail="Recommendation model not loaded")
     
-    if house_id >= len(recommendation_X_scaled) or house_id < 0:
+    if not house_exists(models, house_id):
         raise HTTPException(status_code=404, detail="House ID not found")
     
     try:
-        # Get features
-        house_features = recommendation_X_scaled[house_id].reshape(1, -1)
-        
-        # Find neighbors
-        distances, indices = recommendation_knn.kneighbors(house_features, n_neighbors=limit+1)
-        
-        # Remove itself
-        indices = indices[0][1:]
-        distances = distances[0][1:]
-        similarity_scores = 1 - distances
-        
-        # Get house info
-        recommendations = []
-        for i, idx in enumerate(indices):
-            house = recommendation_df.iloc[idx]
-            recommendations.append({
-                "rank": i + 1,
-                "similarity_score": round(float(similarity_scores[i]), 4),
-                "price": float(house['price']),
-                "price_billions": round(float(house['price'] / 1e9), 2),
-                "area": float(house['area']),
-                "rooms": int(house['rooms']) if pd.notna(house['rooms']) else None,
-                "toilets": int(house['toilets']) if pd.notna(house['toilets']) else None,
-                "floors": int(house['floors']) if pd.notna(house['floors']) else None,
-                "district": str(house.get('district', '')),
-                "ward": str(house.get('ward', '')),
-                "title": str(house.get('title', ''))[:100],
-                "lat": float(house['lat']) if pd.notna(house['lat']) else None,
-                "lng": float(house['lng']) if pd.notna(house['lng']) else None,
-            })
-        
-        return {
-            "success": True,
-            "original_house_id": house_id,
-            "recommendations": recommendations
-        }
-        
+        return await inference_executor.run(similar_houses_response, models, house_id, limit)
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
 
+def recommend_by_features_response(models: ModelBundle, request: RecommendByFeaturesRequest):
+    """Build feature vector từ request rồi tìm nhà gần nhất (chạy trong inference thread pool)"""
+    timer = StageTimer('recommend_by_features')
+    # Create feature vector
+    user_features = {}
+    
+    user_features['price'] = request.price
+    user_features['area'] = request.area
+    user_features['price_per_sqm'] = request.price / request.area if request.area > 0 else 0
+    
+    # District đúng tên class (hash lookup + chuẩn hóa chính tả), giá trị lạ giữ nguyên
+    districts = models.recommendation_categories.get('district')
+    district = request.district
+    if district and districts is not None:
+        district = districts.canonical(district) or district
+    
+    medians = models.model_defaults.medians
+    fallback_lat, fallback_lng = models.model_defaults.coords_for(district)
+    user_features['rooms'] = request.rooms if request.rooms is not None else medians['rooms']
+    user_features['toilets'] = request.toilets if request.toilets is not None else medians['toilets']
+    user_features['floors'] = request.floors if request.floors is not None else medians['floors']
+    user_features['lat'] = request.lat if request.lat is not None else fallback_lat
+    user_features['lng'] = request.lng if request.lng is not None else fallback_lng
+    user_features['width'] = medians['width']
+    user_features['length'] = medians['length']
+    timer.lap('defaults')
+    
+    user_features['total_rooms'] = user_features['rooms'] + user_features['toilets']
+    user_features['area_per_floor'] = request.area / (user_features['floors'] + 0.1)
+    user_features['distance_from_center'] = np.sqrt(
+        (user_features['lat'] - CENTER_LAT)**2 + 
+        (user_features['lng'] - CENTER_LNG)**2
+    )
+    
+    # Price weighting - duplicate price features for higher priority
+    user_features['price_weighted'] = user_features['price']
+    user_features['price_per_sqm_weighted'] = user_features['price_per_sqm']
+    timer.lap('features')
+    
+    # Encode district (giá trị lạ -> 0)
+    user_features['district_encoded'] = districts.encode(district) if district and districts is not None else 0
+    
+    # Fill missing encoded features
+    for feat in models.recommendation_features:
+        if feat.endswith('_encoded') and feat not in user_features:
+            user_features[feat] = 0
+    
+    # Create vector in correct order
+    user_vector = np.array([user_features.get(f, 0) for f in models.recommendation_features]).reshape(1, -1)
+    timer.lap('encode')
+    user_vector_scaled = models.recommendation_scaler.transform(user_vector)
+    timer.lap('scale')
+    
+    # Find neighbors: có district bonus thì lấy pool rộng hơn n để bonus có nhà để đẩy lên;
+    # có filters thì chỉ score các nhà thỏa điều kiện (posting lists / sorted index)
+    index = models.recommendation_index
+    n = request.n_recommendations if request.n_recommendations is not None else DEFAULT_N_RECOMMENDATIONS
+    n_live = getattr(index, 'n_live', index.n_samples)
+    check_n_neighbors(n, n_live)
+    pool = min(n * DISTRICT_RERANK_POOL, n_live) if district else n
+    rows = filtered_rows(models, canonical_filters(models, request.filters)) if request.filters is not None else None
+    if rows is None:
+        distances, indices = index.search(user_vector_scaled, pool)
+    else:
+        distances, indices = filtered_search(models, user_vector_scaled, pool, rows)
+    
+    similarity_scores = 1 - distances
+    
+    # District bonus (priority weighting)
+    if district:
+        same_district = models.listing_table.take_strings('district', indices) == district
+        similarity_scores = similarity_scores + 0.15 * same_district
+    
+    timer.lap('search')
+    
+    # Re-sort by adjusted similarity score (làm tròn như response, hòa giữ thứ tự distance) rồi cắt còn n
+    order = np.argsort(-np.round(similarity_scores, 4), kind='stable')[:n]
+    recommendations = models.listing_table.records(indices[order], similarity_scores[order])
+    
+    user_input = {
+        "price": request.price,
+        "price_billions": round(request.price / 1e9, 2),
+        "area": request.area,
+        "rooms": request.rooms,
+        "district": request.district
+    }
+    response = {"success": True, "user_input": user_input, "recommendations": recommendations}
+    if rows is not None:
+        user_input["filters"] = request.filters.model_dump(exclude_none=True)
+        response["matched_houses"] = len(rows)
+    timer.lap('response')
+    return response
+
 @app.post("/recommend/by-features")
 async def recommend_by_features(request: RecommendByFeaturesRequest):
     """
@@ -282,108 +2866,14 @@ async def recommend_by_features(request: RecommendByFeaturesRequest):
     
     Returns: list of recommended houses
     """
-    if recommendation_knn is None or recommendation_scaler is None:
+    models = model_registry.active
+    if models is None:
         raise HTTPException(status_code=500, detail="Recommendation model not loaded")
     
     try:
-        # Create feature vector
-        user_features = {}
-        
-        user_features['price'] = request.price
-        user_features['area'] = request.area
-        user_features['price_per_sqm'] = request.price / request.area if request.area > 0 else 0
-        
-        user_features['rooms'] = request.rooms if request.rooms is not None else recommendation_df['rooms'].median()
-        user_features['toilets'] = request.toilets if request.toilets is not None else recommendation_df['toilets'].median()
-        user_features['floors'] = request.floors if request.floors is not None else recommendation_df['floors'].median()
-        user_features['lat'] = request.lat if request.lat is not None else 21.0285
-        user_features['lng'] = request.lng if request.lng is not None else 105.8542
-        user_features['width'] = recommendation_df['width'].median()
-        user_features['length'] = recommendation_df['length'].median()
-        
-        user_features['total_rooms'] = user_features['rooms'] + user_features['toilets']
-        user_features['area_per_floor'] = request.area / (user_features['floors'] + 0.1)
-        center_lat, center_lng = 21.0285, 105.8542
-        user_features['distance_from_center'] = np.sqrt(
-            (user_features['lat'] - center_lat)**2 + 
-            (user_features['lng'] - center_lng)**2
-        )
-        
-        # Price weighting - duplicate price features for higher priority
-        user_features['price_weighted'] = user_features['price']
-        user_features['price_per_sqm_weighted'] = user_features['price_per_sqm']
-        
-        # Encode district
-        if request.district and 'district' in recommendation_encoders:
-            le = recommendation_encoders['district']
-            if request.district in le.classes_:
-                user_features['district_encoded'] = le.transform([request.district])[0]
-            else:
-                user_features['district_encoded'] = 0
-        else:
-            user_features['district_encoded'] = 0
-        
-        # Fill missing encoded features
-        for feat in recommendation_features:
-            if feat.endswith('_encoded') and feat not in user_features:
-                user_features[feat] = 0
-        
-        # Create vector in correct order
-        user_vector = np.array([user_features.get(f, 0) for f in recommendation_features]).reshape(1, -1)
-        user_vector_scaled = recommendation_scaler.transform(user_vector)
-        
-        # Find neighbors
-        distances, indices = recommendation_knn.kneighbors(user_vector_scaled, n_neighbors=request.n_recommendations)
-        
-        indices = indices[0]
-        distances = distances[0]
-        similarity_scores = 1 - distances
-        
-        # Build results
-        recommendations = []
-        for i, idx in enumerate(indices):
-            house = recommendation_df.iloc[idx]
-            sim_score = similarity_scores[i]
-            
-            # District bonus (priority weighting)
-            if request.district and house.get('district') == request.district:
-                sim_score += 0.15
-            
-            recommendations.append({
-                "rank": i + 1,
-                "similarity_score": round(float(sim_score), 4),
-                "price": float(house['price']),
-                "price_billions": round(float(house['price'] / 1e9), 2),
-                "area": float(house['area']),
-                "rooms": int(house['rooms']) if pd.notna(house['rooms']) else None,
-                "toilets": int(house['toilets']) if pd.notna(house['toilets']) else None,
-                "floors": int(house['floors']) if pd.notna(house['floors']) else None,
-                "district": str(house.get('district', '')),
-                "ward": str(house.get('ward', '')),
-                "title": str(house.get('title', ''))[:100],
-                "lat": float(house['lat']) if pd.notna(house['lat']) else None,
-                "lng": float(house['lng']) if pd.notna(house['lng']) else None,
-            })
-        
-        # Re-sort by adjusted similarity score
-        recommendations.sort(key=lambda x: x['similarity_score'], reverse=True)
-        
-        # Update ranks
-        for i, rec in enumerate(recommendations):
-            rec['rank'] = i + 1
-        
-        return {
-            "success": True,
-            "user_input": {
-                "price": request.price,
-                "price_billions": round(request.price / 1e9, 2),
-                "area": request.area,
-                "rooms": request.rooms,
-                "district": request.district
-            },
-            "recommendations": recommendations
-        }
-        
+        return await inference_executor.run(recommend_by_features_response, models, request)
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
 
@@ -0,0 +1,152 @@
+"""
+Đo runtime + peak memory của scripts/ingest_crawl.py so với cách notebook 02 (đọc cả CSV vào pandas)
+
+Input là CSV giống output của crawler (stub_server.synthetic_ads -> _extract_item -> RowWriter),
+có tin đăng lặp lại (re-push với list_time mới + giá mới) và giá trị thiếu. Mỗi cách chạy trong
+1 process riêng để đo peak RSS; X_scaled của 2 cách phải giống nhau.
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/benchmark_ingest.py --rows 14000 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'crawler'))
+
+REPUSH_RATE = 0.03
+MISSING_RATE = 0.05
+MISSING_FIELDS = ['rooms', 'toilets', 'floors', 'latitude', 'longitude', 'width', 'length', 'property_legal_document']
+
+
+def write_crawl_csv(path, n_rows, chunk=50_000, seed=0):
+    """CSV n_rows dòng; ~3% là bản re-push của 1 tin đã có (cùng ad_id, list_time mới hơn)"""
+    from chotot_batch_crawl import _extract_item
+    from columnar import RowWriter
+    from stub_server import synthetic_ads
+
+    rng = random.Random(seed)
+    written = 0
+    with RowWriter(path, fmt='csv') as writer:
+        while written < n_rows:
+            ads = synthetic_ads(min(chunk, n_rows - written), seed=written, start_id=150_000_000 - written)
+            for ad in ads:
+                for field in MISSING_FIELDS:
+                    if rng.random() < MISSING_RATE:
+                        ad[field] = None
+            repushed = []
+            for ad in rng.sample(ads, int(len(ads) * REPUSH_RATE)):
+                ad = dict(ad, list_time=ad['list_time'] + 86_400_000, price=int(ad['price'] * 1.05))
+                repushed.append(ad)
+            ads = ads[:len(ads) - len(repushed)] + repushed
+            for page, ad in enumerate(ads):
+                item = _extract_item(ad)
+                item.page = page // 20
+                writer.write(item)
+            written += len(ads)
+
+
+def run_notebook(csv_path):
+    """Các bước của notebook 02 trên 1 DataFrame đầy đủ (dedupe theo ad id thay cho drop_duplicates())"""
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+    import ingest_crawl
+
+    df = pd.read_csv(csv_path)
+    df = df.sort_values('date', kind='stable').drop_duplicates('id', keep='last').sort_index()
+    df = df[df['price'] > 0]
+    price_q1, price_q99 = df['price'].quantile(0.01), df['price'].quantile(0.99)
+    df = df[(df['price'] >= price_q1) & (df['price'] <= price_q99)]
+    df = df[df['area'] > 0]
+    area_q1, area_q99 = df['area'].quantile(0.01), df['area'].quantile(0.99)
+    df = df[(df['area'] >= area_q1) & (df['area'] <= area_q99)].reset_index(drop=True)
+
+    df['price_per_sqm'] = df['price'] / df['area']
+    df['total_rooms'] = df['rooms'].fillna(0) + df['toilets'].fillna(0)
+    df['area_per_floor'] = df['area'] / (df['floors'].fillna(1) + 0.1)
+    center_lat, center_lng = 21.0285, 105.8542
+    df['distance_from_center'] = np.sqrt((df['lat'].fillna(center_lat) - center_lat)**2
+                                         + (df['lng'].fillna(center_lng) - center_lng)**2)
+    features = ingest_crawl.NUMERIC_COLUMNS + ingest_crawl.ENGINEERED_COLUMNS
+    for col in features:
+        df[col] = df[col].fillna(df[col].median())
+    for col in ingest_crawl.CATEGORICAL_COLUMNS:
+        df[col] = df[col].fillna('Unknown')
+        df[col + '_encoded'] = LabelEncoder().fit_transform(df[col].astype(str))
+    df['price_weighted'] = df['price']
+    df['price_per_sqm_weighted'] = df['price_per_sqm']
+
+    X = df[ingest_crawl.RECOMMENDATION_FEATURES].replace([np.inf, -np.inf], np.nan)
+    X = X.fillna(X.median())
+    return StandardScaler().fit_transform(X)
+
+
+def run_worker(mode, csv_path, out_path):
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'scripts'))
+    import ingest_crawl
+    from sklearn.preprocessing import StandardScaler  # noqa: F401  (import trước khi đo baseline)
+
+    baseline_mb = ingest_crawl.peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'pipeline':
+        X, *_ = ingest_crawl.build_artifacts([csv_path], log=lambda *args: None)
+    else:
+        X = run_notebook(csv_path)
+    elapsed = time.perf_counter() - start
+    np.save(out_path, X)
+    print(json.dumps({'seconds': elapsed, 'peak_rss_mb': ingest_crawl.peak_rss_mb(), 'baseline_mb': baseline_mb,
+                      'rows': len(X)}))
+
+
+def measure(mode, csv_path, out_path):
+    output = subprocess.run(
+        [sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--worker', mode, csv_path, out_path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the streaming ingest pipeline against the notebook flow.")
+    p.add_argument('--rows', type=int, nargs='+', default=[14_000, 1_000_000])
+    p.add_argument('--tmp-dir', default=None)
+    p.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.worker:
+        run_worker(*args.worker)
+        return 0
+
+    print(f"{'rows':>10} {'csv MB':>8} {'mode':<9} {'seconds':>8} {'peak RSS MB':>12} {'above imports':>14} {'kept':>9}")
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp:
+        for n_rows in args.rows:
+            csv_path = f'{tmp}/crawl_{n_rows}.csv'
+            write_crawl_csv(csv_path, n_rows)
+            size_mb = os.path.getsize(csv_path) / 1e6
+            results = {}
+            for mode in ('notebook', 'pipeline'):
+                result = measure(mode, csv_path, f'{tmp}/{mode}.npy')
+                results[mode] = np.load(f'{tmp}/{mode}.npy')
+                print(f"{n_rows:>10,} {size_mb:>8.1f} {mode:<9} {result['seconds']:>8.2f} "
+                      f"{result['peak_rss_mb']:>12.1f} {result['peak_rss_mb'] - result['baseline_mb']:>14.1f} "
+                      f"{result['rows']:>9,}")
+            same = results['notebook'].shape == results['pipeline'].shape and np.allclose(
+                results['notebook'], results['pipeline'], rtol=1e-9, atol=1e-9)
+            print(f"{'':>10} X_scaled parity: {'OK' if same else 'MISMATCH'}")
+            if not same:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,439 @@
+"""
+Benchmark ML API endpoints (in-process, không cần chạy server)
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/benchmark_ml_api.py predict-batch --rows 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)  # ml_api load models từ 'models/' theo cwd
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import ml_api  # noqa: E402
+
+
+_listings_df = None
+
+
+def listings_df():
+    """recommendation_df (API không giữ DataFrame này sau khi load models)"""
+    global _listings_df
+    if _listings_df is None:
+        _listings_df = joblib.load('models/recommendation_df.pkl')
+    return _listings_df
+
+
+def sample_predict_payloads(n_rows, seed=42):
+    """Tạo payload /predict từ các nhà thật trong recommendation_df"""
+    df = listings_df()
+    rng = np.random.default_rng(seed)
+    rows = df.iloc[rng.integers(0, len(df), size=n_rows)]
+    payloads = []
+    for area, rooms, toilets, floors, lat, lng, district, ward in zip(
+        rows['area'], rows['rooms'], rows['toilets'], rows['floors'],
+        rows['lat'], rows['lng'], rows['district'], rows['ward']
+    ):
+        payloads.append({
+            "area": float(area),
+            "rooms": float(rooms),
+            "toilets": float(toilets),
+            "floors": float(floors),
+            "lat": float(lat),
+            "lng": float(lng),
+            "district": district,
+            "ward": ward,
+        })
+    return payloads
+
+
+def bench_predict_batch(client, args):
+    payloads = sample_predict_payloads(args.rows)
+
+    # Single-row endpoint trong vòng lặp (lấy mẫu rồi quy đổi ra rows/sec)
+    n_single = min(args.single_rows, len(payloads))
+    start = time.perf_counter()
+    for payload in payloads[:n_single]:
+        response = client.post("/predict", json=payload)
+        response.raise_for_status()
+    single_elapsed = time.perf_counter() - start
+    single_rps = n_single / single_elapsed
+
+    # Batch endpoint
+    batch_elapsed = 0.0
+    for offset in range(0, len(payloads), args.batch_size):
+        chunk = payloads[offset:offset + args.batch_size]
+        start = time.perf_counter()
+        response = client.post("/predict/batch", json={"items": chunk})
+        batch_elapsed += time.perf_counter() - start
+        response.raise_for_status()
+        assert response.json()["n_failed"] == 0
+    batch_rps = len(payloads) / batch_elapsed
+
+    print(f"\n--- /predict vs /predict/batch ({len(payloads):,} rows, batch_size={args.batch_size}) ---")
+    print(f"Single-row loop : {single_rps:10,.0f} rows/sec ({n_single:,} rows sampled)")
+    print(f"Batch endpoint  : {batch_rps:10,.0f} rows/sec")
+    print(f"Speedup         : {batch_rps / single_rps:10.1f}x")
+
+
+def sample_recommend_payloads(n_rows, seed=42):
+    """Tạo payload /recommend/by-features từ các nhà thật trong recommendation_df"""
+    df = listings_df()
+    rng = np.random.default_rng(seed)
+    rows = df.iloc[rng.integers(0, len(df), size=n_rows)]
+    return [
+        {
+            "price": float(price),
+            "area": float(area),
+            "rooms": float(rooms),
+            "district": district,
+            "n_recommendations": 5,
+        }
+        for price, area, rooms, district in zip(rows['price'], rows['area'], rows['rooms'], rows['district'])
+    ]
+
+
+def latency_percentiles(client, requests):
+    """Gọi tuần tự list (path, payload) - payload None là GET; trả về (p50, p99) tính bằng ms"""
+    timings = []
+    for path, payload in requests:
+        start = time.perf_counter()
+        if payload is None:
+            response = client.get(path)
+        else:
+            response = client.post(path, json=payload)
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def bench_latency(client, args):
+    n = args.latency_requests
+    rng = np.random.default_rng(0)
+    house_ids = rng.integers(0, ml_api.model_registry.active.listing_table.n_rows, size=n)
+
+    cases = [
+        ("/predict", [("/predict", payload) for payload in sample_predict_payloads(n)]),
+        ("/recommend/by-features", [("/recommend/by-features", payload) for payload in sample_recommend_payloads(n)]),
+    ]
+    for limit in args.limits:
+        cases.append((
+            f"/recommend/by-id limit={limit}",
+            [(f"/recommend/by-id/{house_id}?limit={limit}", None) for house_id in house_ids],
+        ))
+
+    print(f"\n--- Latency ({n:,} sequential requests / endpoint) ---")
+    for label, requests in cases:
+        p50, p99 = latency_percentiles(client, requests)
+        print(f"{label:<30} p50={p50:8.2f} ms   p99={p99:8.2f} ms")
+
+
+def time_per_call(fn, repeat):
+    """Thời gian trung bình mỗi lần gọi (ms)"""
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_topk(client, args):
+    from sklearn.neighbors import NearestNeighbors
+
+    rng = np.random.default_rng(0)
+    X_scaled = ml_api.model_registry.active.recommendation_X_scaled
+    datasets = [("current", np.asarray(X_scaled, dtype=np.float64))]
+    for n_rows in args.synthetic_rows:
+        datasets.append((f"synthetic", rng.standard_normal((n_rows, X_scaled.shape[1]))))
+
+    print(f"\n--- Cosine top-k (k={args.k}) : sklearn kneighbors vs CosineTopK ---")
+    print(f"{'dataset':<10} {'rows':>10} {'query':>10} {'sklearn ms':>12} {'CosineTopK ms':>14} {'speedup':>8}")
+    for label, X in datasets:
+        knn = NearestNeighbors(metric='cosine', algorithm='brute', n_jobs=-1).fit(X)
+        index = ml_api.CosineTopK(X)
+        queries = X[rng.integers(0, len(X), size=args.topk_batch)] + rng.normal(scale=0.1, size=(args.topk_batch, X.shape[1]))
+        repeat = max(1, args.topk_repeat * 14415 // len(X))
+
+        for query_label, sklearn_fn, engine_fn in [
+            ("single", lambda: knn.kneighbors(queries[:1], n_neighbors=args.k),
+             lambda: index.search(queries[0], args.k)),
+            (f"batch {args.topk_batch}", lambda: knn.kneighbors(queries, n_neighbors=args.k),
+             lambda: index.search_batch(queries, args.k)),
+        ]:
+            sklearn_ms = time_per_call(sklearn_fn, repeat)
+            engine_ms = time_per_call(engine_fn, repeat)
+            print(f"{label:<10} {len(X):>10,} {query_label:>10} {sklearn_ms:>12.3f} {engine_ms:>14.3f} "
+                  f"{sklearn_ms / engine_ms:>7.1f}x")
+
+
+async def run_concurrent(path, payloads, concurrency, probe_path=None):
+    """
+    Gửi payloads tới path bằng `concurrency` client đồng thời (httpx + ASGITransport, cùng event loop với app)
+    
+    Returns: (requests/sec, latencies ms, latencies ms của probe_path gọi song song mỗi 10 ms)
+    """
+    import asyncio
+    import httpx
+
+    transport = httpx.ASGITransport(app=ml_api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        pending = iter(payloads)
+        timings, probe_timings = [], []
+        done = asyncio.Event()
+
+        async def worker():
+            for payload in pending:
+                start = time.perf_counter()
+                response = await client.post(path, json=payload)
+                timings.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                response = await client.get(probe_path)
+                probe_timings.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe()) if probe_path else None
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        if probe_task is not None:
+            await probe_task
+    return len(payloads) / elapsed, timings, probe_timings
+
+
+def bench_concurrency(client, args):
+    import asyncio
+
+    predict_payloads = sample_predict_payloads(args.concurrent_requests)
+    recommend_payloads = sample_recommend_payloads(args.concurrent_requests)
+    batcher = ml_api.prediction_batcher
+    default_batch = batcher.max_batch
+
+    print(f"\n--- Concurrent clients ({args.concurrent_requests:,} requests / case, "
+          f"{ml_api.inference_executor.max_workers} inference threads) ---")
+    print(f"{'case':<34} {'clients':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11}")
+    for concurrency in args.concurrency:
+        for label, max_batch in [("/predict (no coalescing)", 1), ("/predict (coalescing)", default_batch)]:
+            batcher.max_batch = max_batch
+            batches_before, items_before = batcher.batches, batcher.items
+            rps, timings, _ = asyncio.run(run_concurrent("/predict", predict_payloads, concurrency))
+            mean_batch = (batcher.items - items_before) / max(1, batcher.batches - batches_before)
+            print(f"{label:<34} {concurrency:>8} {rps:>9,.0f} {np.percentile(timings, 50):>8.2f} "
+                  f"{np.percentile(timings, 99):>8.2f} {mean_batch:>11.1f}")
+        batcher.max_batch = default_batch
+
+        rps, timings, health = asyncio.run(
+            run_concurrent("/recommend/by-features", recommend_payloads, concurrency, probe_path="/health")
+        )
+        print(f"{'/recommend/by-features':<34} {concurrency:>8} {rps:>9,.0f} {np.percentile(timings, 50):>8.2f} "
+              f"{np.percentile(timings, 99):>8.2f} {'':>11}")
+        print(f"{'  /health during load':<34} {'':>8} {'':>9} {np.percentile(health, 50):>8.2f} "
+              f"{np.percentile(health, 99):>8.2f} {f'n={len(health)}':>11}")
+
+
+def bench_cache(client, args):
+    """Replay /predict với payload lặp lại (phân phối Zipf, giống form gửi lại / backend retry)"""
+    cache = ml_api.prediction_cache
+    distinct = sample_predict_payloads(args.cache_distinct, seed=7)
+    rng = np.random.default_rng(0)
+    order = np.minimum(rng.zipf(1.3, size=args.latency_requests) - 1, len(distinct) - 1)
+    requests = [("/predict", distinct[i]) for i in order]
+
+    print(f"\n--- Prediction cache ({len(requests):,} requests, {len(distinct):,} distinct payloads, Zipf 1.3) ---")
+    max_bytes = cache.max_bytes
+    for label, enabled in [("cache off", False), ("cache on", True)]:
+        cache.max_bytes = max_bytes if enabled else 0
+        cache.clear()
+        hits_before, misses_before = cache.hits, cache.misses
+        p50, p99 = latency_percentiles(client, requests)
+        lookups = (cache.hits - hits_before) + (cache.misses - misses_before)
+        hit_rate = (cache.hits - hits_before) / lookups if lookups else 0.0
+        print(f"{label:<10} p50={p50:7.2f} ms   p99={p99:7.2f} ms   hit rate={hit_rate:6.1%}   "
+              f"entries={len(cache.entries):,}   bytes={cache.bytes:,}")
+    cache.max_bytes = max_bytes
+
+
+def synthetic_filter_bundle(active, n_rows, rng):
+    """n_rows nhà: listing columns lấy mẫu từ data hiện tại (giữ phân phối district / ward / giá), X ngẫu nhiên"""
+    import pandas as pd
+    from types import SimpleNamespace
+
+    table = active.listing_table
+    sample = rng.integers(0, table.n_rows, size=n_rows)
+    columns = {col: table.take_numeric(col, sample) for col in ml_api.LISTING_NUMERIC_COLUMNS}
+    columns.update({col: table.take_strings(col, sample) for col in ('district', 'ward')})
+    listing_table = ml_api.ListingTable.from_dataframe(pd.DataFrame(columns))
+    X = rng.standard_normal((n_rows, active.recommendation_X_scaled.shape[1]))
+    return SimpleNamespace(recommendation_index=ml_api.CosineTopK(X), listing_table=listing_table, delta=None,
+                           filter_index=None)
+
+
+def mask_scan(bundle, filters, query, k):
+    """Không có index: so sánh cả cột để tạo mask, score cả ma trận, top-k trong mask"""
+    table, index = bundle.listing_table, bundle.recommendation_index
+    mask = np.ones(table.n_rows, dtype=bool)
+    for col in ml_api.FILTER_POSTINGS:
+        value = getattr(filters, col)
+        if value is not None:
+            vocab = table.strings[col].vocab.tolist()
+            mask &= table.strings[col].codes == (vocab.index(value) if value in vocab else -1)
+    for col, (low_name, high_name) in ml_api.FILTER_RANGES.items():
+        low = getattr(filters, low_name)
+        high = getattr(filters, high_name) if high_name else None
+        if low is not None:
+            mask &= table.numeric[col] >= low
+        if high is not None:
+            mask &= table.numeric[col] <= high
+    rows = np.flatnonzero(mask)
+    query_unit = ml_api.l2_normalize(query.reshape(1, -1))
+    scores = (index.unit @ query_unit[0].astype(np.float32))[rows]
+    pool = min(k + ml_api.CosineTopK.RERANK_MARGIN, len(rows))
+    candidates = rows[np.argpartition(scores, len(rows) - pool)[len(rows) - pool:]] if pool < len(rows) else rows
+    return ml_api.rerank_cosine(index.X, candidates[None, :], query_unit, min(k, len(candidates)))
+
+
+def bench_filters(client, args):
+    rng = np.random.default_rng(0)
+    active = ml_api.model_registry.active
+    datasets = [("current", active)]
+    for n_rows in args.synthetic_rows:
+        datasets.append(("synthetic", synthetic_filter_bundle(active, n_rows, rng)))
+
+    print(f"\n--- Filtered recommendation search (k={args.k}) : mask scan vs posting lists / sorted index ---")
+    print(f"{'dataset':<10} {'rows':>10} {'filter':<34} {'matches':>9} {'mask scan ms':>13} {'index ms':>9} {'speedup':>8}")
+    for label, bundle in datasets:
+        table = bundle.listing_table
+        if bundle.filter_index is None:
+            start = time.perf_counter()
+            bundle.filter_index = ml_api.ListingFilterIndex(table)
+            print(f"{label:<10} {table.n_rows:>10,} (filter index built in {time.perf_counter() - start:.2f}s)")
+        top = {col: table.strings[col].vocab[np.bincount(table.strings[col].codes).argmax()] for col in ('district', 'ward')}
+        cases = [
+            ("ward", {"ward": top['ward']}),
+            ("district + price 3-6 ty", {"district": top['district'], "price_min": 3e9, "price_max": 6e9}),
+            ("district", {"district": top['district']}),
+            ("price 3-8 ty", {"price_min": 3e9, "price_max": 8e9}),
+            ("area >= 30 m2, rooms >= 2", {"area_min": 30, "rooms_min": 2}),
+        ]
+        X = bundle.recommendation_index.X
+        queries = X[rng.integers(0, len(X), size=20)] + rng.normal(scale=0.1, size=(20, X.shape[1]))
+        repeat = max(1, args.topk_repeat * 14415 // len(X))
+        for case, values in cases:
+            filters = ml_api.RecommendationFilters(**values)
+            matches = len(ml_api.filtered_rows(bundle, filters))
+            for query in queries:
+                _, expected = mask_scan(bundle, filters, query, args.k)
+                _, found = ml_api.filtered_search(bundle, query, args.k, ml_api.filtered_rows(bundle, filters))
+                assert np.array_equal(expected[0], found), case
+            scan_ms = time_per_call(lambda: [mask_scan(bundle, filters, q, args.k) for q in queries], repeat) / len(queries)
+            index_ms = time_per_call(
+                lambda: [ml_api.filtered_search(bundle, q, args.k, ml_api.filtered_rows(bundle, filters)) for q in queries],
+                repeat) / len(queries)
+            print(f"{label:<10} {table.n_rows:>10,} {case:<34} {matches:>9,} {scan_ms:>13.3f} {index_ms:>9.3f} "
+                  f"{scan_ms / index_ms:>7.1f}x")
+
+
+def bench_trees(client, args):
+    active = ml_api.model_registry.active
+    model, scaler = active.prediction_model, active.prediction_scaler
+    engine = ml_api.CompiledTreeEnsemble.from_estimator(model, scaler)
+    if engine is None:
+        print(f"\n{type(model).__name__} cannot be compiled, skipping")
+        return
+    rng = np.random.default_rng(0)
+    X = (rng.normal(size=(max(args.tree_rows), engine.n_features)) * scaler.scale_ + scaler.mean_).astype(np.float32)
+
+    print(f"\n--- Price model ({type(model).__name__}, {engine.n_trees} trees, depth {engine.max_depth}) : "
+          f"scaler + predict vs CompiledTreeEnsemble ---")
+    print(f"{'rows':>10} {'sklearn ms':>12} {'compiled ms':>12} {'speedup':>8}")
+    for n_rows in args.tree_rows:
+        rows = X[:n_rows]
+        assert np.allclose(engine.predict(rows), model.predict(scaler.transform(rows)), rtol=1e-9, atol=1e-6)
+        repeat = max(3, 2000 // n_rows)
+        sklearn_ms = time_per_call(lambda: model.predict(scaler.transform(rows)), repeat)
+        engine_ms = time_per_call(lambda: engine.predict(rows), repeat)
+        print(f"{n_rows:>10,} {sklearn_ms:>12.3f} {engine_ms:>12.3f} {sklearn_ms / engine_ms:>7.1f}x")
+
+
+def bench_engines(client, args):
+    active = ml_api.model_registry.active
+    model, scaler = active.prediction_model, active.prediction_scaler
+    n_features = len(active.prediction_features)
+    engines = {"sklearn": lambda X: model.predict(scaler.transform(X))}
+    compiled = ml_api.CompiledTreeEnsemble.from_estimator(model, scaler)
+    if compiled is not None:
+        engines["compiled"] = compiled.predict
+    onnx = ml_api.OnnxPricePredictor.load(active.path, n_features)
+    if onnx is not None:
+        engines["onnx"] = onnx.predict
+    X = ml_api.parity_rows(scaler, n_features, max(args.engine_batch))
+
+    print(f"\n--- Price model throughput (rows/sec) by PREDICTION_ENGINE ---")
+    print(f"{'batch':>8} " + " ".join(f"{name:>12}" for name in engines))
+    for batch in args.engine_batch:
+        rows = X[:batch]
+        repeat = max(3, 4000 // batch)
+        rates = [batch / time_per_call(lambda: predict(rows), repeat) * 1000 for predict in engines.values()]
+        print(f"{batch:>8,} " + " ".join(f"{rate:>12,.0f}" for rate in rates))
+
+
+BENCHMARKS = {
+    "predict-batch": bench_predict_batch,
+    "trees": bench_trees,
+    "engines": bench_engines,
+    "latency": bench_latency,
+    "topk": bench_topk,
+    "filters": bench_filters,
+    "concurrency": bench_concurrency,
+    "cache": bench_cache,
+}
+
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Benchmark ML API endpoints in-process.")
+    p.add_argument("benchmarks", nargs="*", metavar="BENCHMARK", help=f"Một trong: {', '.join(BENCHMARKS)} (mặc định: tất cả)")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--single-rows", type=int, default=500, help="Số dòng gọi /predict từng cái một")
+    p.add_argument("--batch-size", type=int, default=5000)
+    p.add_argument("--latency-requests", type=int, default=1000)
+    p.add_argument("--limits", type=int, nargs="+", default=[5, 50, 200], help="limit cho /recommend/by-id")
+    p.add_argument("--k", type=int, default=10, help="k cho benchmark topk")
+    p.add_argument("--topk-batch", type=int, default=64)
+    p.add_argument("--topk-repeat", type=int, default=50)
+    p.add_argument("--tree-rows", type=int, nargs="+", default=[1, 64, 1024, 10000], help="Số dòng cho benchmark trees")
+    p.add_argument("--engine-batch", type=int, nargs="+", default=[1, 64, 4096], help="Batch size cho benchmark engines")
+    p.add_argument("--synthetic-rows", type=int, nargs="*", default=[1_000_000])
+    p.add_argument("--cache-distinct", type=int, default=2000, help="Số payload khác nhau cho benchmark cache")
+    p.add_argument("--concurrent-requests", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="Số client đồng thời")
+    return p
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    with TestClient(ml_api.app) as client:
+        for name in args.benchmarks or list(BENCHMARKS):
+            BENCHMARKS[name](client, args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
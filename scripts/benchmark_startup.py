@@ -0,0 +1,99 @@
+"""
+Đo startup time và memory (RSS / PSS) của ML API khi chạy nhiều worker
+
+Mỗi worker là 1 process riêng gọi ml_api.load_models() rồi chạy vài query recommendation,
+giống uvicorn --workers N. PSS chia đều các page dùng chung (mmap / page cache) cho các process,
+nên tổng PSS là memory thật sự mà N workers chiếm.
+
+Usage (Linux, từ thư mục gốc hoặc scripts/):
+python scripts/benchmark_startup.py --workers 1 8
+python scripts/benchmark_startup.py --root /path/to/dir   # dir chứa models/ khác (vd. dataset lớn)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_memory_kb(pid):
+    """(Rss, Pss) theo kB từ /proc/<pid>/smaps_rollup"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                values[parts[0][:-1]] = int(parts[1])
+    return values['Rss'], values['Pss']
+
+
+def run_worker(root):
+    """Process con: load models, chạy query, báo kết quả rồi chờ parent đo memory"""
+    sys.path.insert(0, ROOT_DIR)
+    os.chdir(root)
+    start = time.perf_counter()
+
+    import contextlib
+    import io
+    import ml_api
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(ml_api.load_models())
+    startup_s = time.perf_counter() - start
+
+    # Chạm vào toàn bộ ma trận như khi serve traffic thật
+    n_houses = len(ml_api.model_registry.active.recommendation_X_scaled)
+    for house_id in range(0, n_houses, max(1, n_houses // 15)):
+        asyncio.run(ml_api.recommend_by_house_id(house_id, limit=10))
+
+    print(json.dumps({"startup_s": startup_s}), flush=True)
+    sys.stdin.readline()
+
+
+def measure(n_workers, root):
+    workers = [
+        subprocess.Popen(
+            [sys.executable, '-W', 'ignore', os.path.abspath(__file__), '--worker', '--root', root],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        for _ in range(n_workers)
+    ]
+    try:
+        startups = [json.loads(worker.stdout.readline())["startup_s"] for worker in workers]
+        memory = [read_memory_kb(worker.pid) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.stdin.write("\n")
+            worker.stdin.close()
+            worker.wait()
+
+    rss = [r / 1024 for r, _ in memory]
+    pss = [p / 1024 for _, p in memory]
+    print(f"{n_workers:>8} {sum(startups) / n_workers:>12.2f} {sum(rss) / n_workers:>14.1f} "
+          f"{sum(pss) / n_workers:>14.1f} {sum(pss):>14.1f}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Measure ML API startup time and per-worker memory.")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    p.add_argument("--root", default=ROOT_DIR, help="Thư mục chứa models/ (mặc định: thư mục gốc repo)")
+    p.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.worker:
+        run_worker(os.path.abspath(args.root))
+        return 0
+
+    print(f"{'workers':>8} {'startup s':>12} {'RSS MB/worker':>14} {'PSS MB/worker':>14} {'PSS MB total':>14}")
+    for n_workers in args.workers:
+        measure(n_workers, os.path.abspath(args.root))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
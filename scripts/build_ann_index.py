@@ -0,0 +1,96 @@
+"""
+Build IVF index (approximate nearest neighbours) cho recommendation offline
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/build_ann_index.py                       # build models/recommendation_ivf.npz + đánh giá recall
+python scripts/build_ann_index.py --synthetic-rows 1000000 --no-save
+
+API dùng index này khi chạy với RECOMMENDATION_INDEX=ivf (RECOMMENDATION_NPROBE để chỉnh nprobe).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+import ml_api  # noqa: E402
+
+MODELS_DIR = 'models'
+
+
+def synthetic_matrix(X, n_rows, seed=0):
+    """Dataset lớn giả lập: lấy mẫu các nhà thật + nhiễu Gaussian (giữ cấu trúc cụm của dữ liệu thật)"""
+    rng = np.random.default_rng(seed)
+    base = X[rng.integers(0, len(X), size=n_rows)]
+    return base + rng.normal(scale=0.1, size=base.shape)
+
+
+def evaluate(index, exact, X, k, nprobes, n_queries, seed=0):
+    """recall@k so với exact search + latency mỗi query cho từng nprobe"""
+    rng = np.random.default_rng(seed)
+    queries = X[rng.integers(0, len(X), size=n_queries)] + rng.normal(scale=0.1, size=(n_queries, X.shape[1]))
+
+    start = time.perf_counter()
+    for query in queries:
+        exact.search(query, k)
+    exact_ms = (time.perf_counter() - start) / n_queries * 1000
+    _, exact_indices = exact.search_batch(queries, k)
+
+    print(f"\n--- recall@{k} vs exact ({n_queries} queries, {index.n_lists} lists) ---")
+    print(f"{'nprobe':>8} {'recall':>8} {'ms/query':>10} {'speedup':>8}")
+    print(f"{'exact':>8} {1.0:>8.4f} {exact_ms:>10.3f} {1.0:>7.1f}x")
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query, k, nprobe=nprobe)
+        ivf_ms = (time.perf_counter() - start) / n_queries * 1000
+        _, ivf_indices = index.search_batch(queries, k, nprobe=nprobe)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ivf_indices, exact_indices)])
+        print(f"{nprobe:>8} {recall:>8.4f} {ivf_ms:>10.3f} {exact_ms / ivf_ms:>7.1f}x")
+
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Build and evaluate the IVF recommendation index.")
+    p.add_argument("--n-lists", type=int, default=None, help="Số list (mặc định 4*sqrt(N))")
+    p.add_argument("--n-iter", type=int, default=20)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    p.add_argument("--eval-queries", type=int, default=200)
+    p.add_argument("--synthetic-rows", type=int, default=0, help="Đánh giá trên dataset synthetic N dòng (không lưu)")
+    p.add_argument("--no-save", action="store_true")
+    return p
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    X = joblib.load(f'{MODELS_DIR}/recommendation_X_scaled.pkl')
+    save = not args.no_save and not args.synthetic_rows
+    if args.synthetic_rows:
+        X = synthetic_matrix(X, args.synthetic_rows, seed=args.seed)
+
+    start = time.perf_counter()
+    index = ml_api.IVFIndex.build(X, n_lists=args.n_lists, n_iter=args.n_iter, seed=args.seed)
+    build_s = time.perf_counter() - start
+    sizes = np.diff(index.list_offsets)
+    print(f"Built IVF index: {len(X):,} rows, {index.n_lists} lists "
+          f"(size min/median/max = {sizes.min()}/{int(np.median(sizes))}/{sizes.max()}) in {build_s:.1f}s")
+
+    if save:
+        path = f'{MODELS_DIR}/{ml_api.IVF_INDEX_FILE}'
+        index.save(path)
+        print(f"✓ Saved: {path}")
+
+    evaluate(index, ml_api.CosineTopK(X), X, args.k, args.nprobe, args.eval_queries, seed=args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,105 @@
+"""
+Precompute top-K hàng xóm cho mọi nhà (phục vụ /recommend/by-id bằng 1 lần slice)
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/build_neighbor_table.py                          # -> models/recommendation_neighbor_*.npy
+python scripts/build_neighbor_table.py --models-dir models/v2 --k 50
+python scripts/build_neighbor_table.py --synthetic-rows 200000  # chỉ đo build time / size, không lưu
+
+API tự dùng bảng này khi có (limit > K thì fallback live search).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+import ml_api  # noqa: E402
+from build_ann_index import synthetic_matrix  # noqa: E402
+
+
+def check_parity(table, index, n_queries, seed=0):
+    """lookup trên bảng vs CosineTopK.search cho house id ngẫu nhiên và mọi limit <= K"""
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+    for house_id in rng.integers(0, index.n_samples, size=n_queries):
+        k = int(rng.integers(1, table.width + 1))
+        expected = index.search(index.X[house_id], k)
+        actual = table.lookup(index.X, house_id, k)
+        if not (np.array_equal(expected[1], actual[1]) and np.array_equal(expected[0], actual[0])):
+            mismatches += 1
+    return mismatches
+
+
+def time_lookups(table, index, k, n_queries, seed=0):
+    """ms / query: slice bảng vs live search (top-k gồm chính nó)"""
+    rng = np.random.default_rng(seed)
+    house_ids = rng.integers(0, index.n_samples, size=n_queries)
+    timings = []
+    for fn in (lambda h: table.lookup(index.X, h, k), lambda h: index.search(index.X[h], k)):
+        start = time.perf_counter()
+        for house_id in house_ids:
+            fn(house_id)
+        timings.append((time.perf_counter() - start) / n_queries * 1000)
+    return timings
+
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Precompute the top-K neighbour table for /recommend/by-id.")
+    p.add_argument("--models-dir", default="models", help="Thư mục version chứa recommendation_X_scaled.pkl")
+    p.add_argument("--k", type=int, default=ml_api.NEIGHBOR_TABLE_K)
+    p.add_argument("--block-rows", type=int, default=4096, help="Số dòng query mỗi block")
+    p.add_argument("--parity-queries", type=int, default=500)
+    p.add_argument("--synthetic-rows", type=int, default=0, help="Build trên dataset synthetic N dòng (không lưu)")
+    p.add_argument("--no-save", action="store_true")
+    return p
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    X = joblib.load(f'{args.models_dir}/recommendation_X_scaled.pkl')
+    save = not args.no_save and not args.synthetic_rows
+    if args.synthetic_rows:
+        X = synthetic_matrix(X, args.synthetic_rows)
+
+    index = ml_api.CosineTopK(X)
+    start = time.perf_counter()
+
+    def progress(done, total):
+        elapsed = time.perf_counter() - start
+        print(f"\r{done:,}/{total:,} rows  {elapsed:7.1f}s  (ETA {elapsed / done * (total - done):7.1f}s)", end="", flush=True)
+
+    table = ml_api.NeighborTable.build(index, k=args.k, block_rows=args.block_rows, progress=progress)
+    build_s = time.perf_counter() - start
+    print()
+
+    wide_bytes = table.ids.size * (8 + 8)  # int64 ids + float64 distances
+    print(f"Built neighbour table: {table.n_samples:,} rows x {table.width} (K={table.k}) in {build_s:.1f}s")
+    print(f"Size: {table.nbytes / 1e6:.1f} MB (int32 + float16), {wide_bytes / 1e6:.1f} MB as int64 + float64")
+
+    exact = index.search_batch(X[:min(2000, len(X))], table.width)[0]
+    error = np.abs(table.distances[:len(exact)].astype(np.float64) - exact).max()
+    print(f"Max float16 distance error: {error:.2e} (API re-scores the slice in float64)")
+
+    mismatches = check_parity(table, index, args.parity_queries)
+    print(f"Parity vs live search: {args.parity_queries - mismatches}/{args.parity_queries} identical")
+
+    for k in (6, table.width):
+        table_ms, live_ms = time_lookups(table, index, k, 500)
+        print(f"k={k:<3} table lookup {table_ms:.3f} ms   live search {live_ms:.3f} ms   ({live_ms / table_ms:.1f}x)")
+
+    if save:
+        table.save(args.models_dir)
+        print(f"✓ Saved: {args.models_dir}/{ml_api.NEIGHBOR_IDS_FILE}, {args.models_dir}/{ml_api.NEIGHBOR_DISTANCES_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,215 @@
+"""
+Kiểm tra parity giữa các fast path trong ml_api và cách làm gốc (notebook / sklearn)
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/check_parity.py            # chạy tất cả
+python scripts/check_parity.py encoder
+"""
+
+import argparse
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+import ml_api  # noqa: E402
+
+MODELS_DIR = 'models'
+
+
+def notebook_prediction_frame(df, encoders):
+    """Tái hiện feature engineering + LabelEncoder của notebook 01 (cell 7-9)"""
+    df_clean = df.copy()
+    df_clean['has_dimensions'] = (df_clean['width'].notna() & df_clean['length'].notna()).astype(int)
+    df_clean['total_rooms'] = df_clean['rooms'] + df_clean['toilets']
+    df_clean['toilet_room_ratio'] = df_clean['toilets'] / (df_clean['rooms'] + 1)
+    df_clean['area_per_floor'] = df_clean['area'] / (df_clean['floors'] + 0.1)
+    df_clean['total_floor_area'] = df_clean['area'] * df_clean['floors']
+    df_clean['width_length_ratio'] = df_clean['width'] / (df_clean['length'] + 0.1)
+    df_clean['distance_from_center'] = np.sqrt(
+        (df_clean['lat'] - ml_api.CENTER_LAT)**2 + (df_clean['lng'] - ml_api.CENTER_LNG)**2
+    )
+    df_clean['rooms_per_sqm'] = df_clean['total_rooms'] / (df_clean['area'] + 1)
+
+    for col, le in encoders.items():
+        values = df_clean[col] if col in df_clean.columns else pd.Series('Unknown', index=df_clean.index)
+        values = values.fillna('Unknown').astype(str)
+        # Giá trị không có lúc train -> code của 'Unknown' (hoặc 0)
+        classes = ml_api.encoder_classes(le)
+        fallback = classes.index('Unknown') if 'Unknown' in classes else 0
+        known = values.isin(classes)
+        codes = np.full(len(values), fallback)
+        codes[known.to_numpy()] = le.transform(values[known])
+        df_clean[col + '_encoded'] = codes
+    return df_clean
+
+
+def check_encoder(n_rows):
+    """PredictionEncoder.transform / transform_many vs LabelEncoder + one-hot bằng pandas"""
+    features = joblib.load(f'{MODELS_DIR}/price_prediction_features.pkl')
+    # Encoders API thật sự dùng (cùng đường load với ml_api.load_bundle)
+    served_encoders = ml_api.load_prediction_encoders(MODELS_DIR, features)
+    # Tham chiếu: encoders lúc train notebook 01, đọc độc lập với API
+    notebook_path = f'{MODELS_DIR}/{ml_api.NOTEBOOK_LABEL_ENCODERS}'
+    encoders = joblib.load(notebook_path if os.path.exists(notebook_path)
+                           else f'{MODELS_DIR}/price_prediction_encoders.pkl')
+
+    df = joblib.load(f'{MODELS_DIR}/recommendation_df.pkl')
+    df = df.sample(n=min(n_rows, len(df)), random_state=0).reset_index(drop=True)
+    df.loc[df.index % 7 == 0, 'district'] = 'Quận Không Tồn Tại'
+    df.loc[df.index % 11 == 0, 'ward'] = None
+
+    columns = {name: df[name].to_numpy(dtype=np.float64) for name in ml_api.PREDICT_NUMERIC_INPUTS}
+    columns['has_dimensions'] = np.ones(len(df))
+    for name in ml_api.PREDICT_CATEGORICAL_INPUTS:
+        values = df[name] if name in df.columns else pd.Series(None, index=df.index, dtype=object)
+        columns[name] = values.fillna('Unknown').to_numpy(dtype=object)
+    ml_api.engineer_prediction_features(columns)
+
+    # 1. Label encoding (format features hiện tại)
+    encoder = ml_api.PredictionEncoder(features, served_encoders)
+    expected = notebook_prediction_frame(df, {
+        col: le for col, le in encoders.items() if col + '_encoded' in features
+    })[features].to_numpy(dtype=np.float32)
+    actual = encoder.transform_many(columns)
+    assert np.allclose(actual, expected, rtol=1e-6, atol=1e-6), "transform_many != notebook encoding"
+
+    for i in range(min(len(df), 200)):
+        row = encoder.transform({name: col[i] for name, col in columns.items()})
+        assert np.allclose(row[0], expected[i], rtol=1e-6, atol=1e-6), f"transform != notebook encoding (row {i})"
+
+    # 2. One-hot encoding (format '<col>_<value>')
+    frame = pd.DataFrame({name: columns[name] for name in ml_api.PREDICT_CATEGORICAL_INPUTS + ['area', 'rooms']})
+    dummies = pd.get_dummies(frame, columns=ml_api.PREDICT_CATEGORICAL_INPUTS)
+    onehot_features = ['area', 'rooms'] + [c for c in dummies.columns if c not in ('area', 'rooms')][::3]
+    onehot_features.append('district_Giá Trị Lạ')
+    onehot_encoder = ml_api.PredictionEncoder(onehot_features)
+    expected = dummies.reindex(columns=onehot_features, fill_value=0).to_numpy(dtype=np.float32)
+    assert np.array_equal(onehot_encoder.transform_many(columns), expected), "transform_many != get_dummies"
+
+    print(f"encoder: OK ({len(df):,} rows, {len(features)} features, "
+          f"{len(onehot_features)} one-hot features)")
+
+
+def compare_neighbors(name, queries, X, expected, actual, atol=1e-9):
+    """
+    So sánh (distances, indices) với kneighbors
+    
+    Index chỉ được khác ở vị trí hòa distance - khi đó distance thật của index trả về phải bằng expected.
+    """
+    from sklearn.metrics.pairwise import cosine_distances
+
+    exp_dist, exp_idx = expected
+    act_dist, act_idx = actual
+    assert np.allclose(exp_dist, act_dist, rtol=0, atol=atol), f"{name}: distances differ"
+    ties = 0
+    for row in np.flatnonzero((exp_idx != act_idx).any(axis=1)):
+        true_dist = cosine_distances(queries[row:row + 1], X[act_idx[row]])[0]
+        assert np.allclose(true_dist, exp_dist[row], rtol=0, atol=atol), f"{name}: indices differ (query {row})"
+        ties += int((exp_idx[row] != act_idx[row]).sum())
+    return ties
+
+
+def check_topk(n_rows):
+    """CosineTopK.search / search_batch vs NearestNeighbors.kneighbors"""
+    knn = joblib.load(f'{MODELS_DIR}/recommendation_knn.pkl')
+    X = joblib.load(f'{MODELS_DIR}/recommendation_X_scaled.pkl')
+    index = ml_api.CosineTopK(X)
+    k = 11
+
+    expected = knn.kneighbors(X, n_neighbors=k)
+    ties = compare_neighbors("search_batch (all houses)", X, X, expected, index.search_batch(X, k))
+
+    rng = np.random.default_rng(0)
+    queries = X[rng.integers(0, len(X), size=min(n_rows, 500))] + rng.normal(scale=0.3, size=(min(n_rows, 500), X.shape[1]))
+    exp_dist, exp_idx = knn.kneighbors(queries, n_neighbors=50)
+    single = [index.search(q, 50) for q in queries]
+    actual = (np.array([d for d, _ in single]), np.array([i for _, i in single]))
+    ties += compare_neighbors("search (random queries)", queries, X, (exp_dist, exp_idx), actual)
+
+    print(f"topk: OK ({len(X):,} house queries k={k}, {len(queries)} random queries k=50, "
+          f"{ties} positions differ only by tie order)")
+
+
+def synthetic_price_rows(rng, n_rows, n_features, scaler=None):
+    """Dòng quanh phân phối lúc train (theo scaler) nhưng rộng hơn, nửa số dòng làm tròn như số phòng / tầng"""
+    mean = getattr(scaler, 'mean_', np.zeros(n_features))
+    scale = getattr(scaler, 'scale_', np.ones(n_features))
+    X = rng.normal(scale=1.5, size=(n_rows, n_features)) * scale + mean
+    X[::2] = np.round(X[::2])
+    return X.astype(np.float32)
+
+
+def check_trees(n_rows):
+    """CompiledTreeEnsemble.predict vs sklearn predict (model đang serve + gradient boosting của notebook 01)"""
+    rng = np.random.default_rng(0)
+    cases = [(f'{MODELS_DIR}/price_prediction_model.pkl', f'{MODELS_DIR}/price_prediction_scaler.pkl'),
+             (f'{MODELS_DIR}/house_price_model_gradient_boosting.pkl', None)]
+    for model_path, scaler_path in cases:
+        if not os.path.exists(model_path):
+            continue
+        model = joblib.load(model_path)
+        scaler = joblib.load(scaler_path) if scaler_path else None
+        engine = ml_api.CompiledTreeEnsemble.from_estimator(model, scaler)
+        assert engine is not None, f"{model_path}: {type(model).__name__} cannot be compiled"
+
+        X = synthetic_price_rows(rng, n_rows, model.n_features_in_, scaler)
+        expected = model.predict(scaler.transform(X) if scaler is not None else X)
+        assert np.allclose(engine.predict(X), expected, rtol=1e-9, atol=1e-6), f"{model_path}: predict differs"
+        for i in range(min(n_rows, 200)):
+            assert np.allclose(engine.predict(X[i:i + 1]), expected[i], rtol=1e-9, atol=1e-6), f"{model_path}: row {i}"
+        print(f"trees: OK {os.path.basename(model_path)} ({type(model).__name__}, {engine.n_trees} trees, "
+              f"{engine.n_nodes:,} nodes, {n_rows:,} rows)")
+
+
+def check_onnx(n_rows):
+    """OnnxPricePredictor (file của convert_to_onnx.py) vs scaler + predict của pickle"""
+    model = joblib.load(f'{MODELS_DIR}/price_prediction_model.pkl')
+    scaler = joblib.load(f'{MODELS_DIR}/price_prediction_scaler.pkl')
+    n_features = len(joblib.load(f'{MODELS_DIR}/price_prediction_features.pkl'))
+    engine = ml_api.OnnxPricePredictor.load(MODELS_DIR, n_features)
+    if engine is None:
+        print("onnx: SKIPPED")
+        return
+
+    X = synthetic_price_rows(np.random.default_rng(0), n_rows, n_features, scaler)
+    expected = model.predict(scaler.transform(X))
+    # Batch lớn hơn buffer -> chạy nhiều block
+    actual = engine.predict(np.concatenate([X] * (engine.buffer_rows // n_rows + 2)))[:n_rows]
+    assert np.allclose(actual, expected, rtol=engine.rtol, atol=1e-6), "onnx batch differs from pickle"
+    for i in range(min(n_rows, 200)):
+        assert np.allclose(engine.predict(X[i:i + 1]), expected[i], rtol=engine.rtol, atol=1e-6), f"onnx row {i}"
+    max_error = np.max(np.abs(actual - expected) / np.abs(expected))
+    print(f"onnx: OK ({', '.join(map(os.path.basename, engine.paths))}, {n_rows:,} rows, max relative error {max_error:.1e})")
+
+
+CHECKS = {
+    "encoder": check_encoder,
+    "topk": check_topk,
+    "trees": check_trees,
+    "onnx": check_onnx,
+}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Parity checks for ml_api fast paths.")
+    p.add_argument("checks", nargs="*", metavar="CHECK", help=f"Một trong: {', '.join(CHECKS)} (mặc định: tất cả)")
+    p.add_argument("--rows", type=int, default=5000)
+    args = p.parse_args(argv)
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        p.error(f"unknown check(s): {', '.join(unknown)}")
+
+    for name in args.checks or list(CHECKS):
+        CHECKS[name](args.rows)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,11 @@
 """
 Convert scikit-learn .pkl models to ONNX format for Node.js usage
 
+Ngoài scaler / model riêng lẻ còn export graph gộp (1 lần run mỗi prediction):
+- price_prediction_pipeline.onnx: scaler + regressor
+- recommendation_query.onnx: scaler + L2 normalize (cosine similarity = dot product với vector đơn vị)
+Bảng nhà ghi thành listing bundle nhị phân (xem listing_bundle.py) thay cho recommendation_houses.json.
+
 Requirements:
 pip install scikit-learn onnx skl2onnx onnxruntime joblib pandas numpy
 """
@@ -9,11 +14,15 @@ import joblib
 import json
 import numpy as np
 import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import Normalizer
 from skl2onnx import convert_sklearn
 from skl2onnx.common.data_types import FloatTensorType, DoubleTensorType
 import onnx
 import os
 
+from listing_bundle import write_listing_bundle
+
 def save_json(data, filepath):
     """Save data as JSON"""
     with open(filepath, 'w', encoding='utf-8') as f:
@@ -85,6 +94,13 @@ def main():
             f'{output_dir}/price_prediction_scaler.onnx'
         )
 
+        # Scaler + model trong 1 graph: 1 lần run, output của scaler không phải copy ra ngoài
+        convert_model_to_onnx(
+            Pipeline([('scaler', prediction_scaler), ('model', prediction_model)]),
+            initial_type,
+            f'{output_dir}/price_prediction_pipeline.onnx'
+        )
+
         # Save features as JSON
         save_json(prediction_features, f'{output_dir}/price_prediction_features.json')
 
@@ -134,6 +150,14 @@ def main():
             f'{output_dir}/recommendation_scaler.onnx'
         )
 
+        # Scaler + L2 normalize trong 1 graph -> vector đơn vị của query
+        normalizer = Normalizer(norm='l2').fit(recommendation_X_scaled)
+        convert_model_to_onnx(
+            Pipeline([('scaler', recommendation_scaler), ('normalizer', normalizer)]),
+            initial_type_rec,
+            f'{output_dir}/recommendation_query.onnx'
+        )
+
         # Save features as JSON
         save_json(recommendation_features, f'{output_dir}/recommendation_features.json')
 
@@ -145,18 +169,11 @@ def main():
         np.save(f'{output_dir}/recommendation_X_scaled.npy', recommendation_X_scaled)
         print(f"✓ Saved: {output_dir}/recommendation_X_scaled.npy")
 
-        # Save DataFrame as JSON (for house lookup)
-        # Select only necessary columns to reduce size
-        essential_cols = [
-            'price', 'area', 'rooms', 'toilets', 'floors',
-            'district', 'ward', 'title', 'lat', 'lng',
-            'width', 'length'
-        ]
-        df_subset = recommendation_df[[col for col in essential_cols if col in recommendation_df.columns]]
-
-        # Convert to JSON-serializable format
-        df_dict = df_subset.to_dict(orient='records')
-        save_json(df_dict, f'{output_dir}/recommendation_houses.json')
+        # Save houses as a binary columnar bundle (for house lookup)
+        # Typed arrays + string dictionary + sha256, ~2.5x nhỏ hơn JSON indent và không phải parse cả file
+        bundle = write_listing_bundle(recommendation_df, output_dir)
+        print(f"✓ Saved: {output_dir}/{bundle['file']} ({bundle['n_rows']} houses, "
+              f"{len(bundle['columns'])} columns, {bundle['size'] / 1e6:.1f} MB)")
 
     except Exception as e:
         print(f"✗ Error in recommendation conversion: {str(e)}")
@@ -171,13 +188,16 @@ def main():
         "price_prediction": {
             "model_type": type(prediction_model).__name__,
             "n_features": n_features,
-            "features": prediction_features
+            "features": prediction_features,
+            "pipeline": "price_prediction_pipeline.onnx"
         },
         "recommendation": {
             "model_type": type(recommendation_knn).__name__,
             "n_features": n_rec_features,
             "n_houses": len(recommendation_df),
-            "features": recommendation_features
+            "features": recommendation_features,
+            "query_pipeline": "recommendation_query.onnx",
+            "houses": "recommendation_houses.manifest.json"
         }
     }
 
@@ -0,0 +1,404 @@
+"""
+Cập nhật recommendation index tăng dần: delta segment append-only + tombstones + compaction
+
+Listing mới từ crawler được scale bằng recommendation_scaler / encoders của version đang serve
+(không fit lại, không refit NearestNeighbors) rồi ghi thành 1 segment trong models/<version>/delta/.
+API load delta trong vài ms (watcher MODEL_WATCH_INTERVAL hoặc POST /admin/delta/refresh + X-Admin-Token) và
+merge top-k của base + delta. Tin hết hạn / đã bán -> tombstone; tin re-push (cùng ad id) thay
+dòng cũ. compact gộp base + delta (bỏ tombstone) thành 1 version mới, registry tự chuyển sang.
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/delta_index.py append data/chotot_region13000_incremental.parquet
+python scripts/delta_index.py tombstone --ad-id 123456789 123456790
+python scripts/delta_index.py compact --min-rows 50000 --min-tombstones 20000 --every 600
+python scripts/delta_index.py status
+"""
+
+import argparse
+import fcntl
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ingest_crawl  # noqa: E402  (chdir về thư mục gốc + import ml_api)
+from ingest_crawl import ml_api  # noqa: E402
+
+LOCK_FILE = '.delta.lock'
+BASE_AD_IDS_FILE = 'base_ad_ids.npy'
+# Quá số segment này thì append gộp tất cả thành 1 segment (house id giữ nguyên)
+MAX_SEGMENTS = 8
+
+
+@contextmanager
+def delta_lock(models_root):
+    """1 writer cho mọi version: append / tombstone chờ compact xong rồi mới chọn version"""
+    with open(f'{models_root}/{LOCK_FILE}', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def resolve_version(models_root, version):
+    registry = ml_api.ModelRegistry(models_root)
+    version = version or registry.latest_version()
+    if version is None or version not in registry.versions():
+        raise SystemExit(f"Model version not found: {version} (in {models_root})")
+    return version, registry.version_path(version)
+
+
+def base_matrix(version_dir):
+    """recommendation_X_scaled của base (mmap, export nếu chưa có)"""
+    if not ml_api.mmap_artifacts_fresh(version_dir):
+        ml_api.export_mmap_artifacts(version_dir, joblib.load(f'{version_dir}/recommendation_X_scaled.pkl'),
+                                     joblib.load(f'{version_dir}/recommendation_df.pkl'))
+    return np.load(f'{version_dir}/{ml_api.MMAP_DIR}/recommendation_X_scaled.npy', mmap_mode='r')
+
+
+def load_or_create_manifest(version_dir, X_base, scaler):
+    """
+    Manifest của delta/; lần đầu tính luôn các giá trị frozen lấy từ base:
+    median từng feature (điền giá trị thiếu), khoảng price / area đã lọc, ad id của base
+    """
+    manifest = ml_api.read_delta_manifest(version_dir)
+    if manifest is not None:
+        return manifest
+    directory = f'{version_dir}/{ml_api.DELTA_DIR}'
+    os.makedirs(directory, exist_ok=True)
+
+    listing = ml_api.ListingTable.load(f'{version_dir}/{ml_api.MMAP_DIR}')
+    df = joblib.load(f'{version_dir}/recommendation_df.pkl')
+    ad_ids = df['id'].to_numpy(dtype=np.float64, na_value=np.nan) if 'id' in df.columns else np.full(len(df), np.nan)
+    ml_api.save_npy_atomic(f'{directory}/{BASE_AD_IDS_FILE}', ad_ids)
+
+    # Median của cột đã scale -> inverse_transform = median của cột gốc (scale tuyến tính, đơn điệu)
+    medians = scaler.inverse_transform(np.median(np.asarray(X_base), axis=0).reshape(1, -1))[0]
+    price, area = listing.numeric['price'], listing.numeric['area']
+    return {
+        'base_rows': len(X_base),
+        'n_features': X_base.shape[1],
+        'fill_values': medians.tolist(),
+        'price_range': [float(np.nanmin(price)), float(np.nanmax(price))],
+        'area_range': [float(np.nanmin(area)), float(np.nanmax(area))],
+        'segments': [],
+        'next_segment': 1,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def save_manifest(version_dir, manifest):
+    manifest['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ml_api.save_json_atomic(f'{version_dir}/{ml_api.DELTA_DIR}/{ml_api.DELTA_MANIFEST_FILE}', manifest)
+
+
+def load_tombstones(version_dir):
+    path = f'{version_dir}/{ml_api.DELTA_DIR}/{ml_api.DELTA_TOMBSTONES_FILE}'
+    return np.load(path) if os.path.exists(path) else np.empty(0, dtype=np.int64)
+
+
+def save_tombstones(version_dir, tombstones):
+    ml_api.save_npy_atomic(f'{version_dir}/{ml_api.DELTA_DIR}/{ml_api.DELTA_TOMBSTONES_FILE}',
+                           np.unique(np.asarray(tombstones, dtype=np.int64)))
+
+
+def segment_ad_ids(version_dir, manifest):
+    directory = f'{version_dir}/{ml_api.DELTA_DIR}'
+    parts = [np.load(f'{directory}/{BASE_AD_IDS_FILE}')]
+    parts += [np.load(f'{directory}/{segment["name"]}/ad_ids.npy') for segment in manifest['segments']]
+    return np.concatenate(parts)
+
+
+def live_ad_index(version_dir, manifest):
+    """Series ad id -> house id của các dòng còn sống (mỗi ad id chỉ có tối đa 1 dòng sống)"""
+    ad_ids = segment_ad_ids(version_dir, manifest)
+    dead = np.zeros(len(ad_ids), dtype=bool)
+    tombstones = load_tombstones(version_dir)
+    dead[tombstones[tombstones < len(dead)]] = True
+    house_ids = np.flatnonzero(~dead & ~np.isnan(ad_ids))
+    return pd.Series(house_ids, index=ad_ids[house_ids].astype(np.int64))
+
+
+def build_rows(paths, features, scaler, encoders, manifest, chunk_rows=100_000):
+    """
+    Crawler rows -> (X_scaled, df, ad_ids, stats) bằng scaler / encoders frozen
+
+    Giống ingest_crawl.build_artifacts, trừ: khoảng price / area và median lấy từ base,
+    category chưa có trong encoder -> code 0 (như /recommend/by-features), tên được chuẩn hóa
+    theo ml_api.CategoryDictionary.
+    """
+    accumulator = ingest_crawl.ChunkAccumulator()
+    for path in paths:
+        for chunk in ingest_crawl.iter_chunks(path, chunk_rows):
+            accumulator.add(chunk)
+    columns, codes = accumulator.columns()
+    stats = {'rows_read': accumulator.rows_read}
+
+    keep = ingest_crawl.dedupe_latest(columns['id'], columns['date'])
+    stats['duplicates_removed'] = int((~keep).sum())
+    (price_low, price_high), (area_low, area_high) = manifest['price_range'], manifest['area_range']
+    price, area = columns['price'], columns['area']
+    in_range = (price >= price_low) & (price <= price_high) & (area >= area_low) & (area <= area_high)
+    stats['out_of_range'] = int((keep & ~in_range).sum())
+    rows = np.flatnonzero(keep & in_range)
+    for group in (columns, codes):
+        for col in group:
+            group[col] = group[col][rows]
+    stats['rows_kept'] = len(rows)
+
+    fill_values = dict(zip(features, manifest['fill_values']))
+    ingest_crawl.engineer(columns)
+    for col in ingest_crawl.NUMERIC_COLUMNS + ingest_crawl.ENGINEERED_COLUMNS:
+        values = columns[col]
+        values[np.isnan(values)] = fill_values.get(col, 0.0)
+    stats['unknown_categories'] = {}
+    for col in ingest_crawl.CATEGORICAL_COLUMNS:
+        vocabulary = accumulator.vocabularies[col].index.to_numpy(dtype=object)
+        if col in encoders:
+            # Lookup 1 lần cho mỗi giá trị distinct; biến thể chính tả ('Q. Cầu Giấy', NFD, 'Hoà')
+            # -> đúng class của encoder và df lưu tên class
+            dictionary = ml_api.CategoryDictionary.from_encoder(encoders[col])
+            vocabulary_codes = dictionary.lookup_many(vocabulary)
+            known = vocabulary_codes >= 0
+            vocabulary[known] = np.asarray(dictionary.classes, dtype=object)[vocabulary_codes[known]]
+            encoded = vocabulary_codes[codes[col]]
+        else:
+            encoded = np.zeros(len(rows), dtype=np.int64)
+        columns[col] = vocabulary[codes[col]]
+        stats['unknown_categories'][col] = int((encoded < 0).sum())
+        columns[col + '_encoded'] = np.maximum(encoded, 0)
+    columns['price_weighted'] = columns['price']
+    columns['price_per_sqm_weighted'] = columns['price_per_sqm']
+
+    X = np.empty((len(rows), len(features)), dtype=np.float64)
+    for j, name in enumerate(features):
+        X[:, j] = columns[name]
+        missing = ~np.isfinite(X[:, j])
+        X[missing, j] = fill_values[name]
+    X = scaler.transform(X) if len(X) else X
+
+    df = pd.DataFrame({col: columns[col] for col in ingest_crawl.DF_COLUMNS})
+    df['id'] = df['id'].astype('Int64')
+    df['price'] = df['price'].round().astype(np.int64)
+    return X, df, columns['id'], stats
+
+
+def write_segment(version_dir, manifest, X, ad_ids, df, **info):
+    """Ghi segment vào thư mục tạm rồi rename; trả về tên segment (chưa có trong manifest)"""
+    directory = f'{version_dir}/{ml_api.DELTA_DIR}'
+    name = f'seg_{manifest["next_segment"]:06d}'
+    tmp = f'{directory}/.tmp-{name}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    ml_api.save_delta_segment(tmp, X, ad_ids, df)
+    os.rename(tmp, f'{directory}/{name}')
+    manifest['segments'].append({'name': name, 'rows': len(X),
+                                 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **info})
+    manifest['next_segment'] += 1
+    return name
+
+
+def merge_segments(version_dir, manifest, log=print):
+    """Gộp mọi segment thành 1 (giữ cả dòng tombstone để house id không đổi)"""
+    directory = f'{version_dir}/{ml_api.DELTA_DIR}'
+    old = [segment['name'] for segment in manifest['segments']]
+    X = np.concatenate([np.load(f'{directory}/{name}/recommendation_X_scaled.npy') for name in old])
+    ad_ids = np.concatenate([np.load(f'{directory}/{name}/ad_ids.npy') for name in old])
+    df = pd.concat([joblib.load(f'{directory}/{name}/recommendation_df.pkl') for name in old], ignore_index=True)
+    manifest['segments'] = []
+    write_segment(version_dir, manifest, X, ad_ids, df, merged=old)
+    save_manifest(version_dir, manifest)
+    # API load segment vào memory nên xóa sau khi manifest mới đã có là an toàn
+    for name in old:
+        shutil.rmtree(f'{directory}/{name}', ignore_errors=True)
+    log(f"Merged {len(old)} segments into {manifest['segments'][0]['name']} ({len(X):,} rows)")
+
+
+def append(models_root, version, paths, chunk_rows=100_000, max_segments=MAX_SEGMENTS, log=print):
+    with delta_lock(models_root):
+        version, version_dir = resolve_version(models_root, version)
+        start = time.perf_counter()
+        X_base = base_matrix(version_dir)
+        scaler = joblib.load(f'{version_dir}/recommendation_scaler.pkl')
+        features = joblib.load(f'{version_dir}/recommendation_features.pkl')
+        encoders = joblib.load(f'{version_dir}/recommendation_encoders.pkl')
+        manifest = load_or_create_manifest(version_dir, X_base, scaler)
+
+        X, df, ad_ids, stats = build_rows(paths, features, scaler, encoders, manifest, chunk_rows)
+        if not len(X):
+            log(f"No new rows for version {version} ({stats})")
+            return stats
+
+        # Tin re-push (ad id đã có, còn sống) -> tombstone dòng cũ, dòng mới thắng
+        live = live_ad_index(version_dir, manifest)
+        known = ~np.isnan(ad_ids)
+        superseded = live.reindex(ad_ids[known].astype(np.int64)).dropna().to_numpy(dtype=np.int64)
+        stats['superseded'] = len(superseded)
+
+        name = write_segment(version_dir, manifest, X, ad_ids, df, inputs=[os.path.basename(p) for p in paths])
+        if len(superseded):
+            save_tombstones(version_dir, np.concatenate([load_tombstones(version_dir), superseded]))
+        save_manifest(version_dir, manifest)
+        stats['seconds'] = round(time.perf_counter() - start, 2)
+        log(f"Version {version}: appended {name} with {len(X):,} rows, {len(superseded):,} superseded "
+            f"({stats['seconds']}s)")
+
+        if len(manifest['segments']) > max_segments:
+            merge_segments(version_dir, manifest, log=log)
+        return stats
+
+
+def tombstone(models_root, version, ad_ids=(), house_ids=(), log=print):
+    with delta_lock(models_root):
+        version, version_dir = resolve_version(models_root, version)
+        manifest = ml_api.read_delta_manifest(version_dir)
+        if manifest is None:
+            X_base = base_matrix(version_dir)
+            manifest = load_or_create_manifest(version_dir, X_base, joblib.load(f'{version_dir}/recommendation_scaler.pkl'))
+        n_total = manifest['base_rows'] + sum(segment['rows'] for segment in manifest['segments'])
+
+        house_ids = [house_id for house_id in house_ids if 0 <= house_id < n_total]
+        found = live_ad_index(version_dir, manifest).reindex(list(ad_ids))
+        missing = found.index[found.isna()].tolist()
+        dead = np.concatenate([np.asarray(house_ids, dtype=np.int64), found.dropna().to_numpy(dtype=np.int64)])
+        save_tombstones(version_dir, np.concatenate([load_tombstones(version_dir), dead]))
+        save_manifest(version_dir, manifest)
+        log(f"Version {version}: {len(dead):,} houses tombstoned"
+            + (f", ad ids not found: {missing}" if missing else ""))
+        return dead
+
+
+def compact(models_root, version=None, new_version=None, min_rows=0, min_tombstones=0, neighbor_table=False,
+            log=print):
+    """base + delta - tombstones -> version mới (cùng scaler / encoders); None nếu delta chưa đủ lớn"""
+    with delta_lock(models_root):
+        version, version_dir = resolve_version(models_root, version)
+        manifest = ml_api.read_delta_manifest(version_dir)
+        if manifest is None:
+            return None
+        features = joblib.load(f'{version_dir}/recommendation_features.pkl')
+        delta = ml_api.DeltaSegments.load(version_dir, manifest, len(features))
+        if delta.n_rows < max(min_rows, 1) and delta.n_tombstones < max(min_tombstones, 1):
+            return None
+
+        start = time.perf_counter()
+        X_base = base_matrix(version_dir)
+        df = joblib.load(f'{version_dir}/recommendation_df.pkl')
+        directory = f'{version_dir}/{ml_api.DELTA_DIR}'
+        parts = [df] + [
+            joblib.load(f'{directory}/{name}/recommendation_df.pkl').reindex(columns=df.columns)
+            for name in delta.segments
+        ]
+        live = ~delta.dead
+        X = np.concatenate([np.asarray(X_base), delta.X])[live]
+        df = pd.concat(parts, ignore_index=True)[live].reset_index(drop=True)
+        # Giữ ad id (cả khi df của base không có cột id) để delta của version mới còn nhận ra tin re-push
+        ad_ids = pd.array(segment_ad_ids(version_dir, manifest)[live], dtype='Int64')
+        if 'id' in df.columns:
+            df['id'] = ad_ids
+        else:
+            df.insert(0, 'id', ad_ids)
+        stats = {
+            'source': 'scripts/delta_index.py compact',
+            'compacted_version': version,
+            'base_rows': delta.base_rows,
+            'delta_rows': delta.n_rows,
+            'tombstones': delta.n_tombstones,
+            'timings_s': {'merge': time.perf_counter() - start},
+        }
+        new_version = new_version or datetime.now().strftime('%Y-%m-%d_%H%M%S')
+        target = ingest_crawl.write_version(
+            models_root, new_version, version_dir, X, df,
+            joblib.load(f'{version_dir}/recommendation_scaler.pkl'),
+            joblib.load(f'{version_dir}/recommendation_encoders.pkl'),
+            stats, neighbor_table=neighbor_table, log=log, features=features,
+        )
+        log(f"Compacted {version} ({delta.base_rows:,} base + {delta.n_rows:,} delta - {delta.n_tombstones:,} "
+            f"tombstones) into {new_version}: {len(X):,} houses")
+        return target
+
+
+def status(models_root, version):
+    version, version_dir = resolve_version(models_root, version)
+    manifest = ml_api.read_delta_manifest(version_dir)
+    if manifest is None:
+        return {'version': version, 'delta': None}
+    return {
+        'version': version,
+        'base_rows': manifest['base_rows'],
+        'segments': [{key: segment[key] for key in ('name', 'rows', 'created_at')} for segment in manifest['segments']],
+        'delta_rows': sum(segment['rows'] for segment in manifest['segments']),
+        'tombstones': len(load_tombstones(version_dir)),
+        'updated_at': manifest.get('updated_at'),
+    }
+
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Append-only delta segments for the recommendation index.")
+    p.add_argument('--models-root', default=ml_api.MODELS_ROOT)
+    p.add_argument('--version', default=None, help="Version cần cập nhật (mặc định: mới nhất)")
+    sub = p.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('append', help="Scale crawler rows bằng scaler frozen và ghi 1 segment mới")
+    add.add_argument('inputs', nargs='+', help="CSV / .parquet / .arrow files hoặc glob pattern")
+    add.add_argument('--chunk-rows', type=int, default=100_000)
+    add.add_argument('--max-segments', type=int, default=MAX_SEGMENTS)
+
+    dead = sub.add_parser('tombstone', help="Ẩn tin hết hạn / đã bán")
+    dead.add_argument('--ad-id', type=int, nargs='+', default=[])
+    dead.add_argument('--house-id', type=int, nargs='+', default=[])
+
+    comp = sub.add_parser('compact', help="Gộp base + delta thành version mới")
+    comp.add_argument('--new-version', default=None, help="Tên version mới (mặc định: timestamp; không dùng với --every)")
+    comp.add_argument('--min-rows', type=int, default=0, help="Chỉ compact khi delta có ít nhất N dòng")
+    comp.add_argument('--min-tombstones', type=int, default=0, help="... hoặc ít nhất N tombstone")
+    comp.add_argument('--neighbor-table', action='store_true')
+    comp.add_argument('--every', type=float, default=0, help="Chạy nền: kiểm tra mỗi N giây (0 = chạy 1 lần), luôn dùng version mới nhất")
+
+    sub.add_parser('status', help="Segments + tombstones của version")
+    return p
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'compact' and args.every and (args.version or args.new_version):
+        # Mỗi vòng phải compact version mới nhất (vừa publish) vào 1 version tên mới (timestamp)
+        parser.error("--every cannot be combined with --version or --new-version")
+    if args.command == 'append':
+        paths = sorted({path for pattern in args.inputs for path in (glob.glob(pattern) or [pattern])})
+        paths = [path for path in paths if not path.endswith('.tmp')]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            raise SystemExit(f"Input not found: {', '.join(missing)}")
+        stats = append(args.models_root, args.version, paths, args.chunk_rows, args.max_segments)
+        print(json.dumps(stats, indent=2))
+    elif args.command == 'tombstone':
+        tombstone(args.models_root, args.version, args.ad_id, args.house_id)
+    elif args.command == 'compact':
+        while True:
+            # Version mới nhất ở mỗi vòng (sau compact, version vừa publish nhận delta tiếp theo)
+            target = compact(args.models_root, args.version, args.new_version, args.min_rows, args.min_tombstones,
+                             args.neighbor_table)
+            if target is None and not args.every:
+                print("Nothing to compact")
+            if not args.every:
+                break
+            time.sleep(args.every)
+    else:
+        print(json.dumps(status(args.models_root, args.version), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,363 @@
+"""
+Ingest output của crawler (CSV / Parquet / Arrow) thành 1 version artifacts mới cho ML API
+
+Thay cho việc chạy tay 02_house_recommendation_system.ipynb: đọc từng chunk (chỉ các cột cần,
+không giữ body/address), dedupe theo ad id (giữ list_time mới nhất), lọc + tính features bằng
+phép toán mảng, fit encoders / StandardScaler incremental (partial_fit) rồi ghi
+models/<version>/ (publish atomic bằng rename, registry của API tự thấy version mới).
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/ingest_crawl.py data/chotot_region13000_*.csv
+python scripts/ingest_crawl.py data/*.parquet --version 2026-10-18_nightly --neighbor-table
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+import ml_api  # noqa: E402
+
+NUMERIC_COLUMNS = ['price', 'area', 'rooms', 'toilets', 'floors', 'lat', 'lng', 'width', 'length']
+CATEGORICAL_COLUMNS = ['district', 'ward', 'legal', 'seller_type']
+# Cột đọc từ file crawler (id/date để dedupe, title cho listing)
+INPUT_COLUMNS = ['id', 'date'] + NUMERIC_COLUMNS + CATEGORICAL_COLUMNS + ['title']
+
+ENGINEERED_COLUMNS = ['price_per_sqm', 'total_rooms', 'area_per_floor', 'distance_from_center']
+# Thứ tự giống recommendation_features.pkl hiện tại (17 features của notebook + 2 cột weighted)
+RECOMMENDATION_FEATURES = (
+    NUMERIC_COLUMNS + ENGINEERED_COLUMNS
+    + [col + '_encoded' for col in CATEGORICAL_COLUMNS]
+    + ['price_weighted', 'price_per_sqm_weighted']
+)
+# Cột của recommendation_df.pkl (thêm id để map house index -> tin đăng)
+DF_COLUMNS = ['id'] + NUMERIC_COLUMNS + ['district', 'ward', 'title'] + ENGINEERED_COLUMNS
+
+PERCENTILES = (0.01, 0.99)
+PREDICTION_ARTIFACTS = [name for name in ml_api.REQUIRED_ARTIFACTS if name.startswith('price_prediction_')]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class CategoryVocabulary:
+    """
+    Dictionary string -> code, fit dần theo từng chunk (partial_fit)
+
+    Code tạm theo thứ tự xuất hiện; finalize() đổi sang thứ tự sorted của LabelEncoder
+    cho các giá trị thực sự còn lại sau khi lọc.
+    """
+
+    def __init__(self):
+        self.index = pd.Index([], dtype=object)
+
+    def partial_fit_transform(self, values):
+        values = pd.Index(values)
+        uniques = values.unique()
+        new = uniques[self.index.get_indexer(uniques) < 0]
+        if len(new):
+            self.index = self.index.append(pd.Index(new, dtype=object))
+        return self.index.get_indexer(values).astype(np.int32)
+
+    def finalize(self, codes):
+        """(LabelEncoder đã fit, codes theo classes_) từ code tạm của các dòng được giữ"""
+        used = np.unique(codes)
+        labels = self.index.to_numpy(dtype=object)[used]
+        order = np.argsort(labels.astype(str), kind='stable')
+        remap = np.empty(len(self.index), dtype=np.int32)
+        remap[used[order]] = np.arange(len(used), dtype=np.int32)
+        encoder = LabelEncoder()
+        encoder.classes_ = labels[order]
+        return encoder, remap[codes]
+
+
+def category_strings(name, column):
+    """Giá trị categorical -> string giống notebook: df[col].fillna('Unknown').astype(str)"""
+    if name == 'legal':
+        # legal đọc từ CSV là float ('1.0') khi có NaN -> luôn format như float để chunk nào cũng giống nhau
+        values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        return np.where(np.isnan(values), 'Unknown', values.astype(str)).astype(object)
+    return column.astype(object).where(column.notna(), 'Unknown').astype(str).to_numpy(dtype=object)
+
+
+def iter_chunks(path, chunk_rows):
+    """DataFrame chunks (chỉ INPUT_COLUMNS có trong file) từ 1 file CSV / Parquet / Arrow IPC"""
+    if path.endswith('.csv'):
+        yield from pd.read_csv(
+            path, usecols=lambda col: col in INPUT_COLUMNS, chunksize=chunk_rows,
+            dtype={'title': str, 'district': str, 'ward': str, 'seller_type': str},
+        )
+        return
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+    if path.endswith('.parquet'):
+        source = pa.parquet.ParquetFile(path)
+        columns = [col for col in INPUT_COLUMNS if col in source.schema_arrow.names]
+        for batch in source.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        columns = [col for col in INPUT_COLUMNS if col in reader.schema.names]
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).select(columns).to_pandas()
+
+
+class ChunkAccumulator:
+    """Giữ các cột cần thiết của mọi dòng ở dạng mảng typed (không giữ raw DataFrame)"""
+
+    def __init__(self):
+        self.parts = {col: [] for col in ['id', 'date'] + NUMERIC_COLUMNS + ['title']}
+        self.codes = {col: [] for col in CATEGORICAL_COLUMNS}
+        self.vocabularies = {col: CategoryVocabulary() for col in CATEGORICAL_COLUMNS}
+        self.rows_read = 0
+
+    def add(self, chunk):
+        n = len(chunk)
+        self.rows_read += n
+        missing = lambda: pd.Series([np.nan] * n, index=chunk.index, dtype=np.float64)
+        for col in ['id', 'date'] + NUMERIC_COLUMNS:
+            values = pd.to_numeric(chunk[col], errors='coerce') if col in chunk.columns else missing()
+            self.parts[col].append(values.to_numpy(dtype=np.float64, na_value=np.nan))
+        titles = chunk['title'] if 'title' in chunk.columns else missing()
+        self.parts['title'].append(titles.astype(object).where(titles.notna(), None).to_numpy(dtype=object))
+        for col in CATEGORICAL_COLUMNS:
+            column = chunk[col] if col in chunk.columns else pd.Series([None] * n, dtype=object)
+            strings = category_strings(col, column)
+            self.codes[col].append(self.vocabularies[col].partial_fit_transform(strings))
+
+    def columns(self):
+        """Nối các chunk thành 1 mảng / cột (các chunk được giải phóng ngay)"""
+        columns, codes = {}, {}
+        for col in list(self.parts):
+            parts = self.parts.pop(col)
+            columns[col] = np.concatenate(parts) if parts else np.empty(0)
+        for col in list(self.codes):
+            parts = self.codes.pop(col)
+            codes[col] = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+        return columns, codes
+
+
+def dedupe_latest(ids, dates):
+    """Mask giữ 1 dòng / ad id: list_time lớn nhất (bằng nhau thì dòng sau). Dòng không có id giữ nguyên."""
+    keep = np.isnan(ids)
+    has_id = np.flatnonzero(~keep)
+    # sort theo (id, date, vị trí) -> dòng cuối của mỗi id là dòng được giữ
+    order = has_id[np.lexsort((has_id, np.nan_to_num(dates[has_id], nan=-np.inf), ids[has_id]))]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = ids[order[1:]] != ids[order[:-1]]
+    keep[order[last]] = True
+    return keep
+
+
+def clean_mask(price, area):
+    """price > 0, price trong [p1, p99], area > 0, area trong [p1, p99] (như notebook, lọc lần lượt)"""
+    keep = price > 0
+    low, high = np.quantile(price[keep], PERCENTILES)
+    keep &= (price >= low) & (price <= high)
+    keep &= area > 0
+    low, high = np.quantile(area[keep], PERCENTILES)
+    keep &= (area >= low) & (area <= high)
+    return keep
+
+
+def engineer(columns):
+    """4 features engineered của notebook 02 (trước khi điền median, như notebook)"""
+    area, lat, lng = columns['area'], columns['lat'], columns['lng']
+    columns['price_per_sqm'] = columns['price'] / area
+    columns['total_rooms'] = np.nan_to_num(columns['rooms']) + np.nan_to_num(columns['toilets'])
+    columns['area_per_floor'] = area / (np.where(np.isnan(columns['floors']), 1.0, columns['floors']) + 0.1)
+    columns['distance_from_center'] = np.sqrt(
+        (np.where(np.isnan(lat), ml_api.CENTER_LAT, lat) - ml_api.CENTER_LAT)**2
+        + (np.where(np.isnan(lng), ml_api.CENTER_LNG, lng) - ml_api.CENTER_LNG)**2
+    )
+
+
+def fill_median(values):
+    missing = np.isnan(values)
+    if missing.any():
+        values[missing] = np.median(values[~missing]) if (~missing).any() else 0.0
+    return values
+
+
+def scale_in_place(X, block_rows):
+    """StandardScaler.partial_fit theo block rồi transform từng block ghi đè vào X (không copy cả ma trận)"""
+    scaler = StandardScaler()
+    for start in range(0, len(X), block_rows):
+        scaler.partial_fit(X[start:start + block_rows])
+    for start in range(0, len(X), block_rows):
+        X[start:start + block_rows] = scaler.transform(X[start:start + block_rows])
+    return scaler
+
+
+def build_artifacts(paths, chunk_rows=100_000, block_rows=65_536, log=print):
+    """Stream files -> (X_scaled, df, scaler, encoders, stats)"""
+    stats = {'inputs': [], 'timings_s': {}}
+    start = time.perf_counter()
+    accumulator = ChunkAccumulator()
+    for path in paths:
+        before = accumulator.rows_read
+        for chunk in iter_chunks(path, chunk_rows):
+            accumulator.add(chunk)
+        stats['inputs'].append({'path': path, 'rows': accumulator.rows_read - before, 'bytes': os.path.getsize(path)})
+    columns, codes = accumulator.columns()
+    stats['rows_read'] = accumulator.rows_read
+    stats['timings_s']['read'] = time.perf_counter() - start
+    log(f"Read {accumulator.rows_read:,} rows from {len(paths)} file(s) in {stats['timings_s']['read']:.1f}s")
+
+    start = time.perf_counter()
+    keep = dedupe_latest(columns['id'], columns['date'])
+    stats['duplicates_removed'] = int((~keep).sum())
+    keep &= clean_mask(np.where(keep, columns['price'], np.nan), columns['area'])
+    rows = np.flatnonzero(keep)
+    # Thay từng cột (không giữ 2 bản của mọi cột cùng lúc)
+    for group in (columns, codes):
+        for col in group:
+            group[col] = group[col][rows]
+    stats['rows_kept'] = len(rows)
+
+    engineer(columns)
+    for col in NUMERIC_COLUMNS + ENGINEERED_COLUMNS:
+        fill_median(columns[col])
+    encoders = {}
+    for col in CATEGORICAL_COLUMNS:
+        encoders[col], columns[col + '_encoded'] = accumulator.vocabularies[col].finalize(codes[col])
+        columns[col] = encoders[col].classes_[columns[col + '_encoded']]
+    columns['price_weighted'] = columns['price']
+    columns['price_per_sqm_weighted'] = columns['price_per_sqm']
+
+    X = np.empty((len(rows), len(RECOMMENDATION_FEATURES)), dtype=np.float64)
+    for j, name in enumerate(RECOMMENDATION_FEATURES):
+        X[:, j] = columns[name]
+    X[~np.isfinite(X)] = np.nan
+    for j in range(X.shape[1]):
+        fill_median(X[:, j])
+    stats['timings_s']['transform'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scaler = scale_in_place(X, block_rows)
+    stats['timings_s']['scale'] = time.perf_counter() - start
+
+    df = pd.DataFrame({col: columns.pop(col) for col in DF_COLUMNS}, copy=False)
+    df['id'] = df['id'].astype('Int64')
+    df['price'] = df['price'].round().astype(np.int64)
+    log(f"Kept {len(rows):,} rows ({stats['duplicates_removed']:,} duplicate ads removed), "
+        f"{X.shape[1]} features")
+    return X, df, scaler, encoders, stats
+
+
+def write_version(models_root, version, base_dir, X, df, scaler, encoders, stats, neighbor_table=False, log=print,
+                  features=RECOMMENDATION_FEATURES):
+    """Ghi vào models/.staging/<version>/ rồi rename sang models/<version>/"""
+    target = f'{models_root}/{version}'
+    if os.path.exists(target):
+        raise FileExistsError(f"Model version already exists: {target}")
+    staging = f'{models_root}/.staging/{version}'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    start = time.perf_counter()
+
+    # Model dự đoán giá không train lại ở đây: link (hoặc copy) từ version gốc
+    # (kèm label_encoders.pkl của notebook 01 nếu có - encoders thật của price model)
+    for name in PREDICTION_ARTIFACTS + [ml_api.NOTEBOOK_LABEL_ENCODERS]:
+        if name == ml_api.NOTEBOOK_LABEL_ENCODERS and not os.path.exists(f'{base_dir}/{name}'):
+            continue
+        try:
+            os.link(f'{base_dir}/{name}', f'{staging}/{name}')
+        except OSError:
+            shutil.copy2(f'{base_dir}/{name}', f'{staging}/{name}')
+
+    joblib.dump(scaler, f'{staging}/recommendation_scaler.pkl')
+    joblib.dump(list(features), f'{staging}/recommendation_features.pkl')
+    joblib.dump(encoders, f'{staging}/recommendation_encoders.pkl')
+    joblib.dump(X, f'{staging}/recommendation_X_scaled.pkl')
+    joblib.dump(df, f'{staging}/recommendation_df.pkl')
+    ml_api.export_mmap_artifacts(staging, X, df)
+    if neighbor_table:
+        index = ml_api.CosineTopK(X, unit=np.load(f'{staging}/{ml_api.MMAP_DIR}/recommendation_X_unit.npy', mmap_mode='r'))
+        ml_api.NeighborTable.build(index).save(staging)
+    stats['timings_s']['write'] = time.perf_counter() - start
+
+    with open(f'{staging}/recommendation_metadata.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'created_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'n_samples': len(X),
+            'n_features': X.shape[1],
+            'features': list(features),
+            'source': 'scripts/ingest_crawl.py',
+            'base_version_dir': base_dir,
+            **stats,
+        }, f, indent=2, ensure_ascii=False)
+    os.rename(staging, target)
+    try:
+        os.rmdir(f'{models_root}/.staging')
+    except OSError:
+        pass
+    log(f"Published {target}")
+    return target
+
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Build a recommendation artifact version from crawler output.")
+    p.add_argument('inputs', nargs='+', help="CSV / .parquet / .arrow files hoặc glob pattern")
+    p.add_argument('--models-root', default=ml_api.MODELS_ROOT)
+    p.add_argument('--version', default=None, help="Tên thư mục version (mặc định: timestamp)")
+    p.add_argument('--base-version', default=None,
+                   help="Version lấy price_prediction_* (mặc định: version mới nhất)")
+    p.add_argument('--chunk-rows', type=int, default=100_000)
+    p.add_argument('--block-rows', type=int, default=65_536, help="Số dòng mỗi block khi fit/transform scaler")
+    p.add_argument('--neighbor-table', action='store_true', help="Build luôn neighbour table cho /recommend/by-id")
+    p.add_argument('--dry-run', action='store_true', help="Chỉ xử lý + báo cáo, không ghi artifacts")
+    return p
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    paths = sorted({path for pattern in args.inputs for path in (glob.glob(pattern) or [pattern])})
+    paths = [path for path in paths if not path.endswith('.tmp')]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise SystemExit(f"Input not found: {', '.join(missing)}")
+
+    start = time.perf_counter()
+    X, df, scaler, encoders, stats = build_artifacts(paths, args.chunk_rows, args.block_rows)
+
+    if not args.dry_run:
+        registry = ml_api.ModelRegistry(args.models_root)
+        base_version = args.base_version or registry.latest_version()
+        if base_version is None:
+            raise SystemExit(f"No model version with price_prediction_* artifacts in {args.models_root}")
+        version = args.version or datetime.now().strftime('%Y-%m-%d_%H%M%S')
+        write_version(args.models_root, version, registry.version_path(base_version),
+                      X, df, scaler, encoders, stats, neighbor_table=args.neighbor_table)
+
+    stats['timings_s']['total'] = time.perf_counter() - start
+    stats['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps({
+        'rows_read': stats['rows_read'],
+        'duplicates_removed': stats['duplicates_removed'],
+        'rows_kept': stats['rows_kept'],
+        'timings_s': {name: round(value, 2) for name, value in stats['timings_s'].items()},
+        'peak_rss_mb': round(stats['peak_rss_mb'], 1),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,258 @@
+"""
+Listing bundle: bảng nhà dạng cột nhị phân thay cho recommendation_houses.json
+
+<name>.bin chứa các segment nối tiếp nhau (little-endian, mỗi segment căn 8 byte để bên đọc
+tạo Float64Array / Int32Array trực tiếp trên buffer, không copy):
+- Cột số: float64 / float32, giá trị thiếu = NaN
+- Cột string: dictionary như StringTable của ml_api - codes int32 (-1 = null) + các giá trị
+  distinct trong 1 blob UTF-8, giá trị thứ i là data[offsets[i]:offsets[i + 1]] (offsets uint32)
+
+<name>.manifest.json mô tả n_rows, dtype / offset / length và sha256 của từng segment.
+backend/ml/listingBundle.js là bên đọc của Node.
+
+Usage (từ thư mục gốc hoặc scripts/) - so sánh size + thời gian load với JSON:
+python scripts/listing_bundle.py
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUNDLE_FORMAT = 'listing-bundle'
+BUNDLE_VERSION = 1
+BUNDLE_NAME = 'recommendation_houses'
+ALIGNMENT = 8
+# Cột của recommendation_houses.json -> dtype trong bundle (float64 giữ nguyên giá / toạ độ,
+# float32 đủ cho số phòng / kích thước)
+NUMERIC_DTYPES = {
+    'id': 'float64',
+    'price': 'float64',
+    'area': 'float64',
+    'rooms': 'float32',
+    'toilets': 'float32',
+    'floors': 'float32',
+    'lat': 'float64',
+    'lng': 'float64',
+    'width': 'float32',
+    'length': 'float32',
+}
+STRING_COLUMNS = ['district', 'ward', 'title']
+ESSENTIAL_COLUMNS = ['id', 'price', 'area', 'rooms', 'toilets', 'floors', 'district', 'ward', 'title',
+                     'lat', 'lng', 'width', 'length']
+
+
+def bundle_paths(directory, name=BUNDLE_NAME):
+    return f'{directory}/{name}.bin', f'{directory}/{name}.manifest.json'
+
+
+def string_dictionary(values):
+    """values (object, None / NaN = null) -> (codes int32, offsets uint32, blob UTF-8)"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    encoded = [str(value).encode('utf-8') for value in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return codes.astype(np.int32), offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def write_listing_bundle(df, directory, name=BUNDLE_NAME):
+    """
+    Ghi các cột của ESSENTIAL_COLUMNS có trong df thành <name>.bin + <name>.manifest.json
+
+    Returns: manifest (dict)
+    """
+    bin_path, manifest_path = bundle_paths(directory, name)
+    segments = []
+    columns = []
+    size = 0
+
+    def add_segment(array):
+        nonlocal size
+        data = np.ascontiguousarray(array).astype(array.dtype.newbyteorder('<'), copy=False).tobytes()
+        padding = -size % ALIGNMENT
+        segments.append(b'\0' * padding + data)
+        size += padding
+        segment = {"dtype": np.dtype(array.dtype).name, "offset": size, "length": len(data),
+                   "sha256": hashlib.sha256(data).hexdigest()}
+        size += len(data)
+        return segment
+
+    for col in ESSENTIAL_COLUMNS:
+        if col not in df.columns:
+            continue
+        if col in STRING_COLUMNS:
+            codes, offsets, blob = string_dictionary(df[col].to_numpy(dtype=object))
+            columns.append({"name": col, "kind": "string", "n_values": len(offsets) - 1,
+                            "codes": add_segment(codes), "offsets": add_segment(offsets), "data": add_segment(blob)})
+        else:
+            values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=NUMERIC_DTYPES[col])
+            columns.append({"name": col, "kind": "numeric", "values": add_segment(values)})
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "byte_order": "little",
+        "file": os.path.basename(bin_path),
+        "size": size,
+        "n_rows": len(df),
+        "columns": columns,
+    }
+    # Ghi file tạm rồi rename: bên đọc không bao giờ thấy .bin mới với manifest cũ
+    tmp_bin, tmp_manifest = bin_path + '.tmp', manifest_path + '.tmp'
+    with open(tmp_bin, 'wb') as f:
+        for segment in segments:
+            f.write(segment)
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_bin, bin_path)
+    os.replace(tmp_manifest, manifest_path)
+    return manifest
+
+
+def read_segment(buffer, segment, verify):
+    data = buffer[segment["offset"]:segment["offset"] + segment["length"]]
+    if verify and hashlib.sha256(data).hexdigest() != segment["sha256"]:
+        raise ValueError(f"Checksum mismatch in segment at offset {segment['offset']}")
+    return np.frombuffer(data, dtype=np.dtype(segment["dtype"]).newbyteorder('<'))
+
+
+def read_listing_bundle(directory, name=BUNDLE_NAME, verify=True):
+    """
+    Bundle -> {column: mảng NumPy}; cột string trả về mảng object (None = null)
+
+    verify=True kiểm tra size + sha256 từng segment (ValueError nếu lệch).
+    """
+    bin_path, manifest_path = bundle_paths(directory, name)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported listing bundle: {manifest.get('format')} v{manifest.get('version')}")
+    with open(bin_path, 'rb') as f:
+        buffer = memoryview(f.read())
+    if len(buffer) != manifest["size"]:
+        raise ValueError(f"{bin_path} has {len(buffer)} bytes, manifest says {manifest['size']}")
+
+    columns = {}
+    for column in manifest["columns"]:
+        if column["kind"] == "numeric":
+            columns[column["name"]] = read_segment(buffer, column["values"], verify)
+            continue
+        codes = read_segment(buffer, column["codes"], verify)
+        offsets = read_segment(buffer, column["offsets"], verify)
+        data = bytes(read_segment(buffer, column["data"], verify))
+        vocab = np.array([data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)] + [None],
+                         dtype=object)
+        columns[column["name"]] = vocab[codes]  # code -1 -> None (phần tử cuối)
+    return columns
+
+
+# ============================================================================
+# BENCHMARK: JSON vs bundle
+# ============================================================================
+
+NODE_LOAD_SCRIPT = r"""
+const fs = require('fs');
+const { loadListingBundleSync } = require(process.argv[1]);
+const [dir, mode] = process.argv.slice(2);
+const start = process.hrtime.bigint();
+const ms = () => Number(process.hrtime.bigint() - start) / 1e6;
+if (mode === 'json') {
+  JSON.parse(fs.readFileSync(`${dir}/recommendation_houses.json`, 'utf8'));
+  console.log(JSON.stringify({ load: ms(), records: ms() }));
+} else {
+  const bundle = loadListingBundleSync(dir, 'recommendation_houses', { verify: mode === 'bundle' });
+  const load = ms();
+  bundle.toRecords();
+  console.log(JSON.stringify({ load, records: ms() }));
+}
+"""
+
+
+def write_houses_json(df, path):
+    """recommendation_houses.json như convert_to_onnx.py cũ (NaN -> null để Node parse được)"""
+    records = df[[col for col in ESSENTIAL_COLUMNS if col in df.columns]].to_dict(orient='records')
+    records = [{key: (None if isinstance(value, float) and value != value else value) for key, value in record.items()}
+               for record in records]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, indent=2, ensure_ascii=False)
+
+
+def best_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def node_load_ms(directory, mode, repeat):
+    """(ms tới khi có cột, ms tới khi có mảng record như JSON) trong 1 process node mới (cold)"""
+    loader = os.path.join(ROOT_DIR, 'backend', 'ml', 'listingBundle.js')
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run(['node', '-e', NODE_LOAD_SCRIPT, loader, directory, mode],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+    return min(r["load"] for r in results), min(r["records"] for r in results)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Compare the binary listing bundle with recommendation_houses.json.")
+    p.add_argument('--models-dir', default=os.path.join(ROOT_DIR, 'models'))
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--scale', type=int, default=1, help="Nhân số dòng (lặp lại recommendation_df) để đo bảng lớn hơn")
+    args = p.parse_args(argv)
+
+    df = joblib.load(f'{args.models_dir}/recommendation_df.pkl')
+    if args.scale > 1:
+        df = pd.concat([df] * args.scale, ignore_index=True)
+    has_node = shutil.which('node') is not None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = f'{tmp}/{BUNDLE_NAME}.json'
+        write_houses_json(df, json_path)
+        write_listing_bundle(df, tmp)
+        bin_path, manifest_path = bundle_paths(tmp)
+
+        # Parity: bundle đọc lại phải bằng JSON
+        with open(json_path, encoding='utf-8') as f:
+            records = json.load(f)
+        columns = read_listing_bundle(tmp)
+        for col, values in columns.items():
+            expected = [record[col] for record in records]
+            if values.dtype == object:
+                assert list(values) == expected, col
+            else:
+                expected = np.array([np.nan if v is None else v for v in expected], dtype=values.dtype)
+                assert np.array_equal(values, expected, equal_nan=True), col
+
+        json_mb = os.path.getsize(json_path) / 1e6
+        bundle_mb = (os.path.getsize(bin_path) + os.path.getsize(manifest_path)) / 1e6
+        print(f"{len(df):,} houses, {len(columns)} columns")
+        print(f"{'':<22} {'size MB':>8} {'python ms':>10} {'node ms':>8} {'node records ms':>16}")
+        for label, size_mb, load, mode in [
+            ("recommendation JSON", json_mb, lambda: json.load(open(json_path, encoding='utf-8')), 'json'),
+            ("bundle (verified)", bundle_mb, lambda: read_listing_bundle(tmp), 'bundle'),
+            ("bundle (no checksum)", bundle_mb, lambda: read_listing_bundle(tmp, verify=False), 'bundle-unverified'),
+        ]:
+            node = f"{'-':>8} {'-':>16}"
+            if has_node:
+                load_ms, records_ms = node_load_ms(tmp, mode, args.repeat)
+                node = f"{load_ms:>8.1f} {records_ms:>16.1f}"
+            print(f"{label:<22} {size_mb:>8.2f} {best_ms(load, args.repeat):>10.1f} {node}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,445 @@
+"""
+Load test tất cả endpoint của ML API in-process (httpx + ASGITransport, không cần server / mạng)
+
+Models là fixture tổng hợp, không đọc models/: listing + request được sinh theo phân phối district / ward
+của dataset (scripts/load_test_distribution.json), price model là RandomForest cùng kích thước model thật
+(30 cây, depth 8) train trên dữ liệu đó. Fixture được ghi vào thư mục tạm bằng ingest_crawl.write_version
+rồi load qua ModelRegistry như production (validate, mmap, compiled engine).
+
+Mỗi mức concurrency chạy cùng 1 mix request (seed cố định) và in throughput + p50/p95/p99 theo endpoint;
+kết quả lưu JSON (kèm git commit + config) để diff giữa các commit.
+
+Usage (từ thư mục gốc hoặc scripts/):
+python scripts/load_test_ml_api.py --concurrency 1 8 32 --output load_test.json
+python scripts/load_test_ml_api.py --compare load_test_main.json   # so với kết quả của commit trước
+python scripts/load_test_ml_api.py --write-distribution             # cập nhật phân phối từ models/mmap
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_DIR)
+
+import ingest_crawl  # noqa: E402  (chdir về thư mục gốc, import ml_api)
+import ml_api  # noqa: E402
+
+DISTRIBUTION_PATH = os.path.join(SCRIPTS_DIR, 'load_test_distribution.json')
+# Tỉ lệ request theo endpoint (label = route template như /metrics)
+ENDPOINT_MIX = {
+    '/predict': 0.45,
+    '/recommend/by-features': 0.25,
+    '/recommend/by-id/{house_id}': 0.2,
+    '/predict/batch': 0.05,
+    '/health': 0.05,
+}
+PREDICT_BATCH_ITEMS = 32
+OPTIONAL_FIELD_DROP_RATE = 0.3  # request thiếu lat / lng / toilets / ... -> API điền default
+FILTER_RATE = 0.2  # /recommend/by-features có filters
+LEGAL_VALUES = ['Đã có sổ', 'Đang chờ sổ', 'Giấy tờ khác']
+SELLER_TYPES = ['Cá nhân', 'Môi giới']
+# Giống price model đang serve (RandomForestRegressor, xem /health -> prediction_engine)
+PRICE_MODEL_PARAMS = {'n_estimators': 30, 'max_depth': 8}
+PRICE_MODEL_TRAIN_ROWS = 5000
+PREDICTION_FEATURES = [
+    'area', 'rooms', 'toilets', 'floors', 'lat', 'lng', 'width', 'length', 'total_rooms', 'toilet_room_ratio',
+    'area_per_floor', 'has_dimensions', 'distance_from_center', 'width_length_ratio', 'total_floor_area',
+    'rooms_per_sqm', 'district_encoded', 'ward_encoded', 'legal_encoded', 'seller_type_encoded',
+]
+
+
+# ============================================================================
+# DISTRICT / WARD DISTRIBUTION
+# ============================================================================
+
+def write_distribution(mmap_dir, path=DISTRIBUTION_PATH):
+    """Phân phối (district, ward) + toạ độ / diện tích / giá theo district từ listing table mmap của models/"""
+    table = ml_api.ListingTable.load(mmap_dir)
+    rows = np.arange(table.n_rows)
+    df = pd.DataFrame({
+        'district': table.take_strings('district', rows),
+        'ward': table.take_strings('ward', rows),
+        'lat': table.numeric['lat'],
+        'lng': table.numeric['lng'],
+        'log_area': np.log(table.numeric['area']),
+        'log_price_per_sqm': np.log(table.numeric['price'] / table.numeric['area']),
+    }).dropna(subset=['district'])
+    df['ward'] = df['ward'].fillna('Unknown')
+
+    districts = {}
+    for district, group in df.groupby('district', sort=True):
+        coords = group.dropna(subset=['lat', 'lng'])
+        lat, lng = coords['lat'].median(), coords['lng'].median()
+        districts[district] = {
+            'count': len(group),
+            'lat': round(float(lat), 6),
+            'lng': round(float(lng), 6),
+            # median độ lệch toạ độ quanh tâm district
+            'spread': round(float(np.median(np.hypot(coords['lat'] - lat, coords['lng'] - lng))), 5),
+            'log_area': [round(float(group['log_area'].mean()), 4), round(float(group['log_area'].std(ddof=0)), 4)],
+            'log_price_per_sqm': [round(float(group['log_price_per_sqm'].mean()), 4),
+                                  round(float(group['log_price_per_sqm'].std(ddof=0)), 4)],
+            'wards': {str(ward): int(count) for ward, count in group['ward'].value_counts().sort_index().items()},
+        }
+    distribution = {'source': os.path.relpath(mmap_dir), 'n_houses': len(df), 'districts': districts}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(distribution, f, indent=1, ensure_ascii=False)
+    return distribution
+
+
+def load_distribution(path=DISTRIBUTION_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sample_houses(distribution, n, rng):
+    """n nhà tổng hợp: (district, ward) theo tần suất của dataset, toạ độ / diện tích / giá theo district"""
+    pairs, weights = [], []
+    for district, stats in distribution['districts'].items():
+        for ward, count in stats['wards'].items():
+            pairs.append((district, ward))
+            weights.append(count)
+    weights = np.asarray(weights, dtype=np.float64)
+    chosen = rng.choice(len(pairs), size=n, p=weights / weights.sum())
+    district = np.array([pairs[i][0] for i in chosen], dtype=object)
+    ward = np.array([pairs[i][1] for i in chosen], dtype=object)
+    stats = [distribution['districts'][d] for d in district]
+
+    def per_district(key, index=None):
+        return np.array([s[key] if index is None else s[key][index] for s in stats])
+
+    area = np.clip(np.round(np.exp(rng.normal(per_district('log_area', 0), per_district('log_area', 1))), 1), 15, 600)
+    price_per_sqm = np.exp(rng.normal(per_district('log_price_per_sqm', 0), per_district('log_price_per_sqm', 1)))
+    rooms = np.clip(np.round(area / 20 + rng.normal(1, 1, n)), 1, 10)
+    width = np.round(rng.uniform(3, 8, n), 1)
+    return {
+        'district': district,
+        'ward': ward,
+        'lat': per_district('lat') + rng.normal(0, 1, n) * per_district('spread'),
+        'lng': per_district('lng') + rng.normal(0, 1, n) * per_district('spread'),
+        'area': area,
+        'price': np.maximum(np.round(area * price_per_sqm, -8), 1e8),
+        'rooms': rooms,
+        'toilets': np.clip(rooms + rng.integers(-1, 2, n), 1, 10).astype(np.float64),
+        'floors': rng.integers(1, 8, n).astype(np.float64),
+        'width': width,
+        'length': np.round(np.clip(area / width, 5, 40), 1),
+        'legal': rng.choice(LEGAL_VALUES, size=n).astype(object),
+        'seller_type': rng.choice(SELLER_TYPES, size=n).astype(object),
+    }
+
+
+# ============================================================================
+# SYNTHETIC MODEL FIXTURE
+# ============================================================================
+
+def write_price_artifacts(directory, houses, n_train, seed):
+    """price_prediction_* train trên nhà tổng hợp, encode bằng chính PredictionEncoder của API"""
+    encoders = {col: LabelEncoder().fit(np.append(houses[col], 'Unknown').astype(str))
+                for col in ml_api.PREDICT_CATEGORICAL_INPUTS}
+    rows = slice(0, n_train)
+    columns = {name: np.asarray(values[rows]) for name, values in houses.items() if name != 'price'}
+    columns['has_dimensions'] = np.ones(len(columns['area']))
+    X = ml_api.PredictionEncoder(PREDICTION_FEATURES, encoders).transform_many(
+        ml_api.engineer_prediction_features(columns)
+    )
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(**PRICE_MODEL_PARAMS, random_state=seed, n_jobs=1)
+    model.fit(scaler.transform(X), houses['price'][rows])
+
+    os.makedirs(directory, exist_ok=True)
+    joblib.dump(model, f'{directory}/price_prediction_model.pkl')
+    joblib.dump(scaler, f'{directory}/price_prediction_scaler.pkl')
+    joblib.dump(PREDICTION_FEATURES, f'{directory}/price_prediction_features.pkl')
+    joblib.dump(encoders, f'{directory}/price_prediction_encoders.pkl')
+
+
+def build_fixture(directory, distribution, n_houses, seed=0, neighbor_table=False):
+    """
+    Ghi 1 version models tổng hợp vào directory/models/synthetic/
+
+    Returns: thư mục models root (cho ModelRegistry)
+    """
+    rng = np.random.default_rng(seed)
+    houses = sample_houses(distribution, n_houses, rng)
+    base_dir = f'{directory}/base'
+    write_price_artifacts(base_dir, houses, min(n_houses, PRICE_MODEL_TRAIN_ROWS), seed)
+
+    # Recommendation artifacts như ingest_crawl.build_artifacts
+    columns = {name: np.asarray(values, dtype=np.float64) for name, values in houses.items()
+               if name in ingest_crawl.NUMERIC_COLUMNS}
+    ingest_crawl.engineer(columns)
+    encoders = {}
+    for col in ingest_crawl.CATEGORICAL_COLUMNS:
+        encoders[col] = LabelEncoder().fit(houses[col].astype(str))
+        columns[col] = houses[col]
+        columns[col + '_encoded'] = encoders[col].transform(houses[col].astype(str))
+    columns['price_weighted'] = columns['price']
+    columns['price_per_sqm_weighted'] = columns['price_per_sqm']
+    X = np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in ingest_crawl.RECOMMENDATION_FEATURES])
+    scaler = StandardScaler().fit(X)
+    X = scaler.transform(X)
+
+    columns['id'] = np.arange(150_000_000, 150_000_000 + n_houses)
+    columns['title'] = np.array([f"Bán nhà {ward}, {district} {area:g}m2"
+                                 for district, ward, area in zip(houses['district'], houses['ward'], houses['area'])],
+                                dtype=object)
+    df = pd.DataFrame({col: columns[col] for col in ingest_crawl.DF_COLUMNS})
+    df['price'] = df['price'].round().astype(np.int64)
+
+    models_root = f'{directory}/models'
+    ingest_crawl.write_version(models_root, 'synthetic', base_dir, X, df, scaler, encoders, {'timings_s': {}},
+                               neighbor_table=neighbor_table, log=lambda *args: None)
+    return models_root
+
+
+# ============================================================================
+# REQUEST MIX
+# ============================================================================
+
+def optional(value, rng):
+    return None if rng.random() < OPTIONAL_FIELD_DROP_RATE else value
+
+
+def predict_payload(houses, i, rng):
+    payload = {
+        "area": float(houses['area'][i]),
+        "rooms": optional(float(houses['rooms'][i]), rng),
+        "toilets": optional(float(houses['toilets'][i]), rng),
+        "floors": optional(float(houses['floors'][i]), rng),
+        "lat": optional(round(float(houses['lat'][i]), 6), rng),
+        "lng": optional(round(float(houses['lng'][i]), 6), rng),
+        "district": houses['district'][i],
+        "ward": optional(houses['ward'][i], rng),
+        "legal": optional(houses['legal'][i], rng),
+    }
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def recommend_payload(houses, i, rng):
+    payload = {
+        "price": float(houses['price'][i]),
+        "area": float(houses['area'][i]),
+        "rooms": optional(float(houses['rooms'][i]), rng),
+        "district": optional(houses['district'][i], rng),
+        "n_recommendations": int(rng.choice([5, 10, 20])),
+    }
+    if rng.random() < FILTER_RATE:
+        payload["filters"] = {"district": houses['district'][i], "price_max": float(houses['price'][i]) * 1.3}
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def sample_requests(distribution, n, n_houses, seed):
+    """
+    n request theo ENDPOINT_MIX, payload sinh từ phân phối district / ward (khác seed với fixture)
+
+    Returns: list (endpoint label, method, path, json payload | None)
+    """
+    rng = np.random.default_rng(seed)
+    houses = sample_houses(distribution, n * PREDICT_BATCH_ITEMS, rng)
+    labels = list(ENDPOINT_MIX)
+    weights = np.array([ENDPOINT_MIX[label] for label in labels])
+    requests = []
+    for k, choice in enumerate(rng.choice(len(labels), size=n, p=weights / weights.sum())):
+        label, i = labels[choice], k * PREDICT_BATCH_ITEMS
+        if label == '/predict':
+            requests.append((label, 'POST', '/predict', predict_payload(houses, i, rng)))
+        elif label == '/predict/batch':
+            items = [predict_payload(houses, i + j, rng) for j in range(PREDICT_BATCH_ITEMS)]
+            requests.append((label, 'POST', '/predict/batch', {"items": items}))
+        elif label == '/recommend/by-features':
+            requests.append((label, 'POST', '/recommend/by-features', recommend_payload(houses, i, rng)))
+        elif label == '/recommend/by-id/{house_id}':
+            house_id, limit = int(rng.integers(0, n_houses)), int(rng.choice([5, 10, 20]))
+            requests.append((label, 'GET', f'/recommend/by-id/{house_id}?limit={limit}', None))
+        else:
+            requests.append((label, 'GET', label, None))
+    return requests
+
+
+# ============================================================================
+# RUN
+# ============================================================================
+
+async def run_level(requests, concurrency):
+    """
+    Gửi requests bằng `concurrency` client đồng thời (cùng event loop với app)
+
+    Returns: (giây, list (label, latency ms, status))
+    """
+    import httpx
+
+    transport = httpx.ASGITransport(app=ml_api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+        pending = iter(requests)
+        results = []
+
+        async def worker():
+            for label, method, path, payload in pending:
+                start = time.perf_counter()
+                response = await client.request(method, path, json=payload)
+                results.append((label, (time.perf_counter() - start) * 1000, response.status_code))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start, results
+
+
+def summarize(seconds, results):
+    """Throughput + percentiles theo endpoint (và '*' = tất cả)"""
+    groups = {'*': results}
+    for result in results:
+        groups.setdefault(result[0], []).append(result)
+    summary = {}
+    for label, group in sorted(groups.items()):
+        latencies = np.array([latency for _, latency, _ in group])
+        summary[label] = {
+            "requests": len(group),
+            "errors": sum(1 for _, _, status in group if status >= 400),
+            "throughput_rps": round(len(group) / seconds, 1),
+            "mean_ms": round(float(latencies.mean()), 3),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "max_ms": round(float(latencies.max()), 3),
+        }
+    return summary
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                                text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], check=True,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_level(level):
+    print(f"\n--- concurrency {level['concurrency']}: {level['requests']:,} requests in {level['seconds']:.2f}s ---")
+    print(f"{'endpoint':<30} {'n':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, row in level['endpoints'].items():
+        print(f"{label:<30} {row['requests']:>6} {row['errors']:>4} {row['throughput_rps']:>8,.0f} "
+              f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+
+def print_comparison(old, new):
+    """% thay đổi throughput / p95 / p99 so với 1 file kết quả cũ (cùng concurrency + endpoint)"""
+    print(f"\n--- vs {old['meta'].get('commit')} ---")
+    for key in ('houses', 'requests_per_level', 'seed', 'neighbor_table', 'cpu_count'):
+        if old['meta'].get(key) != new['meta'].get(key):
+            print(f"warning: {key} differs ({old['meta'].get(key)} -> {new['meta'].get(key)}), results not comparable")
+    print(f"{'clients':>7} {'endpoint':<30} {'req/s':>8} {'p95':>8} {'p99':>8}")
+    old_levels = {level['concurrency']: level for level in old['levels']}
+
+    def change(before, after):
+        return f"{(after - before) / before * 100:+7.1f}%" if before else f"{'-':>8}"
+
+    for level in new['levels']:
+        previous = old_levels.get(level['concurrency'])
+        if previous is None:
+            continue
+        for label, row in level['endpoints'].items():
+            before = previous['endpoints'].get(label)
+            if before is not None:
+                print(f"{level['concurrency']:>7} {label:<30} {change(before['throughput_rps'], row['throughput_rps'])} "
+                      f"{change(before['p95_ms'], row['p95_ms'])} {change(before['p99_ms'], row['p99_ms'])}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="In-process load test of all ML API endpoints on a synthetic model fixture.")
+    p.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128], help="Số client đồng thời")
+    p.add_argument('--requests', type=int, default=2000, help="Số request mỗi mức concurrency")
+    p.add_argument('--warmup', type=int, default=200)
+    p.add_argument('--houses', type=int, default=20_000, help="Số nhà của fixture")
+    p.add_argument('--neighbor-table', action='store_true', help="Fixture có precomputed neighbour table")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--output', default=None, help="File JSON kết quả (mặc định: load_test_<commit>.json)")
+    p.add_argument('--compare', default=None, help="File JSON của 1 lần chạy trước để so sánh")
+    p.add_argument('--distribution', default=DISTRIBUTION_PATH)
+    p.add_argument('--write-distribution', nargs='?', const=f'{ml_api.MODELS_ROOT}/{ml_api.MMAP_DIR}',
+                   metavar='MMAP_DIR', help="Ghi lại --distribution từ listing table mmap rồi thoát")
+    args = p.parse_args(argv)
+
+    if args.write_distribution:
+        distribution = write_distribution(args.write_distribution, args.distribution)
+        n_wards = sum(len(stats['wards']) for stats in distribution['districts'].values())
+        print(f"{args.distribution}: {len(distribution['districts'])} districts, {n_wards} (district, ward) pairs, "
+              f"{distribution['n_houses']:,} houses")
+        return 0
+
+    distribution = load_distribution(args.distribution)
+    commit, dirty = git_commit()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        ml_api.model_registry = ml_api.ModelRegistry(build_fixture(tmp, distribution, args.houses, args.seed,
+                                                                   args.neighbor_table))
+        fixture_seconds = time.perf_counter() - start
+        models = ml_api.model_registry.load()
+
+        warmup = sample_requests(distribution, args.warmup, args.houses, args.seed + 1)
+        requests = sample_requests(distribution, args.requests, args.houses, args.seed + 2)
+        levels = []
+        for concurrency in args.concurrency:
+            # Mọi mức concurrency bắt đầu với cache rỗng (cùng request list -> không hit từ lần chạy trước)
+            ml_api.prediction_cache.clear()
+            asyncio.run(run_level(warmup, min(concurrency, len(warmup))))
+            ml_api.prediction_cache.clear()
+            seconds, results = asyncio.run(run_level(requests, concurrency))
+            level = {"concurrency": concurrency, "seconds": round(seconds, 3), "requests": len(results),
+                     "endpoints": summarize(seconds, results)}
+            levels.append(level)
+            print_level(level)
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "created_at": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "houses": args.houses,
+            "neighbor_table": args.neighbor_table,
+            "requests_per_level": args.requests,
+            "seed": args.seed,
+            "mix": ENDPOINT_MIX,
+            "fixture_seconds": round(fixture_seconds, 2),
+            "model_load_seconds": round(models.load_seconds, 3),
+            "prediction_engine": getattr(models.prediction_engine, 'name', 'sklearn'),
+            "recommendation_index": models.recommendation_index.name,
+            "inference_threads": ml_api.inference_executor.max_workers,
+            "coalesce_max_batch": ml_api.prediction_batcher.max_batch,
+            "coalesce_wait_ms": ml_api.prediction_batcher.wait_ms,
+            "prediction_cache_enabled": ml_api.prediction_cache.enabled,
+        },
+        "levels": levels,
+    }
+    output = args.output or f"load_test_{commit or 'local'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())